@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from mts.core.handler import DBHandler
+
+SQL_CREATE = 'CREATE TABLE tdu (timestamp VARCHAR(16) PRIMARY KEY, m1 INT, m2 INT, m3 INT)'
+FIELDS_TDU = {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT', 'm2': 'INT', 'm3': 'INT'}
+KEYS = list(FIELDS_TDU.keys())
+
+
+def inline_insert(conn, rows):
+    # DBHandler.add原有的方式：取值内联进SQL，每一行都是一条新语句，需要重新解析
+    for row in rows:
+        values = "', '".join([str(value) for value in row])
+        conn.execute("INSERT OR IGNORE INTO tdu (timestamp, m1, m2, m3) VALUES ('{}')".format(values))
+
+
+def param_insert(conn, rows):
+    for row in rows:
+        conn.execute('INSERT OR IGNORE INTO tdu (timestamp, m1, m2, m3) VALUES (?, ?, ?, ?)', row)
+
+
+def inline_query(conn, keys):
+    for key in keys:
+        conn.execute("SELECT * FROM tdu WHERE timestamp = '{}'".format(key)).fetchall()
+
+
+def param_query(conn, keys):
+    for key in keys:
+        conn.execute('SELECT * FROM tdu WHERE timestamp = ?', (key,)).fetchall()
+
+
+def handler_insert(db, rows):
+    # 与sqlite3的写法一致，全部写入后只提交一次
+    with db.transaction():
+        for row in rows:
+            db.add(dict(zip(KEYS, row)), 'tdu')
+
+
+def handler_query(db, keys):
+    for key in keys:
+        db.query('tdu', None, 'timestamp = ?', (key,))
+
+
+def report(name, count, cost):
+    print('{0:<32}{1:>10} rows {2:>10.3f} s {3:>14,.0f} rows/s'.format(name, count, cost, count / cost))
+
+
+def bench(name, func, rows, cached_statements, keys=None):
+    # 原生sqlite3作为基线；keys为None时测写入，否则在写入rows后测单行查询
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'bench.db'), cached_statements=cached_statements)
+        conn.execute(SQL_CREATE)
+        if keys is not None:
+            param_insert(conn, rows)
+            conn.commit()
+        start = time.perf_counter()
+        func(conn, rows if keys is None else keys)
+        conn.commit()
+        cost = time.perf_counter() - start
+        conn.close()
+    report(name, len(rows if keys is None else keys), cost)
+
+
+def bench_handler(name, func, db, data):
+    start = time.perf_counter()
+    func(db, data)
+    cost = time.perf_counter() - start
+    report(name, len(data), cost)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rows = [('{0}.000'.format(1612022400 + i), i, i * 2, i * 3) for i in range(n)]
+    # 单行查询逐次返回DataFrame，取较少的行数
+    keys = [row[0] for row in rows[::max(n // 20000, 1)]]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print('insert')
+        bench('sqlite3 inline SQL', inline_insert, rows, 256)
+        bench('sqlite3 ? (no cache)', param_insert, rows, 0)
+        bench('sqlite3 ? (cache=256)', param_insert, rows, 256)
+        db = DBHandler('sqlite://' + os.path.join(tmp_dir, 'handler.db'))
+        db.init_table('tdu', FIELDS_TDU)
+        bench_handler('DBHandler.add', handler_insert, db, rows)
+        print('query')
+        bench('sqlite3 inline SQL', inline_query, rows, 256, keys)
+        bench('sqlite3 ? (cache=256)', param_query, rows, 256, keys)
+        bench_handler('DBHandler.query', handler_query, db, keys)
+        db.disconnect()
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import tempfile
+from mts.commons.const import *
+from mts.core.handler import DBHandler
+from mts.core.datamodel import DataDictionary
+from mts.core.id import DataDictionaryId
+
+
+def frame_map_oid(dd, desc):
+    # 原有的方式：复制整个字典后逐行过滤
+    res = dd._data.copy()
+    res = res[res[FIELD_DESC].isin([desc])]
+    res = res[FIELD_DDID].str[1:].tolist()
+    return res[0] if 1 == len(res) else None
+
+
+def bench(name, func, dd, data):
+    start = time.perf_counter()
+    for item in data:
+        func(dd, item)
+    cost = time.perf_counter() - start
+    print('{0:<24}{1:>10} lookups {2:>10.3f} s {3:>14,.0f} lookups/s'.format(name, len(data), cost, len(data) / cost))
+
+
+def bench_many(name, func, data):
+    # 整列一次映射（首次调用含查找表的构建）
+    for label in ['first', 'cached']:
+        start = time.perf_counter()
+        func(data)
+        cost = time.perf_counter() - start
+        print('{0:<24}{1:>10} lookups {2:>10.3f} s {3:>14,.0f} lookups/s'.format(
+            name + ' (' + label + ')', len(data), cost, len(data) / cost))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DBHandler('sqlite://' + os.path.join(tmp_dir, 'bench.db'))
+        db.init_table('dd_51', FIELDS_DD)
+        rows = []
+        for i in range(n):
+            ddid = DataDictionaryId(dd_type=DD_TYPE_OWNER, service_id='51')
+            rows.append({FIELD_DDID: str(ddid), FIELD_DESC: 'owner_' + str(i), FIELD_OID_MASK: ddid.oid + MASK_DEFAULT})
+        db.add_many(rows, 'dd_51')
+        dd = DataDictionary('51')
+        descs = [row[FIELD_DESC] for row in rows[::max(n // 1000, 1)]]
+        oids = [row[FIELD_DDID][1:] for row in rows[::max(n // 1000, 1)]]
+        bench('frame filter map_oid', frame_map_oid, dd, descs[:100])
+        bench('map_oid', DataDictionary.map_oid, dd, descs)
+        bench('map_desc', DataDictionary.map_desc, dd, oids)
+        batch = [row[FIELD_DESC] for row in rows] + ['missing']
+        bench_many('map_oid_many', lambda data: dd.map_oid_many(data, DD_TYPE_OWNER), batch)
+        bench_many('map_desc_many', dd.map_desc_many, [row[FIELD_DDID][1:] for row in rows])
+        db.disconnect()
@@ -0,0 +1,31 @@
+import sys
+import time
+from mts.commons import hex_str
+from mts.commons.const import OID_LEN
+from mts.core.id import ObjectId
+
+
+def legacy_parse(oid: str):
+    # ObjectId(oid)原有的解析方式：unpack后经由moment及pack重新生成
+    service_code, last_ts, pid_code, sequence = ObjectId.unpack(oid)
+    return ObjectId.pack(service_code, ObjectId.timestamp(last_ts), sequence)
+
+
+def bench(name, func, data):
+    start = time.perf_counter()
+    for item in data:
+        func(item)
+    cost = time.perf_counter() - start
+    print('{0:<24}{1:>10} ids {2:>10.3f} s {3:>14,.0f} ids/s'.format(name, len(data), cost, len(data) / cost))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    oids = [hex_str(oid, OID_LEN) for oid in ObjectId.pack_many(41, n, True)]
+    bench('legacy (pack/moment)', legacy_parse, oids[:min(n, 100000)])
+    bench('ObjectId(str)', ObjectId, oids)
+    bench('ObjectId.from_str', ObjectId.from_str, oids)
+    start = time.perf_counter()
+    ObjectId.validate_array(oids)
+    cost = time.perf_counter() - start
+    print('{0:<24}{1:>10} ids {2:>10.3f} s {3:>14,.0f} ids/s'.format('ObjectId.validate_array', n, cost, n / cost))
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+from mts.commons.singleton import _Singleton
+from mts.commons.const import *
+from mts.core.handler import DBHandler
+
+FIELDS_TDU = {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT', 'm2': 'INT', 'm3': 'INT'}
+
+
+def new_handler(db_file_name, profile):
+    if DBHandler in _Singleton._instances:
+        del _Singleton._instances[DBHandler]
+    db = DBHandler('sqlite://' + db_file_name, profile=profile)
+    db.init_table('tdu', FIELDS_TDU)
+    return db
+
+
+def ingest_rows(db, rows):
+    # 逐行写入，每行一次提交
+    for row in rows:
+        db.add(row, 'tdu')
+
+
+def ingest_many(db, rows):
+    db.add_many(rows, 'tdu')
+
+
+def read_concurrent(db, rows, threads=4, rounds=50):
+    def worker():
+        for i in range(rounds):
+            db.query('tdu', condition='m1 >= ?', params=(i * 10,))
+
+    pool = [threading.Thread(target=worker) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * rounds
+
+
+def bench(profile, n_row, n_many):
+    rows = [{'timestamp': '{0}.000'.format(1612022400 + i), 'm1': i, 'm2': i * 2, 'm3': i * 3} for i in range(n_many)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = new_handler(os.path.join(tmp_dir, 'bench.db'), profile)
+        start = time.perf_counter()
+        ingest_rows(db, rows[:n_row])
+        cost_row = time.perf_counter() - start
+        db.init_table('tdu', FIELDS_TDU)
+        start = time.perf_counter()
+        ingest_many(db, rows)
+        cost_many = time.perf_counter() - start
+        start = time.perf_counter()
+        n_query = read_concurrent(db, rows)
+        cost_read = time.perf_counter() - start
+        db.disconnect()
+    print('{0:<12}{1:>14,.0f} rows/s (add){2:>14,.0f} rows/s (add_many){3:>10,.1f} queries/s'.format(
+        profile, n_row / cost_row, n_many / cost_many, n_query / cost_read))
+
+
+if __name__ == '__main__':
+    n_row = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_many = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    for profile in SQLITE_PROFILES.keys():
+        bench(profile, n_row, n_many)
@@ -0,0 +1,2 @@
+from .handler import AsyncExecutor, AsyncDBHandler
+from .datamodel import AsyncDataDictionary, AsyncTimeDataUnit, AsyncSpaceDataUnit
@@ -0,0 +1,66 @@
+import asyncio
+from mts.core.datamodel import DataDictionary, TimeDataUnit, SpaceDataUnit
+from mts.aio.handler import AsyncExecutor
+
+
+class AsyncDataUnit(object):
+    """数据单元的异步接口，由create构建（构建过程本身需访问数据库）"""
+    _unit_class = None
+
+    def __init__(self, unit, executor: AsyncExecutor = None):
+        self._unit = unit
+        self._executor = AsyncExecutor() if executor is None else executor
+
+    @classmethod
+    async def create(cls, *args, executor: AsyncExecutor = None):
+        executor = AsyncExecutor() if executor is None else executor
+        unit = await executor.run(cls._unit_class, *args)
+        return cls(unit, executor)
+
+    @property
+    def unit(self):
+        return self._unit
+
+    async def query(self, *args, **kwargs):
+        return await self._executor.run(self._unit.query, *args, **kwargs)
+
+    async def add(self, *args, **kwargs):
+        return await self._executor.run(self._unit.add, *args, **kwargs)
+
+    async def remove(self, *args, **kwargs):
+        return await self._executor.run(self._unit.remove, *args, **kwargs)
+
+    async def import_data(self, *args, **kwargs):
+        return await self._executor.run(self._unit.import_data, *args, **kwargs)
+
+    async def export_data(self, *args, **kwargs):
+        return await self._executor.run(self._unit.export_data, *args, **kwargs)
+
+    async def sync_db(self, *args, **kwargs):
+        return await self._executor.run(self._unit.sync_db, *args, **kwargs)
+
+
+class AsyncDataDictionary(AsyncDataUnit):
+    _unit_class = DataDictionary
+
+    async def refresh(self):
+        return await self._executor.run(self._unit.refresh)
+
+
+class AsyncTimeDataUnit(AsyncDataUnit):
+    _unit_class = TimeDataUnit
+
+    @classmethod
+    async def query_many(cls, ddids: list, executor: AsyncExecutor = None, **kwargs):
+        """并发查询多个owner的TDU，参数同TimeDataUnit.query，返回{ddid: 查询结果}"""
+
+        async def query_one(ddid):
+            unit = await cls.create(ddid, executor=executor)
+            return await unit.query(**kwargs)
+
+        res = await asyncio.gather(*[query_one(ddid) for ddid in ddids])
+        return dict(zip(ddids, res))
+
+
+class AsyncSpaceDataUnit(AsyncDataUnit):
+    _unit_class = SpaceDataUnit
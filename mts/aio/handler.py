@@ -0,0 +1,177 @@
+import asyncio
+import threading
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
+from mts.commons import logger, Singleton
+from mts.commons.const import *
+from mts.core.handler import DBHandler, CancelToken
+
+
+class AsyncExecutor(Singleton):
+    """异步接口共用的线程池：限制同时执行的阻塞调用数量，任务取消时中断其正在执行的SQLite查询；
+    再次构造时新的参数对现有实例生效，shutdown之后再次使用时重新建立线程池"""
+
+    def __init__(self, max_workers: int = AIO_WORKERS_DEFAULT, max_concurrency: int = AIO_CONCURRENCY_DEFAULT):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._max_workers = self._check_max_workers(max_workers)
+        self._max_concurrency = self._check_max_concurrency(max_concurrency)
+        # asyncio.Semaphore与事件循环绑定，每个事件循环各用一个
+        self._semaphores = WeakKeyDictionary()
+
+    @staticmethod
+    def _check_max_workers(max_workers: int):
+        if not (isinstance(max_workers, int) and max_workers > 0):
+            raise ValueError(logger.error([6300, max_workers]))
+        return max_workers
+
+    @staticmethod
+    def _check_max_concurrency(max_concurrency: int):
+        if not (isinstance(max_concurrency, int) and max_concurrency > 0):
+            raise ValueError(logger.error([6301, max_concurrency]))
+        return max_concurrency
+
+    def _reuse(self, max_workers: int = None, max_concurrency: int = None):
+        if (max_workers is not None) and (self._check_max_workers(max_workers) != self._max_workers):
+            # 已提交的任务在原线程池中执行完毕，新任务使用新的线程池
+            self.shutdown(False)
+            self._max_workers = max_workers
+        if (max_concurrency is not None) and (self._check_max_concurrency(max_concurrency) != self._max_concurrency):
+            self._max_concurrency = max_concurrency
+            self._semaphores = WeakKeyDictionary()
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='mts-aio')
+            return self._executor
+
+    def _semaphore(self, loop):
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, func, *args, **kwargs):
+        """在线程池中执行func(*args, **kwargs)并等待结果"""
+        return await self.run_with(CancelToken(), func, *args, **kwargs)
+
+    async def run_with(self, token: CancelToken, func, *args, **kwargs):
+        """同run，调用期间获取的只读连接登记到token；任务取消时经token中断查询，多次调用可共用同一token"""
+        loop = asyncio.get_running_loop()
+        db = DBHandler()
+
+        def call():
+            with db.cancel_scope(token):
+                return func(*args, **kwargs)
+
+        semaphore = self._semaphore(loop)
+        await semaphore.acquire()
+        try:
+            future = loop.run_in_executor(self._pool(), call)
+        except BaseException:
+            semaphore.release()
+            raise
+        def done(item):
+            # 任务取消后线程中的调用仍在执行，直到其结束才释放并发名额；取消后的异常无人等待，在此取出
+            semaphore.release()
+            if not item.cancelled():
+                item.exception()
+
+        future.add_done_callback(done)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            token.cancel()
+            raise
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class AsyncDBHandler(object):
+    """DBHandler的异步接口；事务依赖线程，需在同一线程内完成的一组操作请通过run提交"""
+
+    def __init__(self, db: DBHandler = None, executor: AsyncExecutor = None):
+        self._db = DBHandler() if db is None else db
+        self._executor = AsyncExecutor() if executor is None else executor
+
+    @property
+    def db(self):
+        return self._db
+
+    async def run(self, func, *args, **kwargs):
+        return await self._executor.run(func, *args, **kwargs)
+
+    async def query(self, *args, **kwargs):
+        return await self.run(self._db.query, *args, **kwargs)
+
+    async def query_iter(self, *args, **kwargs):
+        # 各块可能在不同线程中读取，共用一个token以便取消时中断迭代器持有的连接；
+        # 取消后线程中的next可能仍在执行，close经线程池在其结束后执行
+        iterator = self._db.query_iter(*args, **kwargs)
+        token = CancelToken()
+        lock = threading.Lock()
+
+        def step():
+            with lock:
+                return next(iterator, None)
+
+        def close():
+            with lock:
+                iterator.close()
+
+        try:
+            while True:
+                chunk = await self._executor.run_with(token, step)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await asyncio.shield(self._executor.run_with(token, close))
+
+    async def get_tables(self):
+        return await self.run(self._db.get_tables)
+
+    async def get_fields(self, table_name: str):
+        return await self.run(self._db.get_fields, table_name)
+
+    async def exist_table(self, table_name: str):
+        return await self.run(self._db.exist_table, table_name)
+
+    async def init_table(self, table_name: str, fields: dict):
+        return await self.run(self._db.init_table, table_name, fields)
+
+    async def add_column(self, table_name: str, field_name: str, field_def: str):
+        return await self.run(self._db.add_column, table_name, field_name, field_def)
+
+    async def add(self, data: dict, table_name: str):
+        return await self.run(self._db.add, data, table_name)
+
+    async def add_many(self, rows: list, table_name: str):
+        return await self.run(self._db.add_many, rows, table_name)
+
+    async def remove(self, *args, **kwargs):
+        return await self.run(self._db.remove, *args, **kwargs)
+
+    async def import_data(self, *args, **kwargs):
+        return await self.run(self._db.import_data, *args, **kwargs)
+
+    async def export_data(self, *args, **kwargs):
+        return await self.run(self._db.export_data, *args, **kwargs)
+
+    async def export_service(self, *args, **kwargs):
+        return await self.run(self._db.export_service, *args, **kwargs)
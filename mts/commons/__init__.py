@@ -1,2 +1,2 @@
-from .utils import logger, hex_str
+from .utils import logger, hex_str, hex_str_array, hex_int_array
 from .singleton import Singleton
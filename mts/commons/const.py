@@ -1,5 +1,5 @@
 from pandas import DataFrame
-from datetime import timedelta
+from datetime import datetime, timedelta
 from ni.config import ParameterValidator
 from mts.commons import hex_str
 from moment import moment
@@ -7,6 +7,7 @@ from moment import moment
 
 EPOCH_DEFAULT = 1608480000
 EPOCH_MOMENT = moment('2020-12-21')
+EPOCH_UNIX = datetime(1970, 1, 1)
 
 BLANK = ''
 
@@ -49,17 +50,81 @@ FIELD_OWNER = 'owner'
 FIELD_OID = 'oid'
 FIELD_MASK = 'mask'
 
+FIELD_SEQ = 'seq'
+FIELD_OP = 'op'
+
 # DD_HEADERS = FIELD_DDID + ',' + FIELD_DESC + ',' + FIELD_OID_MASK
 
 TABLE_PREFIX_DD = 'dd'
+TABLE_PREFIX_DD_LOG = 'ddlog'
 TABLE_PREFIX_SDU = 'sdu'
 TABLE_PREFIX_TDU = 'tdu'
 
 FIELDS_DD = {FIELD_DDID: 'VARCHAR(17) PRIMARY KEY', FIELD_DESC: 'VARCHAR(160)', FIELD_OID_MASK: 'VARCHAR(32)'}
+# 数据字典变更日志：seq单调递增，op为新增/删除/重置（重置后需全部重新加载）
+FIELDS_DD_LOG = {FIELD_SEQ: 'INTEGER PRIMARY KEY AUTOINCREMENT', FIELD_OP: 'VARCHAR(1)',
+                 FIELD_DDID: 'VARCHAR(17)', FIELD_DESC: 'VARCHAR(160)', FIELD_OID_MASK: 'VARCHAR(32)'}
+DD_LOG_ADD = 'a'
+DD_LOG_REMOVE = 'd'
+DD_LOG_RESET = 'r'
 
 CACHE_TTL_DEFAULT = timedelta(hours=12)
 CACHE_MAX_SIZE_DEFAULT = 30
 
+POOL_SIZE_DEFAULT = 4
+CACHED_STATEMENTS_DEFAULT = 256
+CHUNK_ROWS_DEFAULT = 50000
+
+RETURN_TYPE_PANDAS = 'pandas'
+RETURN_TYPE_ARROW = 'arrow'
+RETURN_TYPES = [RETURN_TYPE_PANDAS, RETURN_TYPE_ARROW]
+
+ENGINE_CX = 'connectorx'
+ENGINE_SQLITE = 'sqlite3'
+CX_RETRY_INTERVAL = 300  # 秒，connectorx因数据原因失败的查询在此之后重新尝试
+BACKENDS_MAX_SIZE = 1024
+
+IMPORT_BATCH_ROWS_DEFAULT = 10000
+PARSER_CSV = 'csv'
+PARSER_ARROW = 'arrow'
+PARSER_PARQUET = 'parquet'
+PARSER_IPC = 'ipc'
+PARSERS = [PARSER_CSV, PARSER_ARROW, PARSER_PARQUET, PARSER_IPC]
+PARSER_EXTENSIONS = {'.parquet': PARSER_PARQUET, '.arrow': PARSER_IPC, '.ipc': PARSER_IPC, '.feather': PARSER_IPC}
+
+EXPORT_FORMAT_CSV_GZ = 'csv.gz'
+EXPORT_FORMAT_PARQUET = 'parquet'
+EXPORT_FORMATS = [EXPORT_FORMAT_CSV_GZ, EXPORT_FORMAT_PARQUET]
+EXPORT_WORKERS_DEFAULT = 4
+MANIFEST_FILENAME = 'manifest_{}.json'
+
+AIO_WORKERS_DEFAULT = 8
+AIO_CONCURRENCY_DEFAULT = 8
+
+# SQLite性能配置（profile）：按名称给出连接建立后执行的pragma
+PROFILE_DEFAULT = 'default'
+PROFILE_BALANCED = 'balanced'
+PROFILE_FAST = 'fast'
+SQLITE_PROFILES = {
+    PROFILE_DEFAULT: {},  # 不执行pragma；已为WAL的数据库文件仍为WAL
+    PROFILE_BALANCED: {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,  # 负值单位为KiB，即64MiB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    },
+    PROFILE_FAST: {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    }
+}
+
 MOMENT_FORMAT = 'X.SSS'
 
 KEY_OID = 'oid'
@@ -81,6 +146,13 @@ KEY_TAG = 'tag'
 KEY_DATA = 'data'
 KEY_DATA_DESC = 'data_desc'
 KEY_OP = 'op'
+KEY_TIMESTAMP = 'timestamp'
+KEY_PID_CODE = 'pid_code'
+KEY_SEQUENCE = 'sequence'
+KEY_CREATED_BETWEEN = 'created_between'
+KEY_CHUNK_ROWS = 'chunk_rows'
+KEY_RETURN_TYPE = 'return_type'
+KEY_COLUMNS = 'columns'
 
 OID_LEN = 16
 DDID_LEN = 17
@@ -166,6 +238,14 @@ PV_DD_QUERY = ParameterValidator({
         'type': 'array',
         'items': DDID,
         'minItems': 1
+    },
+    KEY_CREATED_BETWEEN: {
+        'type': 'object',
+        'properties': {
+            KEY_FROM: {'type': 'string'},
+            KEY_TO: {'type': 'string'}
+        },
+        'required': [KEY_FROM, KEY_TO]
     }
 })
 
@@ -198,6 +278,14 @@ PV_TDU_QUERY = ParameterValidator({
         'type': 'array',
         'items': {'type': 'string'},
         'minItems': 1
+    },
+    KEY_CHUNK_ROWS: {
+        'type': 'integer',
+        'minimum': 1
+    },
+    KEY_RETURN_TYPE: {
+        'type': 'string',
+        'enum': RETURN_TYPES
     }
 })
 
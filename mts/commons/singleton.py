@@ -6,6 +6,11 @@ class _Singleton(type):
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
             cls._instances[cls] = super(_Singleton, cls).__call__(*args, **kwargs)
+        elif args or kwargs:
+            # 已创建的实例不会再次执行__init__，新传入的参数交由实例的_reuse处理
+            reuse = getattr(cls._instances[cls], '_reuse', None)
+            if reuse is not None:
+                reuse(*args, **kwargs)
         return cls._instances[cls]
 
 
@@ -1,3 +1,4 @@
+import numpy as np
 from ni.config.tools import Logger
 from moment import moment
 
@@ -15,6 +16,55 @@ def hex_str(num, bits):
         return res[bits:]
 
 
+HEX_INVALID = 255
+HEX_TABLE = np.full(128, HEX_INVALID, dtype=np.uint8)
+HEX_TABLE[[ord(c) for c in '0123456789abcdef']] = np.arange(16)
+HEX_TABLE[[ord(c) for c in 'ABCDEF']] = np.arange(10, 16)
+
+
+def hex_nibbles(values, length: int):
+    """将定长十六进制字符串数组拆分为(N, length)的半字节矩阵；长度不符或含非十六进制字符的行，valid为False且置0"""
+    data = np.asarray(values, dtype=str)
+    codes = data.astype('U' + str(length + 1)).view(np.uint32).reshape(-1, length + 1)
+    valid = codes[:, length] == 0
+    codes = codes[:, :length]
+    nibbles = HEX_TABLE[np.minimum(codes, len(HEX_TABLE) - 1)]
+    nibbles[codes >= len(HEX_TABLE)] = HEX_INVALID
+    valid &= np.all(nibbles != HEX_INVALID, axis=1)
+    nibbles[~valid] = 0
+    return nibbles, valid
+
+
+def join_nibbles(nibbles):
+    """按大端序将不超过16列的半字节矩阵合并为uint64数组"""
+    nibbles = nibbles.astype(np.uint8)
+    pad = 16 - nibbles.shape[1]
+    if pad > 0:
+        nibbles = np.hstack([np.zeros((nibbles.shape[0], pad), dtype=np.uint8), nibbles])
+    packed = np.ascontiguousarray((nibbles[:, 0::2] << 4) | nibbles[:, 1::2])
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+HEX_CHARS = np.array([ord(c) for c in '0123456789abcdef'], dtype=np.uint32)
+
+
+def hex_str_array(values, length: int = 16):
+    """hex_str的批量版本：将uint64数组格式化为length位（不超过16位）补零的十六进制字符串数组"""
+    data = np.ascontiguousarray(np.asarray(values, dtype=np.uint64).astype('>u8'))
+    octets = data.view(np.uint8).reshape(-1, 8)
+    nibbles = np.empty((octets.shape[0], 16), dtype=np.uint8)
+    nibbles[:, 0::2] = octets >> 4
+    nibbles[:, 1::2] = octets & 0x0f
+    codes = np.ascontiguousarray(HEX_CHARS[nibbles[:, 16 - length:]])
+    return codes.view('U' + str(length)).ravel()
+
+
+def hex_int_array(values, length: int):
+    """hex_str的逆运算（批量）：返回uint64数组及对应的合法性标记"""
+    nibbles, valid = hex_nibbles(values, length)
+    return join_nibbles(nibbles), valid
+
+
 # 1000-1999：DataUnitProcessor
 # 2000-2499：TimeDataUnit
 # 2500-3999：SpaceDataUnit
@@ -29,6 +79,7 @@ def hex_str(num, bits):
 # 6000-6099：Service
 # 6100-6199：similarity
 # 6200-6299：DataFragments
+# 6300-6399：aio
 
 
 ERROR_DEF = {
@@ -58,10 +109,16 @@ ERROR_DEF = {
     '5500': '[{0}] service_code值"{1}"异常，取值范围应为[{2}, {3}]。',
     '5501': '[{0}] oid的类型应为str或ObjectId，而非{1}。',
     '5502': '[{0}] 非法id；时间逆流。',
+    '5503': '[{0}] pack_many的参数n值（{1}）异常，应为正整数。',
+    '5504': '[{0}] 非法id；共有{1}个元素未通过校验。',
+    '5505': '[{0}] 分配器的参数pid_code值（{1}）异常，应为[0, 15]的整数（或由其组成的不重复list）。',
+    '5506': '[{0}] 分配器的pid_code（{1}）继承自父进程，fork后的子进程应注册使用其他pid_code的分配器。',
     '5600': '[{0}] ddid的类型应为str或DataDictionaryId，而非{1}。',
     '5601': '[{0}] 构建DataDictionaryId时，遇到异常的参数{1}。',
     '5602': '[{0}] ddid应为17位长度的字符串，或者是DataDictionaryId实例。',
     '5603': '[{0}] 异常：非法ddid。',
+    '5604': '[{0}] pack_many的参数dd_type值（{1}）异常。',
+    '5605': '[{0}] 异常：非法ddid；共有{1}个元素未通过校验。',
     '5700': '[{0}] DBHandler需要对db_url进行登记(register)后方能使用。',
     '5701': '[{0}] 参数table_type应为({1})。',
     '5702': '[{0}] 参数owner_id不能为None。',
@@ -71,6 +128,23 @@ ERROR_DEF = {
     '5706': '[{0}] get_table_name的参数owner_id值异常。',
     # '5707': '[{0}] export_data的参数owner_id不能为None。',
     '5708': '[{0}] DBHandler初始化参数timezone值（"{1}"）异常。',
+    '5709': '[{0}] DBHandler初始化参数pool_size值（{1}）异常，应为正整数。',
+    '5710': '[{0}] DBHandler初始化参数cached_statements值（{1}）异常，应为非负整数。',
+    '5711': '[{0}] DBHandler参数profile值（{1}）异常，应为({2})之一。',
+    '5712': '[{0}] query_iter的参数chunk_rows值（{1}）异常，应为正整数。',
+    '5713': '[{0}] 参数return_type值（{1}）异常，应为({2})之一。',
+    '5714': '[{0}] return_type为arrow时需要安装pyarrow。',
+    '5715': '[{0}] connectorx无法执行查询（{1}），运行环境不支持，此后所有查询直接使用sqlite3：{2}',
+    '5716': '[{0}] import_data的参数batch_rows值（{1}）异常，应为正整数。',
+    '5717': '[{0}] import_data的参数parser值（{1}）异常，应为({2})之一。',
+    '5718': '[{0}] 文件"{1}"导入{2}完成，共{3}行，耗时{4:.3f}秒（{5:.0f}行/秒）。',
+    '5719': '[{0}] export_service的参数fmt值（{1}）异常，应为({2})之一。',
+    '5720': '[{0}] export_service的参数workers值（{1}）异常，应为正整数。',
+    '5721': '[{0}] Service（{1}）导出完成，共{2}张表，{3}行，清单文件"{4}"。',
+    '5722': '[{0}] 事务回滚后的回调执行失败：{1}。',
+    '5723': '[{0}] connectorx无法执行查询（{1}），已改用sqlite3，相同查询{2}秒内直接使用sqlite3：{3}',
+    '5724': '[{0}] DBHandler已创建，参数{1}值（{2}）与现有实例（{3}）不一致，已忽略，{4}。',
+    '5725': '[{0}] 只读连接池已关闭。',
     '5800': '[{0}] query的参数dd_type值异常。',
     '5801': '[{0}] 异常：未能识别的dd_type({1})。',
     '5802': '[{0}] remove的参数ddid值异常。',
@@ -80,12 +154,16 @@ ERROR_DEF = {
     # '5806': '[{0}] append参数{1}异常。',
     '5807': '[{0}] query的参数ddid值异常。',
     '5808': '[{0}] query的参数oid值异常。',
+    '5809': '[{0}] query的参数created_between值异常。',
     '5900': '[{0}] 成功读取文件"{1}"。',
     '5901': '[{0}] 找不到"{1}"。',
+    '5902': '[{0}] 文件"{1}"校验失败，与清单中的checksum不一致。',
     '6000': '[{0}] to_service_code参数类型异常，应该为int或8进制的str。',
     '6001': '[{0}] Service Code值（{1}）异常，不在合理范围[{2}, {3}]内；系统保留Service的原值，不会对Service设置处理。',
     '6100': '[{0}] Jaccard相关方法的参数只能为set或者numpy.ndarray。',
     '6200': '[{0}] 构建DataFragments失败，service_id值异常。',
+    '6300': '[{0}] AsyncExecutor参数max_workers值（{1}）异常，应为正整数。',
+    '6301': '[{0}] AsyncExecutor参数max_concurrency值（{1}）异常，应为正整数。',
 }
 
 logger = Logger(ERROR_DEF, 'mts')
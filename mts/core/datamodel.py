@@ -1,9 +1,28 @@
+import threading
 from abc import abstractmethod
+from bisect import bisect_left, insort
+import numpy as np
 import pandas as pd
-from mts.commons import logger
+from mts.commons import logger, hex_str_array
 from mts.commons.const import *
 from mts.core.handler import DBHandler
-from mts.core.id import DataDictionaryId, Service
+from mts.core.id import DataDictionaryId, ObjectId, Service
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover
+    pa = None
+    pc = None
+
+
+def _map_many(keys: pd.Index, values: np.ndarray, items, missing=None):
+    """以哈希连接将items按keys映射为values中对应的值，返回与items对齐的数组，未命中处为missing"""
+    indexer = keys.get_indexer(pd.Index(list(items), dtype=object))
+    res = np.full(len(indexer), missing, dtype=object)
+    hit = indexer >= 0
+    res[hit] = values[indexer[hit]]
+    return res
 
 
 class DataUnit(object):
@@ -20,7 +39,7 @@ class DataUnit(object):
         if self._db.exist_table(self._table_name):
             pass
         else:
-            self.init_db()
+            self.create_db()
 
     @abstractmethod
     def _set_table_name(self):
@@ -46,8 +65,8 @@ class DataUnit(object):
     def remove(self, **kwargs):
         pass
 
-    def import_data(self, filename):
-        self._db.import_data(filename, self._table_name)
+    def import_data(self, filename, **kwargs):
+        return self._db.import_data(filename, self._table_name, **kwargs)
 
     def export_data(self, output_dir):
         self._db.export_data(output_dir, self._table_name)
@@ -64,55 +83,318 @@ class DataUnit(object):
     def init_db(self):
         self._db.init_table(self._table_name, self.fields())
 
+    def create_db(self):
+        """表不存在时创建；其他进程可能已建表，不能删除重建"""
+        self._db.init_table(self._table_name, self.fields(), False)
+
 
 class DataDictionary(DataUnit):
+    # 进程内按service id共享的实例及各service的版本号
+    _shared = {}
+    _versions = {}
+    _registry_lock = threading.Lock()
 
     def __init__(self, service_id: str):
+        # 共享实例会被多个线程同时使用，内存中的列及索引的读写均在_mutex下进行；持有_mutex时不访问数据库
+        self._mutex = threading.RLock()
         super().__init__(service_id)
-        self._data = None
+        self._init_log()
+        self._frame = None
         self.load_data()
 
+    @classmethod
+    def shared(cls, service_id: str):
+        """返回进程内共享的实例；数据库切换、事务回滚或经其他实例写入后重新加载"""
+        db = DBHandler()
+        with cls._registry_lock:
+            dd = cls._shared.get(service_id)
+            if (dd is not None) and (dd._db is db) and (dd._generation == db.generation) \
+                    and (dd._version == cls._versions.get(dd.sid, 0)):
+                return dd
+        dd = cls(service_id)
+        with cls._registry_lock:
+            cls._shared[service_id] = dd
+        return dd
+
+    @classmethod
+    def invalidate(cls, service_id: str = None):
+        """清除共享实例，service_id为None时全部清除"""
+        with cls._registry_lock:
+            if service_id is None:
+                cls._shared.clear()
+            else:
+                cls._shared.pop(service_id, None)
+
+    @property
+    def version(self):
+        return self._version
+
+    def _bump(self):
+        # 经本实例写入后递增版本号，本实例与数据库保持一致，其他实例据此判断已过期
+        with DataDictionary._registry_lock:
+            self._version = DataDictionary._versions.get(self.sid, 0) + 1
+            DataDictionary._versions[self.sid] = self._version
+
+    def init_db(self):
+        self._init_log()
+        with self._db.transaction():
+            super().init_db()
+            self._log_reset()
+        self._bump()
+
+    def _init_log(self):
+        # 变更日志不随数据字典重建，保证seq在多个进程间始终单调递增
+        if not self._db.exist_table(self._log_table_name):
+            self._db.init_table(self._log_table_name, FIELDS_DD_LOG, False)
+
+    def _log_reset(self):
+        # 重置之前的日志已无意义，一并清除
+        self._db.remove(self._log_table_name)
+        self._db.add({FIELD_OP: DD_LOG_RESET}, self._log_table_name)
+
+    def _last_seq(self):
+        res = self._db.query(self._log_table_name, ['MAX(' + FIELD_SEQ + ') AS ' + FIELD_SEQ])
+        seq = res[FIELD_SEQ].iloc[0] if len(res.index) > 0 else None
+        if (seq is None) or pd.isna(seq):
+            return 0
+        return int(seq)
+
     def load_data(self):
-        self._data = self._db.query(self._table_name)
+        with DataDictionary._registry_lock:
+            self._version = DataDictionary._versions.get(self.sid, 0)
+        self._generation = self._db.generation
+        # 先读取序号再读取数据，期间的变更在refresh时重复应用，结果不变
+        seq = self._last_seq()
+        data = self._db.query(self._table_name)
+        with self._mutex:
+            self._seq = seq
+            self._ddids = data[FIELD_DDID].tolist()
+            self._descs = data[FIELD_DESC].tolist()
+            self._masks = data[FIELD_OID_MASK].tolist()
+            self._frame = data.reset_index(drop=True)
+            self._build_index()
+
+    @property
+    def _data(self):
+        # 增删时只维护各列的list及索引，DataFrame在需要时才重新构建，行标签即行的位置
+        with self._mutex:
+            if self._frame is None:
+                positions = list(self._ddid_index.values())
+                self._frame = pd.DataFrame({
+                    FIELD_DDID: [self._ddids[pos] for pos in positions],
+                    FIELD_DESC: [self._descs[pos] for pos in positions],
+                    FIELD_OID_MASK: [self._masks[pos] for pos in positions]}, index=positions)
+            return self._frame
+
+    def _build_index(self):
+        # 索引中记录的是行在各列list中的位置；同一键对应的位置以dict保存（保持插入顺序），删除时为O(1)
+        self._map_tables = {}
+        self._removed = 0
+        self._ddid_index = {}
+        self._oid_index = {}
+        self._desc_index = {}
+        self._type_desc_index = {}
+        self._type_index = {}
+        for pos, (ddid, desc) in enumerate(zip(self._ddids, self._descs)):
+            self._index_row(pos, ddid, desc)
+        self._type_oids = {}
+        for dd_type, positions in self._type_index.items():
+            self._type_oids[dd_type] = sorted([self._ddids[pos][1:] for pos in positions])
+
+    def _index_row(self, pos: int, ddid: str, desc: str):
+        self._ddid_index[ddid] = pos
+        self._oid_index.setdefault(ddid[1:], {})[pos] = None
+        self._desc_index.setdefault(desc, {})[pos] = None
+        self._type_desc_index.setdefault((ddid[0], desc), {})[pos] = None
+        self._type_index.setdefault(ddid[0], {})[pos] = None
+
+    @staticmethod
+    def _unindex(index: dict, key, pos: int):
+        positions = index[key]
+        del positions[pos]
+        if not positions:
+            del index[key]
+
+    def _append(self, ddid: str, desc: str, oid_mask: str):
+        # 与数据库中已存在的ddid冲突时INSERT OR IGNORE不会写入，内存中同样忽略
+        with self._mutex:
+            if ddid in self._ddid_index:
+                return
+            pos = len(self._ddids)
+            self._ddids.append(ddid)
+            self._descs.append(desc)
+            self._masks.append(oid_mask)
+            self._index_row(pos, ddid, desc)
+            insort(self._type_oids.setdefault(ddid[0], []), ddid[1:])
+            self._frame = None
+            self._map_tables = {}
+
+    def _lookup(self, dd_type: str = None, desc: list = None, ddid: list = None, oid: str = None):
+        """由索引求出满足全部条件的行位置（升序）"""
+        if ddid is not None:
+            positions = [self._ddid_index[item] for item in set(ddid) if item in self._ddid_index]
+        elif oid is not None:
+            positions = list(self._oid_index.get(oid, {}))
+        elif desc is not None:
+            positions = []
+            for item in set(desc):
+                if dd_type is None:
+                    positions.extend(self._desc_index.get(item, {}))
+                else:
+                    positions.extend(self._type_desc_index.get((dd_type, item), {}))
+        elif dd_type is not None:
+            positions = list(self._type_index.get(dd_type, {}))
+        else:
+            return list(self._ddid_index.values())
+        if dd_type is not None:
+            positions = [pos for pos in positions if self._ddids[pos][0] == dd_type]
+        if desc is not None:
+            desc = set(desc)
+            positions = [pos for pos in positions if self._descs[pos] in desc]
+        if oid is not None:
+            positions = [pos for pos in positions if self._ddids[pos][1:] == oid]
+        return sorted(positions)
+
+    def _discard(self, ddid: str):
+        with self._mutex:
+            pos = self._ddid_index.pop(ddid, None)
+            if pos is None:
+                return
+            # 只在各索引中删除该行并留下空位，其他行的位置不变；空位超过半数时再整理
+            desc = self._descs[pos]
+            self._unindex(self._oid_index, ddid[1:], pos)
+            self._unindex(self._desc_index, desc, pos)
+            self._unindex(self._type_desc_index, (ddid[0], desc), pos)
+            self._unindex(self._type_index, ddid[0], pos)
+            oids = self._type_oids[ddid[0]]
+            del oids[bisect_left(oids, ddid[1:])]
+            self._ddids[pos] = None
+            self._descs[pos] = None
+            self._masks[pos] = None
+            self._removed = self._removed + 1
+            self._frame = None
+            self._map_tables = {}
+            if self._removed * 2 > len(self._ddids):
+                self._compact()
+
+    def _compact(self):
+        positions = list(self._ddid_index.values())
+        self._ddids = [self._ddids[pos] for pos in positions]
+        self._descs = [self._descs[pos] for pos in positions]
+        self._masks = [self._masks[pos] for pos in positions]
+        self._build_index()
+
+    def refresh(self):
+        """应用变更日志中序号大于上次所见的记录，遇到重置记录时重新加载；返回应用的记录数"""
+        res = self._db.query(self._log_table_name, None, FIELD_SEQ + ' > ?', (self._seq,))
+        count = 0
+        for row in res.sort_values(FIELD_SEQ).itertuples(index=False):
+            count = count + 1
+            op = getattr(row, FIELD_OP)
+            if DD_LOG_RESET == op:
+                self.load_data()
+                return count
+            seq = int(getattr(row, FIELD_SEQ))
+            with self._mutex:
+                # 其他线程可能已应用过该记录
+                if seq <= self._seq:
+                    continue
+                if DD_LOG_ADD == op:
+                    self._append(getattr(row, FIELD_DDID), getattr(row, FIELD_DESC), getattr(row, FIELD_OID_MASK))
+                elif DD_LOG_REMOVE == op:
+                    self._discard(getattr(row, FIELD_DDID))
+                self._seq = seq
+        return count
+
+    def _advance(self, seq: int, count: int):
+        # 本实例写入的日志紧接在已应用的序号之后时直接推进，refresh不再重复应用；
+        # 中间夹有其他进程的日志时保持不变，留待refresh按序应用
+        with self._mutex:
+            if self._seq + count == seq:
+                self._seq = seq
+
+    @property
+    def seq(self):
+        return self._seq
 
     def _after_sync(self):
+        with self._db.transaction():
+            self._log_reset()
+        self._bump()
         self.load_data()
 
     def _set_table_name(self):
         self._table_name = '_'.join([TABLE_PREFIX_DD, self.sid])
+        self._log_table_name = '_'.join([TABLE_PREFIX_DD_LOG, self.sid])
 
     def fields(self):
         return FIELDS_DD
 
+    def _query_created_between(self, interval: dict, dd_type: str = None):
+        # id的高位为创建时间，按时间窗口换算为ddid主键上的范围扫描
+        oid_from = hex_str(ObjectId.min_for(interval[KEY_FROM], self._service.code), OID_LEN)
+        oid_to = hex_str(ObjectId.max_for(interval[KEY_TO], self._service.code), OID_LEN)
+        dd_types = DD_TYPES
+        if dd_type in DD_TYPES:
+            dd_types = [dd_type]
+        condition = []
+        params = []
+        for item in dd_types:
+            condition.append(FIELD_DDID + ' BETWEEN ? AND ?')
+            params.extend([item + oid_from, item + oid_to])
+        return self._db.query(self._table_name, None, ' OR '.join(condition), params)
+
     def query(self, oid_only=False, **kwargs):
-        res = self._data.copy()
+        dd_type = None
         if KEY_DD_TYPE in kwargs:
             if PV_DD_QUERY.validate(KEY_DD_TYPE, kwargs[KEY_DD_TYPE]):
                 if kwargs[KEY_DD_TYPE] in DD_TYPES:
-                    res = res[res[FIELD_DDID].str[0] == kwargs[KEY_DD_TYPE]]
+                    dd_type = kwargs[KEY_DD_TYPE]
                 else:
                     raise ValueError(logger.error([5801, kwargs[KEY_DD_TYPE]]))
             else:
                 raise ValueError(logger.error([5800, kwargs[KEY_DD_TYPE]]))
+        desc = None
         if KEY_DESC in kwargs:
             if PV_DD_QUERY.validate(KEY_DESC, kwargs[KEY_DESC]):
-                res = res[res['desc'].isin(kwargs[KEY_DESC])]
+                desc = kwargs[KEY_DESC]
             else:
                 raise ValueError(logger.error([5803]))
+        ddid = None
         if KEY_DDID in kwargs:
             if PV_DD_QUERY.validate(KEY_DDID, kwargs[KEY_DDID]):
-                res = res[res[FIELD_DDID].isin(kwargs[KEY_DDID])]
+                ddid = kwargs[KEY_DDID]
             else:
                 raise ValueError(logger.error([5807]))
+        oid = None
         if KEY_OID in kwargs:
             if PV_DD_QUERY.validate(KEY_OID, kwargs[KEY_OID]):
-                res = res[res[FIELD_DDID].str[1:] == kwargs[KEY_OID]]
+                oid = kwargs[KEY_OID]
             else:
                 raise ValueError(logger.error([5808]))
-        if oid_only:
-            res = res[FIELD_DDID].apply(lambda x: x[1:]).tolist()
-            res.sort()
-        return res
+        if KEY_CREATED_BETWEEN in kwargs:
+            if PV_DD_QUERY.validate(KEY_CREATED_BETWEEN, kwargs[KEY_CREATED_BETWEEN]):
+                res = self._query_created_between(kwargs[KEY_CREATED_BETWEEN], dd_type)
+            else:
+                raise ValueError(logger.error([5809]))
+            if desc is not None:
+                res = res[res[FIELD_DESC].isin(desc)]
+            if ddid is not None:
+                res = res[res[FIELD_DDID].isin(ddid)]
+            if oid is not None:
+                res = res[res[FIELD_DDID].str[1:] == oid]
+            if oid_only:
+                res = res[FIELD_DDID].str[1:].tolist()
+                res.sort()
+            return res
+        with self._mutex:
+            if oid_only:
+                if (dd_type is not None) and (desc is None) and (ddid is None) and (oid is None):
+                    return list(self._type_oids.get(dd_type, []))
+                res = [self._ddids[pos][1:] for pos in self._lookup(dd_type, desc, ddid, oid)]
+                res.sort()
+                return res
+            return self._data.loc[self._lookup(dd_type, desc, ddid, oid)]
 
     def add(self, **kwargs):
         if (KEY_DD_TYPE in kwargs) and PV_DD_ADD.validate(KEY_DD_TYPE, kwargs[KEY_DD_TYPE]):
@@ -123,55 +405,179 @@ class DataDictionary(DataUnit):
                     ddid = DataDictionaryId(ddid=kwargs[KEY_DD_TYPE]+kwargs[KEY_OID])
                 if (KEY_MASK in kwargs) and PV_DD_ADD.validate(KEY_MASK, kwargs[KEY_MASK]):
                     mask = kwargs[KEY_MASK]
-                duplicated = True
-                res = self.query(dd_type=kwargs[KEY_DD_TYPE], desc=[kwargs[KEY_DESC]])
-                if res.empty:
-                    duplicated = False
-                if duplicated:
+                with self._mutex:
+                    positions = self._type_desc_index.get((kwargs[KEY_DD_TYPE], kwargs[KEY_DESC]))
+                    exist = self._ddids[next(iter(positions))] if positions else None
+                if exist is not None:
                     logger.warning([5804, kwargs])
-                    return res[KEY_DDID][0]
+                    return exist
                 else:
                     if ddid is None:
                         ddid = DataDictionaryId(dd_type=kwargs[KEY_DD_TYPE], service_id=self.sid)
                     ddid_str = str(ddid)
                     oid_mask = ddid.oid + mask
                     data = {FIELD_DDID: ddid_str, FIELD_DESC: kwargs[KEY_DESC], FIELD_OID_MASK: oid_mask}
-                    self._db.add(data, self._table_name)
-                    self.load_data()
+                    seq = None
+                    with self._db.transaction():
+                        # 指定的oid已存在时不会写入，也不记录日志
+                        if self._db.add(data, self._table_name) is not None:
+                            seq = self._db.add(dict(data, **{FIELD_OP: DD_LOG_ADD}), self._log_table_name)
+                            # 外层事务回滚时内存中的修改随之作废，按数据库重新加载
+                            self._db.on_rollback(self.load_data)
+                    if seq is None:
+                        logger.warning([5804, kwargs])
+                        return ddid_str
+                    with self._mutex:
+                        self._append(ddid_str, kwargs[KEY_DESC], oid_mask)
+                        self._advance(seq, 1)
+                    self._bump()
                     return ddid_str
             else:
                 raise ValueError(logger.error([5805, kwargs]))
         else:
             raise ValueError(logger.error([5805, kwargs]))
 
+    def add_many(self, items: list):
+        """批量添加，items中每项为add的参数(dict)；按(dd_type, desc)统一查重后在一个事务中写入，返回各项对应的ddid"""
+        keys = []
+        pending = {}
+        for item in items:
+            if not ((KEY_DD_TYPE in item) and PV_DD_ADD.validate(KEY_DD_TYPE, item[KEY_DD_TYPE])):
+                raise ValueError(logger.error([5805, item]))
+            if not ((KEY_DESC in item) and PV_DD_ADD.validate(KEY_DESC, item[KEY_DESC])):
+                raise ValueError(logger.error([5805, item]))
+            key = (item[KEY_DD_TYPE], item[KEY_DESC])
+            keys.append(key)
+            if key not in pending:
+                oid = None
+                if (KEY_OID in item) and PV_DD_ADD.validate(KEY_OID, item[KEY_OID]):
+                    oid = item[KEY_OID]
+                mask = MASK_DEFAULT
+                if (KEY_MASK in item) and PV_DD_ADD.validate(KEY_MASK, item[KEY_MASK]):
+                    mask = item[KEY_MASK]
+                pending[key] = [oid, mask]
+        with self._mutex:
+            for key in [key for key in pending if key in self._type_desc_index]:
+                del pending[key]
+        # 未指定oid的项按dd_type批量生成id
+        counts = {}
+        for (dd_type, desc), (oid, mask) in pending.items():
+            if oid is None:
+                counts[dd_type] = counts.get(dd_type, 0) + 1
+        generated = {}
+        for dd_type, n in counts.items():
+            # oid为uint64，整批格式化为十六进制字符串
+            generated[dd_type] = iter(hex_str_array(ObjectId.pack_many(self._service.code, n), OID_LEN).tolist())
+        ddids = {}
+        rows = []
+        explicit = []
+        for (dd_type, desc), (oid, mask) in pending.items():
+            if oid is None:
+                row = {FIELD_DDID: dd_type + next(generated[dd_type]), FIELD_DESC: desc}
+                rows.append(row)
+            else:
+                row = {FIELD_DDID: dd_type + oid, FIELD_DESC: desc}
+                explicit.append(row)
+            row[FIELD_OID_MASK] = row[FIELD_DDID][1:] + mask
+            ddids[(dd_type, desc)] = row[FIELD_DDID]
+        if rows or explicit:
+            with self._db.transaction():
+                if rows:
+                    self._db.add_many(rows, self._table_name)
+                # 指定的oid可能已存在，逐条写入以便只为实际插入的行记录日志
+                for row in explicit:
+                    if self._db.add(row, self._table_name) is not None:
+                        rows.append(row)
+                    else:
+                        logger.warning([5804, row])
+                if rows:
+                    seq = self._db.add_many([dict(row, **{FIELD_OP: DD_LOG_ADD}) for row in rows], self._log_table_name)
+                    self._db.on_rollback(self.load_data)
+            if rows:
+                with self._mutex:
+                    for row in rows:
+                        self._append(row[FIELD_DDID], row[FIELD_DESC], row[FIELD_OID_MASK])
+                    self._advance(seq, len(rows))
+                self._bump()
+        res = []
+        with self._mutex:
+            for key in keys:
+                if key in ddids:
+                    res.append(ddids[key])
+                else:
+                    positions = self._type_desc_index.get(key)
+                    res.append(self._ddids[next(iter(positions))] if positions else None)
+        return res
+
     def remove(self, ddid: str):
         if PV_DD_REMOVE.validate(KEY_DDID, ddid):
-            self._db.remove(self._table_name, FIELD_DDID + '="' + ddid + '"')
-            self.load_data()
+            with self._db.transaction():
+                self._db.remove(self._table_name, FIELD_DDID + ' = ?', (ddid,))
+                seq = self._db.add({FIELD_OP: DD_LOG_REMOVE, FIELD_DDID: ddid}, self._log_table_name)
+                self._db.on_rollback(self.load_data)
+            with self._mutex:
+                self._discard(ddid)
+                self._advance(seq, 1)
+            self._bump()
         else:
             raise ValueError(logger.error([5802]))
 
     def map_oid(self, desc: str, dd_type: str = None):
-        if dd_type is None:
-            res = self.query(True, desc=[desc])
-        else:
-            res = self.query(True, dd_type=dd_type, desc=[desc])
-        if 1 == len(res):
-            return res[0]
-        else:
-            return None
+        with self._mutex:
+            if dd_type is None:
+                positions = self._desc_index.get(desc, {})
+            else:
+                positions = self._type_desc_index.get((dd_type, desc), {})
+            if 1 == len(positions):
+                return self._ddids[next(iter(positions))][1:]
+            else:
+                return None
 
     def map_desc(self, oid: str, dd_type: str = None):
-        if dd_type is None:
-            res = self.query(oid=oid)[FIELD_DESC].tolist()
-        else:
-            ddid = dd_type + oid
-            res = self.query(ddid=[ddid])[FIELD_DESC].tolist()
-        if 1 == len(res):
-            return res[0]
-        else:
+        with self._mutex:
+            if dd_type is None:
+                positions = self._oid_index.get(oid, {})
+                if 1 == len(positions):
+                    return self._descs[next(iter(positions))]
+            else:
+                pos = self._ddid_index.get(dd_type + oid)
+                if pos is not None:
+                    return self._descs[pos]
             return None
 
+    def _map_table(self, to_oid: bool, dd_type: str = None):
+        # 批量映射所用的查找表，由索引中能唯一确定的项构成，增删后重新构建
+        with self._mutex:
+            key = (to_oid, dd_type)
+            if key not in self._map_tables:
+                if to_oid and (dd_type is None):
+                    items = self._desc_index.items()
+                elif to_oid:
+                    items = [(desc, positions) for (item, desc), positions in self._type_desc_index.items() if item == dd_type]
+                elif dd_type is None:
+                    items = self._oid_index.items()
+                else:
+                    items = [(self._ddids[pos][1:], [pos]) for pos in self._type_index.get(dd_type, {})]
+                keys = []
+                values = []
+                for item, positions in items:
+                    if 1 == len(positions):
+                        pos = next(iter(positions))
+                        keys.append(item)
+                        values.append(self._ddids[pos][1:] if to_oid else self._descs[pos])
+                self._map_tables[key] = (pd.Index(keys, dtype=object), np.array(values, dtype=object))
+            return self._map_tables[key]
+
+    def map_oid_many(self, descs, dd_type: str = None, missing=None):
+        """批量map_oid，返回与descs对齐的数组，无法唯一确定的项为missing"""
+        keys, values = self._map_table(True, dd_type)
+        return _map_many(keys, values, descs, missing)
+
+    def map_desc_many(self, oids, dd_type: str = None, missing=None):
+        """批量map_desc，返回与oids对齐的数组，无法唯一确定的项为missing"""
+        keys, values = self._map_table(False, dd_type)
+        return _map_many(keys, values, oids, missing)
+
 
 class DataFragments(object):
     def __init__(self, service_id: str):
@@ -188,20 +594,33 @@ class DataFragments(object):
         self.load_data()
 
     def load_data(self):
-        dd = DataDictionary(self.sid)
+        dd = DataDictionary.shared(self.sid)
         keys = dd.query(dd_type=self._key_type)
         values = dd.query(dd_type=self._value_type)
         label_01 = keys.copy()
-        label_01[FIELD_OID] = label_01[FIELD_DDID].apply(lambda x: x[1:])
+        label_01[FIELD_OID] = label_01[FIELD_DDID].str[1:]
         label_01.drop(columns=[FIELD_DDID, FIELD_OID_MASK], inplace=True)
         label_01[FIELD_MASK] = 0
         label_02 = values.copy()
-        label_02[FIELD_OID] = label_02[FIELD_OID_MASK].apply(lambda x: x[0:16])
+        label_02[FIELD_OID] = label_02[FIELD_OID_MASK].str[0:OID_LEN]
         label_02[FIELD_MASK] = label_02[FIELD_OID_MASK].apply(lambda x: int(x[16:], 16))
         label_02.drop(columns=[FIELD_DDID, FIELD_OID_MASK], inplace=True)
         self._labels = pd.concat([label_01, label_02])
         self._labels.reset_index(drop=True, inplace=True)
         self._data = self._labels.sort_values(FIELD_MASK).drop_duplicates(FIELD_OID, keep='last').set_index(FIELD_OID).to_dict()[FIELD_MASK]
+        # desc到oid的查找表：只保留对应唯一oid的desc
+        pairs = self._labels[[FIELD_DESC, FIELD_OID]].drop_duplicates()
+        pairs = pairs[~pairs[FIELD_DESC].duplicated(keep=False)]
+        self._oid_table = pd.Series(pairs[FIELD_OID].values, index=pd.Index(pairs[FIELD_DESC].values, dtype=object))
+        self._desc_tables = {}
+
+    def _desc_table(self, mask: int):
+        # 按mask缓存oid到desc的查找表：只保留(oid, mask)对应唯一一行的oid
+        if mask not in self._desc_tables:
+            labels = self._labels[self._labels[FIELD_MASK] == mask]
+            labels = labels[~labels[FIELD_OID].duplicated(keep=False)]
+            self._desc_tables[mask] = pd.Series(labels[FIELD_DESC].values, index=pd.Index(labels[FIELD_OID].values, dtype=object))
+        return self._desc_tables[mask]
 
     def exists(self, desc: str, mask: int = 0):
         oid = self.oid(desc)
@@ -221,18 +640,19 @@ class DataFragments(object):
         return oid in self._data
 
     def desc(self, oid: str, mask: int = 0):
-        res = self._labels[(self._labels[FIELD_OID] == oid) & (self._labels[FIELD_MASK] == mask)][FIELD_DESC].tolist()
-        if 1 == len(res):
-            return res[0]
-        else:
-            return BLANK
+        return self._desc_table(mask).get(oid, BLANK)
 
     def oid(self, desc: str):
-        res = self._labels[(self._labels[FIELD_DESC] == desc)].drop_duplicates(FIELD_OID, keep='last')[FIELD_OID].tolist()
-        if 1 == len(res):
-            return res[0]
-        else:
-            return None
+        return self._oid_table.get(desc)
+
+    def map_oid_many(self, descs, missing=None):
+        """批量oid，返回与descs对齐的数组，无法唯一确定的项为missing"""
+        return _map_many(self._oid_table.index, self._oid_table.values, descs, missing)
+
+    def map_desc_many(self, oids, mask: int = 0, missing=BLANK):
+        """批量desc，返回与oids对齐的数组，无法唯一确定的项为missing"""
+        table = self._desc_table(mask)
+        return _map_many(table.index, table.values, oids, missing)
 
     @abstractmethod
     def init_key_and_value(self):
@@ -281,7 +701,7 @@ class TimeDataUnit(DataUnit):
     _metrics = {}
 
     def __init__(self, ddid: str):
-        ddid_obj = DataDictionaryId(ddid=ddid)
+        ddid_obj = DataDictionaryId.intern(ddid)
         if ddid_obj.dd_type == DD_TYPE_OWNER:
             self._ddid = ddid_obj
             TimeDataUnit.add_metrics(ddid_obj.sid)
@@ -328,7 +748,22 @@ class TimeDataUnit(DataUnit):
     def _after_sync(self):
         self.reset_metrics()
 
-    def query(self, **kwargs):
+    def import_data(self, filename, **kwargs):
+        """文件的列名可以是指标oid或指标描述，指标描述统一映射为oid后写入"""
+        if kwargs.get(KEY_COLUMNS) is None:
+            kwargs[KEY_COLUMNS] = self._import_columns()
+        return super().import_data(filename, **kwargs)
+
+    def _import_columns(self):
+        # 指标描述到oid的映射；没有描述的指标（map_desc返回BLANK）不参与映射
+        columns = {}
+        for oid in self.metrics.value:
+            desc = self.map_desc(oid)
+            if BLANK != desc:
+                columns[desc] = oid
+        return columns
+
+    def _query_args(self, **kwargs):
         fields = [FIELD_TIMESTAMP]
         if (KEY_METRIC in kwargs) and PV_TDU_QUERY.validate(KEY_METRIC, kwargs[KEY_METRIC]):
             for oid in kwargs[KEY_METRIC]:
@@ -340,42 +775,112 @@ class TimeDataUnit(DataUnit):
                 if oid is not None:
                     fields.append(oid)
         condition = None
+        params = None
         if (KEY_INTERVAL in kwargs) and PV_TDU_QUERY.validate(KEY_INTERVAL, kwargs[KEY_INTERVAL]):
-            c = FIELD_TIMESTAMP + " >= '{0}' AND " + FIELD_TIMESTAMP + " <= '{1}'"
+            condition = FIELD_TIMESTAMP + ' >= ? AND ' + FIELD_TIMESTAMP + ' <= ?'
             date_from = moment(kwargs[KEY_INTERVAL][KEY_FROM]).format(MOMENT_FORMAT)
             date_to = moment(kwargs[KEY_INTERVAL][KEY_TO]).format(MOMENT_FORMAT)
-            condition = c.format(*[date_from, date_to])
+            params = (date_from, date_to)
         else:
             if (KEY_ANY in kwargs) and PV_TDU_QUERY.validate(KEY_ANY, kwargs[KEY_ANY]):
-                claus = []
-                c = FIELD_TIMESTAMP + " = '{0}'"
-                for item in kwargs[KEY_ANY]:
-                    claus.append(c.format(*[moment(item).format(MOMENT_FORMAT)]))
-                condition = ' OR '.join(claus)
+                params = tuple([moment(item).format(MOMENT_FORMAT) for item in kwargs[KEY_ANY]])
+                condition = FIELD_TIMESTAMP + ' IN (' + ', '.join(['?'] * len(params)) + ')'
         if 1 == len(fields):
             fields = None
-        res = self._db.query(self._table_name, fields, condition)
+        return fields, condition, params
+
+    def _query_post(self, res):
         res[FIELD_TIMESTAMP] = pd.to_datetime(res[FIELD_TIMESTAMP], unit='s') + self._db.timezone
         res.set_index(FIELD_TIMESTAMP, drop=True, inplace=True)
         res = res.apply(pd.to_numeric)
+        if res.empty:
+            # 空结果无从推断类型，与arrow的结果一致按float64处理
+            res = res.astype(np.float64)
         return res
 
+    def _query_post_arrow(self, res):
+        # 与_query_post相同的转换，全程在Arrow列上完成
+        offset = int(self._db.timezone / pd.Timedelta(milliseconds=1))
+        ts = pc.cast(res.column(FIELD_TIMESTAMP), pa.float64())
+        ts = pc.add(pc.cast(pc.round(pc.multiply(ts, 1000)), pa.int64()), offset)
+        names = [FIELD_TIMESTAMP]
+        columns = [pc.cast(pc.multiply(ts, 1000000), pa.timestamp('ns'))]
+        for name in res.schema.names:
+            if FIELD_TIMESTAMP != name:
+                column = res.column(name)
+                if pa.types.is_string(column.type):
+                    column = pc.if_else(pc.equal(column, ''), pa.scalar(None, pa.string()), column)
+                    column = pc.cast(column, pa.float64())
+                elif pa.types.is_null(column.type):
+                    column = pc.cast(column, pa.float64())
+                names.append(name)
+                columns.append(column)
+        return pa.Table.from_arrays(columns, names=names)
+
+    @staticmethod
+    def to_pandas(res):
+        """将return_type为arrow的查询结果转为与query默认返回值一致的DataFrame"""
+        res = res.to_pandas()
+        res.set_index(FIELD_TIMESTAMP, drop=True, inplace=True)
+        return res
+
+    @staticmethod
+    def _return_type(**kwargs):
+        if (KEY_RETURN_TYPE in kwargs) and PV_TDU_QUERY.validate(KEY_RETURN_TYPE, kwargs[KEY_RETURN_TYPE]):
+            return kwargs[KEY_RETURN_TYPE]
+        return RETURN_TYPE_PANDAS
+
+    def query_iter(self, **kwargs):
+        """参数同query，逐块返回处理后的结果，每块不超过chunk_rows行；内存中只保留当前块，大表请用此方法逐块处理。
+        迭代期间持有DBHandler.query_iter的只读连接，注意事项见该方法"""
+        chunk_rows = CHUNK_ROWS_DEFAULT
+        if (KEY_CHUNK_ROWS in kwargs) and PV_TDU_QUERY.validate(KEY_CHUNK_ROWS, kwargs[KEY_CHUNK_ROWS]):
+            chunk_rows = kwargs[KEY_CHUNK_ROWS]
+        return_type = self._return_type(**kwargs)
+        fields, condition, params = self._query_args(**kwargs)
+        for res in self._db.query_iter(self._table_name, fields, condition, params, chunk_rows, return_type):
+            if RETURN_TYPE_ARROW == return_type:
+                yield self._query_post_arrow(res)
+            else:
+                yield self._query_post(res)
+
+    def query(self, **kwargs):
+        """指定chunk_rows时分块读取并逐块转换后合并，合并时各块与结果同时驻留内存，峰值约为结果的两倍，
+        无须一次取得全部结果时请使用query_iter；
+        return_type为arrow时返回pyarrow.Table（timestamp为普通列），可用to_pandas按需转换"""
+        return_type = self._return_type(**kwargs)
+        if KEY_CHUNK_ROWS in kwargs:
+            if RETURN_TYPE_ARROW == return_type:
+                return pa.concat_tables(list(self.query_iter(**kwargs)), promote_options='permissive')
+            return pd.concat(list(self.query_iter(**kwargs)))
+        fields, condition, params = self._query_args(**kwargs)
+        res = self._db.query(self._table_name, fields, condition, params, return_type)
+        if RETURN_TYPE_ARROW == return_type:
+            return self._query_post_arrow(res)
+        return self._query_post(res)
+
     def add(self, **kwargs):
         if (KEY_TS in kwargs) and PV_TDU_ADD.validate(KEY_TS, kwargs[KEY_TS]):
             data = {}
             if (KEY_DATA_DESC in kwargs) and PV_TDU_ADD.validate(KEY_DATA_DESC, kwargs[KEY_DATA_DESC]):
-                dd = DataDictionary(self.sid)
-                for key, value in kwargs[KEY_DATA_DESC].items():
-                    if self.metrics.exists(key):
-                        data[self.metrics.oid(key)] = value
-                    else:
-                        ddid = dd.add(dd_type=DD_TYPE_METRIC, desc=key)
-                        oid = ddid[1:]
-                        self._db.add_column(self._table_name, oid, 'INT')
-                        self.reset_metrics(True)
-                        data[oid] = value
-                data[FIELD_TIMESTAMP] = moment(kwargs[KEY_TS]).format(MOMENT_FORMAT)
-                self._db.add(data, self._table_name)
+                try:
+                    with self._db.transaction():
+                        dd = DataDictionary.shared(self.sid)
+                        for key, value in kwargs[KEY_DATA_DESC].items():
+                            if self.metrics.exists(key):
+                                data[self.metrics.oid(key)] = value
+                            else:
+                                ddid = dd.add(dd_type=DD_TYPE_METRIC, desc=key)
+                                oid = ddid[1:]
+                                self._db.add_column(self._table_name, oid, 'INT')
+                                self.reset_metrics(True)
+                                data[oid] = value
+                        data[FIELD_TIMESTAMP] = moment(kwargs[KEY_TS]).format(MOMENT_FORMAT)
+                        self._db.add(data, self._table_name)
+                except Exception:
+                    # 新增的指标及字段已随事务回滚，缓存的Metrics需重新加载
+                    self.reset_metrics(True)
+                    raise
             else:
                 if (KEY_DATA in kwargs) and PV_TDU_ADD.validate(KEY_DATA, kwargs[KEY_DATA]):
                     for key, value in kwargs[KEY_DATA].items():
@@ -391,14 +896,13 @@ class TimeDataUnit(DataUnit):
     def remove(self, ts):
         if isinstance(ts, str):
             ts_value = moment(ts).format(MOMENT_FORMAT)
-            self._db.remove(self._table_name, FIELD_TIMESTAMP + '="' + ts_value + '"')
+            self._db.remove(self._table_name, FIELD_TIMESTAMP + ' = ?', (ts_value,))
         else:
             if isinstance(ts, dict) and PV_TDU_REMOVE.validate(KEY_TS, ts):
-                c = FIELD_TIMESTAMP + " >= '{0}' AND " + FIELD_TIMESTAMP + " <= '{1}'"
+                condition = FIELD_TIMESTAMP + ' >= ? AND ' + FIELD_TIMESTAMP + ' <= ?'
                 date_from = moment(ts[KEY_FROM]).format(MOMENT_FORMAT)
                 date_to = moment(ts[KEY_TO]).format(MOMENT_FORMAT)
-                condition = c.format(*[date_from, date_to])
-                self._db.remove(self._table_name, condition)
+                self._db.remove(self._table_name, condition, (date_from, date_to))
             else:
                 raise ValueError(logger.warning([2002]))
 
@@ -422,18 +926,21 @@ class SpaceDataUnit(DataUnit):
         return self.tags.desc(oid)
 
     def init_data(self):
-        dd = DataDictionary(self.sid)
+        dd = DataDictionary.shared(self.sid)
         tags = {}
         for tag in self.tags.value:
             tags[tag] = 0
+        rows = []
         for owner in dd.query(True, dd_type=DD_TYPE_OWNER):
             data = tags.copy()
             data[FIELD_OWNER] = owner
-            self._db.add(data, self._table_name)
+            rows.append(data)
+        self._db.add_many(rows, self._table_name)
 
     def _query_condition_for_owner(self, **kwargs):
         condition = BLANK
-        dd = DataDictionary(self.sid)
+        params = []
+        dd = DataDictionary.shared(self.sid)
         owner_condition = []
         op = ' OR '
         if 'and' == kwargs[KEY_OWNER][KEY_OP]:
@@ -443,30 +950,36 @@ class SpaceDataUnit(DataUnit):
         if KEY_DATA in kwargs[KEY_OWNER]:
             for item in kwargs[KEY_OWNER][KEY_DATA]:
                 if 'eq' in item:
-                    owner_condition.append(FIELD_OWNER + '="' + item['eq'] + '"')
+                    owner_condition.append(FIELD_OWNER + ' = ?')
+                    params.append(item['eq'])
                 if 'ne' in item:
-                    owner_condition.append(FIELD_OWNER + '!="' + item['ne'] + '"')
+                    owner_condition.append(FIELD_OWNER + ' != ?')
+                    params.append(item['ne'])
         if KEY_DATA_DESC in kwargs[KEY_OWNER]:
             for item in kwargs[KEY_OWNER][KEY_DATA_DESC]:
                 if 'eq' in item:
                     v = dd.map_oid(item['eq'], DD_TYPE_OWNER)
                     if v is not None:
-                        owner_condition.append(FIELD_OWNER + '="' + v + '"')
+                        owner_condition.append(FIELD_OWNER + ' = ?')
+                        params.append(v)
                 if 'ne' in item:
                     v = dd.map_oid(item['ne'], DD_TYPE_OWNER)
                     if v is not None:
-                        owner_condition.append(FIELD_OWNER + '!="' + v + '"')
+                        owner_condition.append(FIELD_OWNER + ' != ?')
+                        params.append(v)
         condition = condition + op.join(owner_condition)
-        return condition
+        return condition, params
 
     def query(self, oid_only=True, **kwargs):
         if (KEY_TAG in kwargs) and PV_SDU_QUERY.validate(KEY_TAG, kwargs[KEY_TAG]):
             condition = BLANK
+            params = None
             if (KEY_OWNER in kwargs) and PV_SDU_QUERY.validate(KEY_OWNER, kwargs[KEY_OWNER]):
-                condition = self._query_condition_for_owner(**kwargs)
+                condition, params = self._query_condition_for_owner(**kwargs)
             if BLANK == condition:
                 condition = None
-            df = self._db.query(self._table_name, None, condition)
+                params = None
+            df = self._db.query(self._table_name, None, condition, params)
             if df.empty:
                 return None
             else:
@@ -519,8 +1032,8 @@ class SpaceDataUnit(DataUnit):
                     return None
         else:
             if (KEY_OWNER in kwargs) and PV_SDU_QUERY.validate(KEY_OWNER, kwargs[KEY_OWNER]):
-                condition = self._query_condition_for_owner(**kwargs)
-                df = self._db.query(self._table_name, None, condition)
+                condition, params = self._query_condition_for_owner(**kwargs)
+                df = self._db.query(self._table_name, None, condition, params)
                 if df.empty:
                     return None
                 else:
@@ -550,7 +1063,7 @@ class SpaceDataUnit(DataUnit):
 
     def add(self, **kwargs):
         if (KEY_OWNER in kwargs) and PV_SDU_ADD.validate(KEY_OWNER, kwargs[KEY_OWNER]):
-            dd = DataDictionary(self.sid)
+            dd = DataDictionary.shared(self.sid)
             if PV_ID.validate(KEY_OID, kwargs[KEY_OWNER]):
                 if dd.map_desc(kwargs[KEY_OWNER], DD_TYPE_OWNER) is None:
                     raise ValueError(logger.error([2502, kwargs[KEY_OWNER]]))
@@ -560,17 +1073,18 @@ class SpaceDataUnit(DataUnit):
                 owner = dd.map_oid(kwargs[KEY_OWNER], DD_TYPE_OWNER)
             if owner is None:
                 raise ValueError(logger.error([2502, kwargs[KEY_OWNER]]))
-            res = self.query(oid_only=False, owner={'op': 'and', 'data': [{'eq': owner}]})
-            if (res is not None) and (res.shape[0] == 1):
-                data = self._add_pre(res.to_dict('records')[0], **kwargs)
-                self._db.remove(self._table_name, FIELD_OWNER + '="' + owner + '"')
-                self._db.add(data, self._table_name)
-            else:
-                data = {FIELD_OWNER: owner}
-                for tag in self.tags.value:
-                    data[tag] = 0
-                data = self._add_pre(data, **kwargs)
-                self._db.add(data, self._table_name)
+            with self._db.transaction():
+                res = self.query(oid_only=False, owner={'op': 'and', 'data': [{'eq': owner}]})
+                if (res is not None) and (res.shape[0] == 1):
+                    data = self._add_pre(res.to_dict('records')[0], **kwargs)
+                    self._db.remove(self._table_name, FIELD_OWNER + ' = ?', (owner,))
+                    self._db.add(data, self._table_name)
+                else:
+                    data = {FIELD_OWNER: owner}
+                    for tag in self.tags.value:
+                        data[tag] = 0
+                    data = self._add_pre(data, **kwargs)
+                    self._db.add(data, self._table_name)
         else:
             raise ValueError(logger.error([2501]))
 
@@ -591,7 +1105,7 @@ class SpaceDataUnit(DataUnit):
 
     def remove(self, **kwargs):
         if (KEY_OWNER in kwargs) and PV_SDU_REMOVE.validate(KEY_OWNER, kwargs[KEY_OWNER]):
-            dd = DataDictionary(self.sid)
+            dd = DataDictionary.shared(self.sid)
             if PV_ID.validate(KEY_OID, kwargs[KEY_OWNER]):
                 if dd.map_desc(kwargs[KEY_OWNER], DD_TYPE_OWNER) is None:
                     raise ValueError(logger.error([2503, kwargs[KEY_OWNER]]))
@@ -601,16 +1115,17 @@ class SpaceDataUnit(DataUnit):
                 owner = dd.map_oid(kwargs[KEY_OWNER], DD_TYPE_OWNER)
             if owner is None:
                 raise ValueError(logger.error([2503, kwargs[KEY_OWNER]]))
-            res = self.query(oid_only=False, owner={'op': 'and', 'data': [{'eq': owner}]})
-            if (res is not None) and (res.shape[0] == 1):
-                data = self._remove_pre(res.to_dict('records')[0], **kwargs)
-                self._db.remove(self._table_name, FIELD_OWNER + '="' + owner + '"')
-                self._db.add(data, self._table_name)
-            else:
-                data = {FIELD_OWNER: owner}
-                for tag in self.tags.value:
-                    data[tag] = 0
-                self._db.add(data, self._table_name)
+            with self._db.transaction():
+                res = self.query(oid_only=False, owner={'op': 'and', 'data': [{'eq': owner}]})
+                if (res is not None) and (res.shape[0] == 1):
+                    data = self._remove_pre(res.to_dict('records')[0], **kwargs)
+                    self._db.remove(self._table_name, FIELD_OWNER + ' = ?', (owner,))
+                    self._db.add(data, self._table_name)
+                else:
+                    data = {FIELD_OWNER: owner}
+                    for tag in self.tags.value:
+                        data[tag] = 0
+                    self._db.add(data, self._table_name)
         else:
             raise ValueError(logger.error([2504]))
 
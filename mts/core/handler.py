@@ -1,13 +1,34 @@
 import csv
+import gzip
+import json
 import yaml
+import queue
 import sqlite3
+import threading
+import itertools
 import connectorx as cx
+import numpy as np
 import pandas as pd
 from os import path
+from time import perf_counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+from collections import OrderedDict
 from mts.commons import logger, Singleton
 from mts.commons.const import *
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pc = None
+    pa_csv = None
+    pq = None
+
 
 class DataFileHandler(object):
 
@@ -30,14 +51,213 @@ class DataFileHandler(object):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
 
+    @staticmethod
+    def open_text(filename, mode='r'):
+        """以文本方式打开文件，.gz文件自动解压/压缩"""
+        if filename.endswith('.gz'):
+            return gzip.open(filename, mode + 't', newline='')
+        return open(filename, mode, newline='')
+
+    @staticmethod
+    def verify_manifest(filename):
+        """按export_service生成的清单校验导出文件，全部一致时返回True"""
+        manifest = DataFileHandler.load_json(filename)
+        if manifest is None:
+            return False
+        res = True
+        for item in manifest['tables']:
+            data_filename = path.join(path.dirname(filename), item['file'])
+            if (not path.exists(data_filename)) or (DataFileHandler.checksum(data_filename) != item['checksum']):
+                logger.warning([5902, data_filename])
+                res = False
+        return res
+
+
+def apply_pragmas(conn, pragmas: dict, writer: bool = True):
+    """在连接上执行性能配置中的pragma；journal_mode为数据库级设置，仅由写连接执行"""
+    for key, value in pragmas.items():
+        if (not writer) and (key == 'journal_mode'):
+            continue
+        conn.execute('PRAGMA {} = {}'.format(key, value))
+    return conn
+
+
+class ConnectionPool(object):
+    """SQLite只读连接池：按需创建，最多size个连接，连接用尽时阻塞等待并统计等待时间"""
+
+    def __init__(self, db_path: str, size: int = POOL_SIZE_DEFAULT, cached_statements: int = CACHED_STATEMENTS_DEFAULT,
+                 pragmas: dict = None):
+        self._db_path = db_path
+        self._size = size
+        self._cached_statements = cached_statements
+        self._pragmas = {} if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._conns = set()  # 已创建且尚未关闭的全部连接，含使用中的连接
+        self._closed = False
+        self._lock = threading.Lock()
+        self._metrics = {'acquire': 0, 'wait': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def created(self):
+        return self._created
+
+    @property
+    def metrics(self):
+        with self._lock:
+            return self._metrics.copy()
+
+    def acquire(self):
+        if self._closed:
+            raise ValueError(logger.error([5725]))
+        try:
+            conn = self._idle.get_nowait()
+            wait_time = None
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                create = self._created < self._size
+                if create:
+                    self._created = self._created + 1
+            if create:
+                try:
+                    conn = sqlite3.connect(self._db_path, check_same_thread=False,
+                                           cached_statements=self._cached_statements)
+                    apply_pragmas(conn, self._pragmas, False)
+                except Exception:
+                    if conn is not None:
+                        conn.close()
+                    with self._lock:
+                        self._created = self._created - 1
+                    raise
+                with self._lock:
+                    self._conns.add(conn)
+                wait_time = None
+            else:
+                start = perf_counter()
+                conn = self._idle.get()
+                wait_time = perf_counter() - start
+        if conn is None:
+            # close()放入的结束标记，留给其他等待中的线程
+            self._idle.put(None)
+            raise ValueError(logger.error([5725]))
+        with self._lock:
+            self._metrics['acquire'] = self._metrics['acquire'] + 1
+            if wait_time is not None:
+                self._metrics['wait'] = self._metrics['wait'] + 1
+                self._metrics['wait_time'] = self._metrics['wait_time'] + wait_time
+                self._metrics['max_wait_time'] = max(self._metrics['max_wait_time'], wait_time)
+        return conn
+
+    def release(self, conn):
+        # 连接池关闭后归还的连接直接关闭；放回空闲队列与close()互斥，保证不会遗漏
+        with self._lock:
+            if not self._closed:
+                self._idle.put(conn)
+                return
+            self._conns.discard(conn)
+            self._created = self._created - 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """关闭连接池：空闲连接立即关闭，使用中的连接在归还时关闭"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+                with self._lock:
+                    self._conns.discard(conn)
+                    self._created = self._created - 1
+        # 唤醒等待空闲连接的线程
+        self._idle.put(None)
+
+
+class CancelToken(object):
+    """取消标记：在DBHandler.cancel_scope内经由连接池执行的只读查询登记于此，cancel时逐一中断；
+    取消后再获取只读连接将直接抛出sqlite3.OperationalError"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns = []
+        self._cancelled = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            for conn in self._conns:
+                conn.interrupt()
+
+    def attach(self, conn):
+        with self._lock:
+            if self._cancelled:
+                raise sqlite3.OperationalError('interrupted')
+            self._conns.append(conn)
+
+    def detach(self, conn):
+        # 与cancel互斥：连接归还连接池后不会再被中断
+        with self._lock:
+            self._conns.remove(conn)
+
 
 class DBHandler(Singleton):
     _db_url = None  # sqlite:///path/to/db
     _connection = None
+    _pool = None
+    _profile = PROFILE_DEFAULT
+    _catalog = None  # {table_name: [field, ...]}，字段列表按需加载
+    _schema_version = None
+    _cx_retry_interval = CX_RETRY_INTERVAL
+    _backends_max_size = BACKENDS_MAX_SIZE
     timezone = None
 
-    def __init__(self, db_url: str = None, timezone: str = DEFAULT_TZ):
+    def __init__(self, db_url: str = None, timezone: str = DEFAULT_TZ, pool_size: int = POOL_SIZE_DEFAULT,
+                 cached_statements: int = CACHED_STATEMENTS_DEFAULT, profile: str = PROFILE_DEFAULT,
+                 schema_check: bool = True):
         super().__init__()
+        self._schema_check = schema_check
+        if isinstance(pool_size, int) and pool_size > 0:
+            self._pool_size = pool_size
+        else:
+            raise ValueError(logger.error([5709, pool_size]))
+        if isinstance(cached_statements, int) and cached_statements >= 0:
+            self._cached_statements = cached_statements
+        else:
+            raise ValueError(logger.error([5710, cached_statements]))
+        self._lock = threading.RLock()
+        self._tx_depth = 0
+        self._tx_owner = None
+        self._rollback_hooks = []
+        self._writer_metrics = {'acquire': 0, 'commit': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+        self._engine_lock = threading.Lock()
+        self._engine_metrics = {}
+        for engine in [ENGINE_CX, ENGINE_SQLITE]:
+            self._engine_metrics[engine] = {'count': 0, 'error': 0, 'time': 0.0}
+        self._backends = OrderedDict()  # {(sql, return_type): (engine, 重试connectorx的时间)}
+        self._cx_enabled = True
+        self._local = threading.local()
+        self._generation = 0
+        self.set_profile(profile)
         if db_url is not None:
             self.register(db_url)
         if self.set_timezone(timezone):
@@ -45,6 +265,20 @@ class DBHandler(Singleton):
         else:
             raise ValueError(logger.warning([5708, timezone]))
 
+    def _reuse(self, db_url: str = None, timezone: str = None, pool_size: int = None, cached_statements: int = None,
+               profile: str = None, schema_check: bool = None):
+        # DBHandler为单例，再次构造时profile与timezone转由set_profile/set_timezone生效，其他参数不一致时给出警告
+        if (profile is not None) and (profile != self._profile):
+            self.set_profile(profile)
+        if (timezone is not None) and (not self.set_timezone(timezone)):
+            raise ValueError(logger.warning([5708, timezone]))
+        if (db_url is not None) and (db_url != self._db_url):
+            logger.warning([5724, 'db_url', db_url, self._db_url, '切换数据库请使用register'])
+        for name, value in [('pool_size', pool_size), ('cached_statements', cached_statements),
+                            ('schema_check', schema_check)]:
+            if (value is not None) and (value != getattr(self, '_' + name)):
+                logger.warning([5724, name, value, getattr(self, '_' + name), '该参数仅在首次构造时生效'])
+
     def set_timezone(self, timezone: str = DEFAULT_TZ):
         if PV_TZ.validate('timezone', timezone):
             self.timezone = pd.Timedelta(timezone + ':00')
@@ -52,11 +286,51 @@ class DBHandler(Singleton):
         else:
             return False
 
-    def register(self, db_url: str):
+    def set_profile(self, profile: str):
+        """设置SQLite性能配置，已建立的连接将被关闭，下次使用时按新配置重新建立。
+        default不执行任何pragma：连接级设置恢复SQLite默认值，但journal_mode保存在数据库文件中，
+        已切换为WAL的数据库仍保持WAL，需要时请自行执行PRAGMA journal_mode = DELETE"""
+        if profile in SQLITE_PROFILES:
+            self._profile = profile
+            self.disconnect()
+        else:
+            raise ValueError(logger.error([5711, profile, ', '.join(SQLITE_PROFILES.keys())]))
+
+    @property
+    def profile(self):
+        return self._profile
+
+    @property
+    def pragmas(self):
+        return SQLITE_PROFILES[self._profile]
+
+    @property
+    def generation(self):
+        """切换数据库或事务回滚时递增，内存中的缓存据此判断是否失效"""
+        return self._generation
+
+    def register(self, db_url: str, profile: str = None):
         self._db_url = db_url
-        self.disconnect()
+        with self._engine_lock:
+            self._backends = OrderedDict()
+        self._generation = self._generation + 1
+        if profile is None:
+            self.disconnect()
+        else:
+            self.set_profile(profile)
 
-    def query(self, table_name: str, fields: list = None, condition: str = None):
+    @staticmethod
+    def _params(params):
+        # sqlite3无法绑定numpy标量，需转换为Python原生类型
+        res = []
+        for value in params:
+            if isinstance(value, np.generic):
+                value = value.item()
+            res.append(value)
+        return tuple(res)
+
+    @staticmethod
+    def _select_sql(table_name: str, fields: list = None, condition: str = None):
         sql = 'SELECT '
         if fields is None:
             sql = sql + '* from ' + table_name
@@ -64,123 +338,634 @@ class DBHandler(Singleton):
             sql = sql + ', '.join(fields) + ' from ' + table_name
         if condition is not None:
             sql = sql + ' WHERE ' + condition
-        try:
-            result = cx.read_sql(self._db_url, sql)
-        except (ModuleNotFoundError, AttributeError, ValueError, TypeError, RuntimeError) as e:
-            result = pd.read_sql_query(sql, self.connect())
+        return sql
+
+    @staticmethod
+    def _check_return_type(return_type: str):
+        if return_type not in RETURN_TYPES:
+            raise ValueError(logger.error([5713, return_type, ', '.join(RETURN_TYPES)]))
+        if (RETURN_TYPE_ARROW == return_type) and (pa is None):
+            raise ValueError(logger.error([5714]))  # pragma: no cover
+
+    @staticmethod
+    def _arrow_arrays(rows: list, n_columns: int):
+        # 按列构建Arrow数组；同一列中类型混杂（如INT列中的空字符串）时整列按字符串处理
+        arrays = []
+        for values in (zip(*rows) if rows else [[]] * n_columns):
+            values = list(values)
+            try:
+                arrays.append(pa.array(values))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                arrays.append(pa.array([None if value is None else str(value) for value in values], pa.string()))
+        return arrays
+
+    @staticmethod
+    def _arrow_table(batches: list, columns: list):
+        # 各批分别推断类型，同一列各批类型不一致时统一：数值列按float64处理，其他混杂类型整列按字符串处理
+        arrays = []
+        for i in range(len(columns)):
+            chunks = [batch[i] for batch in batches]
+            types = set([chunk.type for chunk in chunks if not pa.types.is_null(chunk.type)])
+            if len(types) <= 1:
+                target = types.pop() if types else pa.null()
+            elif all([pa.types.is_integer(item) or pa.types.is_floating(item) for item in types]):
+                target = pa.float64()
+            else:
+                target = pa.string()
+            arrays.append(pa.chunked_array([chunk.cast(target) for chunk in chunks], target))
+        return pa.Table.from_arrays(arrays, names=columns)
+
+    def _query_sqlite(self, sql: str, params, return_type: str):
+        with self.reader() as conn:
+            if RETURN_TYPE_ARROW != return_type:
+                return pd.read_sql_query(sql, conn, params=params)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, () if params is None else params)
+                columns = [item[0] for item in cursor.description]
+                # 分批读取并逐批转为Arrow数组，内存中只保留一批行的Python对象
+                batches = []
+                while True:
+                    rows = cursor.fetchmany(CHUNK_ROWS_DEFAULT)
+                    if (not rows) and batches:
+                        break
+                    batches.append(self._arrow_arrays(rows, len(columns)))
+                    if len(rows) < CHUNK_ROWS_DEFAULT:
+                        break
+            finally:
+                cursor.close()
+        return self._arrow_table(batches, columns)
+
+    def _count_engine(self, engine: str, cost: float, error: bool = False):
+        with self._engine_lock:
+            metrics = self._engine_metrics[engine]
+            metrics['time'] = metrics['time'] + cost
+            if error:
+                metrics['error'] = metrics['error'] + 1
+            else:
+                metrics['count'] = metrics['count'] + 1
+
+    def query(self, table_name: str, fields: list = None, condition: str = None, params=None,
+              return_type: str = RETURN_TYPE_PANDAS):
+        """condition中可使用?占位符，对应取值由params给出；带params的查询经由连接池执行以复用预编译语句；
+        return_type为arrow时返回pyarrow.Table，不经过pandas转换"""
+        self._check_return_type(return_type)
+        sql = self._select_sql(table_name, fields, condition)
+        if params is not None:
+            params = self._params(params)
+        # 按查询形态记录执行引擎：connectorx失败过的查询直接由sqlite3执行，避免重复执行
+        shape = (sql, return_type)
+        # connectorx的查询无法中断，可取消的调用一律由sqlite3执行
+        if self._cx_enabled and (params is None) and (not self.in_transaction()) and \
+                (self.cancel_token() is None) and (self._backend(shape) != ENGINE_SQLITE):
+            start = perf_counter()
+            try:
+                result = cx.read_sql(self._db_url, sql, return_type=return_type)
+                self._count_engine(ENGINE_CX, perf_counter() - start)
+                self._set_backend(shape, ENGINE_CX)
+                return result
+            except (ImportError, AttributeError, TypeError) as e:
+                # 与数据无关的错误（依赖缺失、版本不兼容），任何查询重试都不会成功，整个DBHandler停用connectorx
+                self._count_engine(ENGINE_CX, perf_counter() - start, True)
+                self._cx_enabled = False
+                logger.warning([5715, sql, e])
+            except (ValueError, RuntimeError) as e:
+                # 与当前数据有关的错误（如无法推断列类型），一段时间后重新尝试
+                self._count_engine(ENGINE_CX, perf_counter() - start, True)
+                self._set_backend(shape, ENGINE_SQLITE, perf_counter() + self._cx_retry_interval)
+                logger.warning([5723, sql, self._cx_retry_interval, e])
+        start = perf_counter()
+        result = self._query_sqlite(sql, params, return_type)
+        self._count_engine(ENGINE_SQLITE, perf_counter() - start)
         return result
 
+    @property
+    def cx_enabled(self):
+        """是否尝试使用connectorx执行查询；运行环境不支持时停用"""
+        return self._cx_enabled
+
+    def _backend(self, shape: tuple):
+        with self._engine_lock:
+            item = self._backends.get(shape)
+            if item is None:
+                return None
+            engine, retry_at = item
+            if (retry_at is not None) and (perf_counter() >= retry_at):
+                del self._backends[shape]
+                return None
+            self._backends.move_to_end(shape)
+            return engine
+
+    def _set_backend(self, shape: tuple, engine: str, retry_at: float = None):
+        # 只保留最近使用的_backends_max_size种查询形态
+        with self._engine_lock:
+            self._backends[shape] = (engine, retry_at)
+            self._backends.move_to_end(shape)
+            while len(self._backends) > self._backends_max_size:
+                self._backends.popitem(last=False)
+
+    @property
+    def backends(self):
+        """各查询形态(sql, return_type)当前使用的执行引擎"""
+        with self._engine_lock:
+            return {shape: item[0] for shape, item in self._backends.items()}
+
+    def query_iter(self, table_name: str, fields: list = None, condition: str = None, params=None,
+                   chunk_rows: int = CHUNK_ROWS_DEFAULT, return_type: str = RETURN_TYPE_PANDAS):
+        """分块查询，逐块返回不超过chunk_rows行的DataFrame（return_type为arrow时为pyarrow.RecordBatch）；
+        结果为空时返回一个仅含列名的空块。
+        迭代期间（含两次取块之间）一直占用连接池中的一个只读连接，并持有该查询的读快照：
+        WAL模式下检查点无法越过该快照，WAL文件将持续增长；连接池可用连接相应减少。
+        请尽快迭代完毕，提前结束时调用close()释放"""
+        if not (isinstance(chunk_rows, int) and chunk_rows > 0):
+            raise ValueError(logger.error([5712, chunk_rows]))
+        self._check_return_type(return_type)
+        sql = self._select_sql(table_name, fields, condition)
+        if params is not None:
+            params = self._params(params)
+        with self.reader() as conn:
+            cursor = conn.cursor()
+            try:
+                if params is None:
+                    cursor.execute(sql)
+                else:
+                    cursor.execute(sql, params)
+                columns = [item[0] for item in cursor.description]
+                empty = True
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if (not rows) and (not empty):
+                        break
+                    empty = False
+                    if RETURN_TYPE_ARROW == return_type:
+                        yield pa.RecordBatch.from_arrays(self._arrow_arrays(rows, len(columns)), names=columns)
+                    else:
+                        yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                    if len(rows) < chunk_rows:
+                        break
+            finally:
+                cursor.close()
+
+    def _db_path(self):
+        if self._db_url is None:
+            raise ValueError(logger.error([5700]))
+        return self._db_url.split('://')[1]
+
     def connect(self):
+        """写连接：全局唯一，由writer()串行化使用"""
         if self._connection is None:
-            if self._db_url is None:
-                raise ValueError(logger.error([5700]))
-            db_path = self._db_url.split('://')[1]
-            self._connection = sqlite3.connect(db_path)
+            conn = sqlite3.connect(self._db_path(), check_same_thread=False, cached_statements=self._cached_statements)
+            self._connection = apply_pragmas(conn, self.pragmas)
         return self._connection
 
+    def in_transaction(self):
+        return self._tx_owner == threading.get_ident()
+
+    @contextmanager
+    def reader(self):
+        """从只读连接池中获取连接；当前线程处于事务中时使用写连接，以读取事务内尚未提交的数据"""
+        if self.in_transaction():
+            yield self.connect()
+            return
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(self._db_path(), self._pool_size, self._cached_statements, self.pragmas)
+        token = self.cancel_token()
+        with self._pool.connection() as conn:
+            if token is None:
+                yield conn
+                return
+            token.attach(conn)
+            try:
+                yield conn
+            finally:
+                token.detach(conn)
+
+    @contextmanager
+    def cancel_scope(self, token: CancelToken):
+        """当前线程在此范围内获取的只读连接登记到token，token.cancel()将中断其正在执行的查询"""
+        previous = getattr(self._local, 'token', None)
+        self._local.token = token
+        try:
+            yield token
+        finally:
+            self._local.token = previous
+
+    def cancel_token(self):
+        return getattr(self._local, 'token', None)
+
+    @contextmanager
+    def writer(self):
+        """独占写连接，成功时提交，异常时回滚"""
+        start = perf_counter()
+        with self._lock:
+            wait_time = perf_counter() - start
+            self._writer_metrics['acquire'] = self._writer_metrics['acquire'] + 1
+            self._writer_metrics['wait_time'] = self._writer_metrics['wait_time'] + wait_time
+            self._writer_metrics['max_wait_time'] = max(self._writer_metrics['max_wait_time'], wait_time)
+            cursor = self.get_cursor()
+            try:
+                yield cursor
+                if 0 == self._tx_depth:
+                    self.commit()
+            except BaseException:
+                if 0 == self._tx_depth:
+                    self.connect().rollback()
+                    self.invalidate_catalog()
+                    self._generation = self._generation + 1
+                raise
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """期间的写操作合并为一个事务，在最外层退出时统一提交（异常时回滚）"""
+        with self._lock:
+            self._tx_depth = self._tx_depth + 1
+            self._tx_owner = threading.get_ident()
+            hooks = []
+            try:
+                yield self
+                if 1 == self._tx_depth:
+                    self.commit()
+            except BaseException:
+                if 1 == self._tx_depth:
+                    self.connect().rollback()
+                    self.invalidate_catalog()
+                    self._generation = self._generation + 1
+                    hooks = self._rollback_hooks
+                raise
+            finally:
+                self._tx_depth = self._tx_depth - 1
+                if 0 == self._tx_depth:
+                    self._tx_owner = None
+                    self._rollback_hooks = []
+                for hook in hooks:
+                    try:
+                        hook()
+                    except Exception as e:
+                        logger.warning([5722, e])
+
+    def on_rollback(self, hook):
+        """在当前线程的事务中登记回滚后的回调（如恢复内存中的缓存）；事务提交时丢弃，不在事务中时忽略"""
+        if self.in_transaction() and (hook not in self._rollback_hooks):
+            self._rollback_hooks.append(hook)
+
+    @property
+    def metrics(self):
+        with self._engine_lock:
+            engine = {key: value.copy() for key, value in self._engine_metrics.items()}
+        engine['fallback'] = engine[ENGINE_CX]['error']
+        res = {'writer': self._writer_metrics.copy(), 'reader': None, 'engine': engine}
+        if self._pool is not None:
+            res['reader'] = self._pool.metrics
+        return res
+
     def get_cursor(self):
         cursor = self.connect().cursor()
         return cursor
 
     def commit(self):
         self.connect().commit()
+        self._writer_metrics['commit'] = self._writer_metrics['commit'] + 1
 
     def is_connect(self):
         return self._connection is not None
 
     def disconnect(self):
-        if self.is_connect():
-            self._connection.close()
-            self._connection = None
+        with self._lock:
+            if self.is_connect():
+                self._connection.close()
+                self._connection = None
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+            self.invalidate_catalog()
 
-    def get_fields(self, table_name: str):
-        cursor = self.get_cursor()
-        res = cursor.execute("PRAGMA table_info('" + table_name + "')").fetchall()
-        fields = []
+    def invalidate_catalog(self):
+        """清空表结构缓存，下次访问时重新从数据库加载"""
+        self._catalog = None
+        self._schema_version = None
+
+    def _load_catalog(self):
+        with self.reader() as conn:
+            version = conn.execute('PRAGMA schema_version').fetchone()[0]
+            res = conn.execute("SELECT name FROM sqlite_schema WHERE type='table'").fetchall()
+        catalog = {}
         for item in res:
-            fields.append(item[1])
-        fields.sort()
-        return fields
+            catalog[item[0]] = None
+        self._catalog = catalog
+        self._schema_version = version
+        return catalog
+
+    def _get_catalog(self):
+        catalog = self._catalog
+        if (catalog is not None) and self._schema_check:
+            # 表结构可能被其他进程或连接修改，以schema_version判断缓存是否失效
+            with self.reader() as conn:
+                version = conn.execute('PRAGMA schema_version').fetchone()[0]
+            if version != self._schema_version:
+                catalog = None
+        if catalog is None:
+            catalog = self._load_catalog()
+        return catalog
+
+    def _update_catalog(self, cursor, table_name: str, fields: list):
+        if self._catalog is not None:
+            self._catalog[table_name] = sorted(fields)
+            self._schema_version = cursor.execute('PRAGMA schema_version').fetchone()[0]
+
+    def get_fields(self, table_name: str):
+        catalog = self._get_catalog()
+        fields = catalog.get(table_name)
+        if fields is None:
+            with self.reader() as conn:
+                res = conn.execute("PRAGMA table_info('" + table_name + "')").fetchall()
+            fields = []
+            for item in res:
+                fields.append(item[1])
+            fields.sort()
+            if table_name in catalog:
+                catalog[table_name] = fields
+        return list(fields)
 
     def get_tables(self):
-        cursor = self.get_cursor()
-        res = cursor.execute("SELECT name FROM sqlite_schema WHERE type='table' ORDER BY name").fetchall()
-        tables = []
-        for item in res:
-            tables.append(item[0])
+        tables = list(self._get_catalog().keys())
         tables.sort()
         return tables
 
     def exist_table(self, table_name: str):
-        return table_name in self.get_tables()
+        return table_name in self._get_catalog()
 
-    def init_table(self, table_name: str, fields: dict):
+    def init_table(self, table_name: str, fields: dict, drop: bool = True):
+        """drop为False时只在表不存在时创建，已存在的表及其数据保持不变"""
         if self._db_url is None:
             raise ValueError(logger.error([5700]))
         else:
             if PV_DB_DEFINITION.validate('field', fields):
-                cursor = self.get_cursor()
-                # 如果存在table，先drop掉
-                sql = "SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{}'".format(table_name)
-                cursor.execute(sql)
-                if cursor.fetchone()[0] == 1:
-                    sql = "DROP TABLE {}".format(table_name)
+                with self.writer() as cursor:
+                    # 如果存在table，先drop掉；是否存在以sqlite_master为准，不依赖缓存的表结构
+                    sql = "SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{}'".format(table_name)
                     cursor.execute(sql)
-                # 创建table
-                fields_def = []
-                for key, value in fields.items():
-                    fields_def.append('[' + key + '] ' + value)
-                sql = "CREATE TABLE IF NOT EXISTS {}({})".format(table_name, ", ".join(fields_def))
-                cursor.execute(sql)
-                self.commit()
-                cursor.close()
+                    exist = cursor.fetchone()[0] == 1
+                    if exist and drop:
+                        sql = "DROP TABLE {}".format(table_name)
+                        cursor.execute(sql)
+                    # 创建table
+                    fields_def = []
+                    for key, value in fields.items():
+                        fields_def.append('[' + key + '] ' + value)
+                    sql = "CREATE TABLE IF NOT EXISTS {}({})".format(table_name, ", ".join(fields_def))
+                    cursor.execute(sql)
+                    if exist and (not drop):
+                        # 沿用已存在的表，字段在下次访问时从数据库读取
+                        self.invalidate_catalog()
+                    else:
+                        self._update_catalog(cursor, table_name, list(fields.keys()))
             else:
                 raise ValueError(logger.error([5703]))
 
-    def add(self, data: dict, table_name: str):
-        cursor = self.get_cursor()
-        keys = []
-        values = []
-        for key, value in data.items():
-            keys.append(key)
-            values.append(str(value))
+    @staticmethod
+    def _insert_sql(table_name: str, keys):
         columns = ', '.join(keys)
-        values = "', '".join(values)
-        sql = "INSERT OR IGNORE INTO {} ({}) VALUES ('{}')".format(table_name, columns, values)
-        cursor.execute(sql)
-        self.commit()
-        cursor.close()
+        placeholders = ', '.join(['?'] * len(keys))
+        return "INSERT OR IGNORE INTO {} ({}) VALUES ({})".format(table_name, columns, placeholders)
 
-    def remove(self, table_name: str, condition: str = None):
+    def add(self, data: dict, table_name: str):
+        """返回插入行的rowid；与已有主键冲突而被忽略时返回None"""
+        sql = self._insert_sql(table_name, list(data.keys()))
+        with self.writer() as cursor:
+            cursor.execute(sql, self._params(data.values()))
+            return cursor.lastrowid if cursor.rowcount > 0 else None
+
+    def add_many(self, rows: list, table_name: str):
+        """批量插入；rows为dict的list，按字段组合分组后以executemany写入，只提交一次；
+        返回最后插入行的rowid，全部被忽略时返回None"""
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(self._params(row.values()))
+        count = 0
+        with self.writer() as cursor:
+            for keys, values in groups.items():
+                cursor.executemany(self._insert_sql(table_name, keys), values)
+                count = count + max(cursor.rowcount, 0)
+            if 0 == count:
+                return None
+            # executemany不更新cursor.lastrowid
+            return cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+
+    def remove(self, table_name: str, condition: str = None, params=None):
         if condition is None:
             sql = "DELETE FROM " + table_name
         else:
             sql = "DELETE FROM " + table_name + " WHERE " + condition
-        cursor = self.get_cursor()
-        cursor.execute(sql)
-        self.commit()
-        cursor.close()
+        with self.writer() as cursor:
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, self._params(params))
 
     def add_column(self, table_name: str, field_name: str, field_def: str):
-        cursor = self.get_cursor()
         sql = "ALTER TABLE {} ADD COLUMN {} {};".format(table_name, field_name, field_def)
-        cursor.execute(sql)
-        self.commit()
-        cursor.close()
-
-    def import_data(self, filename: str, table_name: str):
-        cursor = self.get_cursor()
-        with open(filename, 'r') as fin:
-            dr = csv.DictReader(fin)
-            to_db = [tuple([row[field] for field in dr.fieldnames]) for row in dr]
-            sql = 'INSERT OR IGNORE INTO ' + table_name + ' ' + str(tuple(dr.fieldnames)).replace("'", '')
-            sql = sql + ' VALUES (' + ', '.join(list('?' * len(dr.fieldnames))) + ');'
-            cursor.executemany(sql, to_db)
-            self.commit()
-        cursor.close()
-
-    def export_data(self, output_dir: str, table_name: str):
+        with self.writer() as cursor:
+            cursor.execute(sql)
+            if (self._catalog is not None) and (self._catalog.get(table_name) is not None):
+                self._update_catalog(cursor, table_name, self._catalog[table_name] + [field_name])
+
+    @staticmethod
+    def _csv_batches(filename: str, batch_rows: int):
+        with DataFileHandler.open_text(filename) as fin:
+            reader = csv.reader(fin)
+            fieldnames = next(reader, None)
+            yield fieldnames
+            if fieldnames is not None:
+                n = len(fieldnames)
+                while True:
+                    rows = list(itertools.islice(reader, batch_rows))
+                    if not rows:
+                        break
+                    # 与csv.DictReader一致：跳过空行，缺失的字段取None，多余的字段忽略
+                    rows = [row[:n] if len(row) >= n else row + [None] * (n - len(row)) for row in rows if row]
+                    if rows:
+                        yield rows
+
+    def _batch_rows(self, batch, batch_rows: int):
+        # Arrow批次按行拆分；时间类型的列转为与MOMENT_FORMAT一致的Unix时间戳字符串，无时区的时间视为本地时间
+        offset = int(self.timezone / pd.Timedelta(milliseconds=1))
+        columns = []
+        for column in batch.columns:
+            if pa.types.is_timestamp(column.type):
+                ms = pc.cast(column, pa.timestamp('ms', tz=column.type.tz), safe=False).cast(pa.int64())
+                if column.type.tz is None:
+                    ms = pc.subtract(ms, offset)
+                column = [None if value is None else '{0}.{1:03d}'.format(value // 1000, value % 1000) for value in ms.to_pylist()]
+            else:
+                column = column.to_pylist()
+            columns.append(column)
+        rows = list(zip(*columns))
+        for i in range(0, len(rows), batch_rows):
+            yield rows[i:i + batch_rows]
+
+    def _arrow_batches(self, filename: str, table_name: str, batch_rows: int, columns: dict):
+        # 数值型字段由pyarrow解析为数值（空值为NULL），其余字段保持原始字符串
+        if pa_csv is None:
+            raise ValueError(logger.error([5714]))  # pragma: no cover
+        with self.reader() as conn:
+            res = conn.execute("PRAGMA table_info('" + table_name + "')").fetchall()
+        numeric = set([item[1] for item in res if ('INT' in item[2].upper()) or ('REAL' in item[2].upper())])
+        with DataFileHandler.open_text(filename) as fin:
+            fieldnames = next(csv.reader(fin), None)
+        yield fieldnames
+        if fieldnames is not None:
+            column_types = {}
+            for field in fieldnames:
+                if columns.get(field, field) not in numeric:
+                    column_types[field] = pa.string()
+            reader = pa_csv.open_csv(filename, convert_options=pa_csv.ConvertOptions(column_types=column_types))
+            for batch in reader:
+                yield from self._batch_rows(batch, batch_rows)
+
+    def _columnar_batches(self, filename: str, parser: str, batch_rows: int):
+        # Parquet与Arrow IPC文件本身带有类型，按批读取后直接写入
+        if pq is None:
+            raise ValueError(logger.error([5714]))  # pragma: no cover
+        if PARSER_PARQUET == parser:
+            reader = pq.ParquetFile(filename)
+            yield reader.schema_arrow.names
+            batches = reader.iter_batches(batch_size=batch_rows)
+        else:
+            try:
+                reader = pa.ipc.open_file(filename)
+                batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                reader = pa.ipc.open_stream(filename)
+                batches = reader
+            yield reader.schema.names
+        for batch in batches:
+            yield from self._batch_rows(batch, batch_rows)
+
+    def import_data(self, filename: str, table_name: str, batch_rows: int = IMPORT_BATCH_ROWS_DEFAULT,
+                    progress=None, parser: str = None, columns: dict = None):
+        """分批读取文件并以executemany写入，全部批次在同一事务中提交；
+        parser为None时按扩展名识别Parquet（.parquet）、Arrow IPC（.arrow/.ipc/.feather），其余按CSV处理；
+        columns为文件列名到表字段名的映射；progress为可选回调，每批写入后以(已导入行数, 行/秒)调用；返回导入的行数"""
+        if not (isinstance(batch_rows, int) and batch_rows > 0):
+            raise ValueError(logger.error([5716, batch_rows]))
+        if parser is None:
+            parser = PARSER_EXTENSIONS.get(path.splitext(filename)[1].lower(), PARSER_CSV)
+        if columns is None:
+            columns = {}
+        if PARSER_CSV == parser:
+            batches = self._csv_batches(filename, batch_rows)
+        elif PARSER_ARROW == parser:
+            batches = self._arrow_batches(filename, table_name, batch_rows, columns)
+        elif parser in [PARSER_PARQUET, PARSER_IPC]:
+            batches = self._columnar_batches(filename, parser, batch_rows)
+        else:
+            raise ValueError(logger.error([5717, parser, ', '.join(PARSERS)]))
+        count = 0
+        start = perf_counter()
+        fieldnames = next(batches)
+        if fieldnames is not None:
+            sql = self._insert_sql(table_name, [columns.get(field, field) for field in fieldnames])
+            with self.writer() as cursor:
+                for rows in batches:
+                    cursor.executemany(sql, rows)
+                    count = count + len(rows)
+                    if progress is not None:
+                        progress(count, count / max(perf_counter() - start, 1e-9))
+        cost = perf_counter() - start
+        logger.info([5718, filename, table_name, count, cost, count / max(cost, 1e-9)])
+        return count
+
+    def export_data(self, output_dir: str, table_name: str, chunk_rows: int = CHUNK_ROWS_DEFAULT):
         output_filename = table_name + '.csv'
         output_filename = path.join(output_dir, output_filename)
-        df = self.query(table_name)
-        df.to_csv(output_filename, index=False)
+        self._export_csv(output_filename, table_name, chunk_rows)
+
+    def _export_csv(self, output_filename: str, table_name: str, chunk_rows: int):
+        count = 0
+        with DataFileHandler.open_text(output_filename, 'w') as fout:
+            header = True
+            for df in self.query_iter(table_name, chunk_rows=chunk_rows):
+                df.to_csv(fout, header=header, index=False)
+                header = False
+                count = count + len(df.index)
+        return count
+
+    @staticmethod
+    def _arrow_cast(column, field_def: str):
+        # 按字段声明的类型转换，INT/REAL字段中的空字符串视为NULL
+        field_def = field_def.upper()
+        if 'INT' in field_def:
+            target = pa.int64()
+        elif 'REAL' in field_def:
+            target = pa.float64()
+        else:
+            target = pa.string()
+        if column.type == target:
+            return column
+        if pa.types.is_string(column.type) and (target != pa.string()):
+            column = pc.if_else(pc.equal(column, ''), pa.scalar(None, pa.string()), column)
+        return column.cast(target)
+
+    def _export_parquet(self, output_filename: str, table_name: str, chunk_rows: int):
+        with self.reader() as conn:
+            res = conn.execute("PRAGMA table_info('" + table_name + "')").fetchall()
+        field_defs = {}
+        for item in res:
+            field_defs[item[1]] = item[2]
+        count = 0
+        writer = None
+        try:
+            for batch in self.query_iter(table_name, chunk_rows=chunk_rows, return_type=RETURN_TYPE_ARROW):
+                columns = [self._arrow_cast(batch.column(i), field_defs[name]) for i, name in enumerate(batch.schema.names)]
+                table = pa.Table.from_arrays(columns, names=batch.schema.names)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_filename, table.schema, compression='zstd')
+                writer.write_table(table)
+                count = count + table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+    def service_tables(self, service_id: str):
+        """service_id对应的全部DD、SDU、TDU表"""
+        names = ['_'.join([TABLE_PREFIX_DD, service_id]), '_'.join([TABLE_PREFIX_SDU, service_id])]
+        prefix = '_'.join([TABLE_PREFIX_TDU, service_id, ''])
+        tables = []
+        for table_name in self.get_tables():
+            if (table_name in names) or table_name.startswith(prefix):
+                tables.append(table_name)
+        return tables
+
+    def export_service(self, service_id: str, output_dir: str, fmt: str = EXPORT_FORMAT_CSV_GZ,
+                       workers: int = EXPORT_WORKERS_DEFAULT, chunk_rows: int = CHUNK_ROWS_DEFAULT):
+        """以workers个线程并发导出service的全部表（gzip压缩的CSV或Parquet），并生成含行数与checksum的清单，返回清单文件名"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(logger.error([5719, fmt, ', '.join(EXPORT_FORMATS)]))
+        if (EXPORT_FORMAT_PARQUET == fmt) and (pq is None):
+            raise ValueError(logger.error([5714]))  # pragma: no cover
+        if not (isinstance(workers, int) and workers > 0):
+            raise ValueError(logger.error([5720, workers]))
+
+        def export_table(table_name):
+            filename = table_name + '.' + fmt
+            output_filename = path.join(output_dir, filename)
+            if EXPORT_FORMAT_PARQUET == fmt:
+                count = self._export_parquet(output_filename, table_name, chunk_rows)
+            else:
+                count = self._export_csv(output_filename, table_name, chunk_rows)
+            return {'table': table_name, 'file': filename, 'rows': count,
+                    'checksum': DataFileHandler.checksum(output_filename)}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(export_table, self.service_tables(service_id)))
+        manifest = {'service_id': service_id, 'format': fmt, 'tables': tables}
+        manifest_filename = path.join(output_dir, MANIFEST_FILENAME.format(service_id))
+        with open(manifest_filename, 'w') as fout:
+            json.dump(manifest, fout, ensure_ascii=False, indent=2)
+        logger.info([5721, service_id, len(tables), sum([item['rows'] for item in tables]), manifest_filename])
+        return manifest_filename
@@ -1,7 +1,16 @@
+import os
 from os import getpid
-from random import getrandbits
+from random import getrandbits, randint
+from abc import abstractmethod
+import time
 import threading
+from datetime import timedelta
+from functools import lru_cache
+from weakref import WeakValueDictionary, ref
+import numpy as np
+import pandas as pd
 from mts.commons import logger
+from mts.commons.utils import hex_nibbles, join_nibbles
 from mts.commons.const import *
 
 
@@ -26,6 +35,7 @@ class Service(object):
         return Service.to_service_id(self.code)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def to_service_id(value: int):
         return oct(value)[2:]
 
@@ -58,18 +68,166 @@ class Service(object):
         return NotImplemented
 
 
+class SequenceAllocator(object):
+    """序列号分配器：allocate(ts, n)返回(pid_code, counter)，counter为首个id的(时间戳 << SEQUENCE_BITS) | 序列号，其后n个取值连续"""
+
+    @abstractmethod
+    def allocate(self, ts: int, n: int = 1):
+        pass
+
+    def _watch_fork(self):
+        # fork后子进程继承了分区及计数器，需在子进程中重新划分，避免与父进程生成相同的id
+        if hasattr(os, 'register_at_fork'):
+            allocator = ref(self)
+
+            def after_in_child():
+                if allocator() is not None:
+                    allocator()._after_fork()
+            os.register_at_fork(after_in_child=after_in_child)
+
+    def _after_fork(self):
+        pass
+
+
+class _Partition(object):
+    __slots__ = ('pid_code', 'lock', 'counter', 'wall', 'borrowed_ms', 'clock_regression')
+
+    def __init__(self, pid_code: int = None):
+        self.pid_code = pid_code
+        self.lock = threading.Lock()
+        self.counter = -1
+        self.wall = -1
+        self.borrowed_ms = 0
+        self.clock_regression = 0
+
+    def allocate(self, ts: int, n: int = 1):
+        # counter为单调递增的逻辑时钟；序列号用尽时借用后续的毫秒，墙上时钟回拨时继续沿用逻辑时钟
+        with self.lock:
+            if ts < self.wall:
+                self.clock_regression = self.clock_regression + 1
+            else:
+                self.wall = ts
+            last_ms = self.counter >> SEQUENCE_BITS
+            start = max(ts << SEQUENCE_BITS, self.counter + 1)
+            self.counter = start + n - 1
+            self.borrowed_ms = self.borrowed_ms + max(0, (self.counter >> SEQUENCE_BITS) - max(last_ms, self.wall))
+        return self.pid_code, start
+
+    def stats(self):
+        with self.lock:
+            return {
+                'borrowed_ms': self.borrowed_ms,
+                'clock_regression': self.clock_regression,
+                'drift_ms': max(0, (self.counter >> SEQUENCE_BITS) - self.wall)
+            }
+
+
+class MonotonicAllocator(SequenceAllocator):
+    """单调逻辑时钟分配器：突发流量下借用后续毫秒，时钟回拨时不会产生重复id，并统计借用毫秒数及时钟回拨次数"""
+
+    def __init__(self, pid_code: int = None):
+        if (pid_code is not None) and ((not isinstance(pid_code, int)) or (pid_code & PID_CODE_MASK) != pid_code):
+            raise ValueError(logger.error([5505, pid_code]))
+        self._partition = _Partition(pid_code)
+        self._forked = False
+        self._watch_fork()
+
+    def _after_fork(self):
+        # 未指定pid_code时沿用进程的pid_code（fork后随之改变）；指定的pid_code不能在父子进程间共用
+        self._forked = self._partition.pid_code is not None
+        self._partition = _Partition(self._partition.pid_code)
+
+    def allocate(self, ts: int, n: int = 1):
+        if self._forked:
+            raise ValueError(logger.error([5506, self._partition.pid_code]))
+        pid_code, start = self._partition.allocate(ts, n)
+        if pid_code is None:
+            pid_code = ObjectId._generate_pid_code()
+        return pid_code, start
+
+    @property
+    def stats(self):
+        return self._partition.stats()
+
+
+class ThreadPartitionAllocator(SequenceAllocator):
+    """按线程划分pid_code分区的分配器：pid_codes中每个pid_code为一个分区，各分区独立维护序列号，
+    线程按首次使用的顺序轮流分配到各分区，线程数不超过分区数时互不争用锁。
+    pid_codes由本进程独占，多个进程并发时应各自指定互不相交的pid_codes（单进程可使用全部16个）；
+    fork后的子进程不能继续使用，应另行注册分配器"""
+
+    def __init__(self, pid_codes: list):
+        if (not isinstance(pid_codes, list)) or (len(pid_codes) == 0) or (len(set(pid_codes)) != len(pid_codes)):
+            raise ValueError(logger.error([5505, pid_codes]))
+        for pid_code in pid_codes:
+            if (not isinstance(pid_code, int)) or (pid_code & PID_CODE_MASK) != pid_code:
+                raise ValueError(logger.error([5505, pid_codes]))
+        self._pid_codes = pid_codes
+        self._forked = False
+        self._seed()
+        self._watch_fork()
+
+    def _seed(self):
+        self._partitions = [_Partition(pid_code) for pid_code in self._pid_codes]
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def _after_fork(self):
+        # pid_codes不能在父子进程间共用
+        self._forked = True
+        self._seed()
+
+    def _partition(self):
+        if self._forked:
+            raise ValueError(logger.error([5506, self._pid_codes]))
+        partition = getattr(self._local, 'partition', None)
+        if partition is None:
+            with self._lock:
+                partition = self._partitions[self._next % len(self._partitions)]
+                self._next = self._next + 1
+            self._local.partition = partition
+        return partition
+
+    def allocate(self, ts: int, n: int = 1):
+        return self._partition().allocate(ts, n)
+
+    @property
+    def stats(self):
+        res = {'borrowed_ms': 0, 'clock_regression': 0, 'drift_ms': 0}
+        for partition in self._partitions:
+            item = partition.stats()
+            res['borrowed_ms'] = res['borrowed_ms'] + item['borrowed_ms']
+            res['clock_regression'] = res['clock_regression'] + item['clock_regression']
+            res['drift_ms'] = max(res['drift_ms'], item['drift_ms'])
+        return res
+
+
+def _split_nulls(ids):
+    """按非空元素推断id数组的类型；空值（None/NaN）置为不合法的占位值，并返回空值掩码"""
+    values = np.asarray(ids)
+    null = pd.isna(values)
+    kind = 'empty' if null.all() else pd.api.types.infer_dtype(values[~null], skipna=False)
+    if null.any():
+        values = values.astype(object)
+        values[null] = 0 if kind == 'integer' else ''
+    return values, kind, null
+
+
 class ObjectId(object):
     _pid = getpid()
     _lock = threading.Lock()
     _epoch = EPOCH_DEFAULT
     _service = Service()
     _pid_code = getrandbits(4)
-    _last_ts = None
-    _sequence = 0
-    __slots__ = ('_id', '_sc',)
+    _counter = -1  # (时间戳 << SEQUENCE_BITS) | 序列号，已分配的最大值
+    _allocator = None
+    _interned = WeakValueDictionary()
+    __slots__ = ('_id', '_sc', '_str', '__weakref__')
 
     def __init__(self, oid=None, service_code: int = None):
         self._sc = None
+        self._str = None
         if service_code is None:
             self._sc = ObjectId._service.code
         else:
@@ -81,15 +239,33 @@ class ObjectId(object):
             self._id = ObjectId.pack(self._sc)
         else:
             if isinstance(oid, str) and len(oid) == OID_LEN:
-                self._generate(oid)
+                self._generate(int(oid, 16))
+                self._str = oid.lower()
             else:
                 if isinstance(oid, ObjectId):
-                    self._generate(str(oid))
+                    self._id = oid.value
+                    self._sc = oid._sc
+                    self._str = oid._str
                 else:
                     raise TypeError(logger.error([5501, type(oid)]))
 
     def __str__(self):
-        return hex_str(self._id, OID_LEN)
+        if self._str is None:
+            self._str = hex_str(self._id, OID_LEN)
+        return self._str
+
+    def __hash__(self):
+        return hash(self._id)
+
+    @classmethod
+    def intern(cls, oid):
+        """返回与oid对应的共享实例；同一oid字符串重复构建时复用同一对象"""
+        key = oid if isinstance(oid, str) else str(oid)
+        res = cls._interned.get(key)
+        if res is None:
+            res = cls(oid)
+            cls._interned[key] = res
+        return res
 
     def __repr__(self):
         service_code, ts, pid_code, sequence = ObjectId.unpack(self._id)
@@ -103,7 +279,8 @@ class ObjectId(object):
         pid = getpid()
         if pid != cls._pid:
             cls._pid = pid
-            cls._pid_code = getrandbits(4)
+            # 确保新进程的pid_code与原进程不同
+            cls._pid_code = (cls._pid_code + randint(1, PID_CODE_MASK)) & PID_CODE_MASK
         return cls._pid_code
 
     @staticmethod
@@ -113,6 +290,8 @@ class ObjectId(object):
             ObjectId._epoch = settings['epoch'] & TIMESTAMP_MASK
         if 'service_code' in settings and isinstance(settings['service_code'], int):
             ObjectId._service = Service(settings['service_code'] & SERVICE_CODE_MASK)
+        if 'allocator' in settings and (settings['allocator'] is None or isinstance(settings['allocator'], SequenceAllocator)):
+            ObjectId._allocator = settings['allocator']
 
     @staticmethod
     def unpack(oid):
@@ -126,7 +305,7 @@ class ObjectId(object):
                 raise TypeError(logger.error([5501, type(oid)]))
         service_code = oid_value >> SERVICE_CODE_BITS_SHIFT
         last_ts = (oid_value >> TIMESTAMP_BITS_SHIFT) & TIMESTAMP_MASK
-        pid_code = (oid_value >> TIMESTAMP_BITS_SHIFT) & PID_CODE_MASK
+        pid_code = (oid_value >> PID_CODE_BITS_SHIFT) & PID_CODE_MASK
         sequence = oid_value & SEQUENCE_MASK
         if last_ts <= 0:
             raise ValueError(logger.error([5502]))
@@ -135,39 +314,147 @@ class ObjectId(object):
         else:
             raise ValueError(logger.error([5500, service_code, SERVICE_CODE_MIN, SERVICE_CODE_MAX]))
 
+    @staticmethod
+    def to_array(oids):
+        """将OID的Series/ndarray/list（16位十六进制字符串或整数）转换为uint64数组，并返回格式合法性标记"""
+        values, kind, null = _split_nulls(oids)
+        if kind in ['string', 'empty']:
+            nibbles, valid = hex_nibbles(values, OID_LEN)
+            return join_nibbles(nibbles), valid
+        if kind == 'integer':
+            return values.astype(np.uint64), ~null
+        raise TypeError(logger.error([5501, type(oids)]))
+
+    @staticmethod
+    def _unpack_array(values, valid):
+        service_code = values >> np.uint64(SERVICE_CODE_BITS_SHIFT)
+        last_ts = (values >> np.uint64(TIMESTAMP_BITS_SHIFT)) & np.uint64(TIMESTAMP_MASK)
+        pid_code = (values >> np.uint64(PID_CODE_BITS_SHIFT)) & np.uint64(PID_CODE_MASK)
+        sequence = values & np.uint64(SEQUENCE_MASK)
+        valid = valid & (last_ts > 0) & (service_code >= SERVICE_CODE_MIN) & (service_code <= SERVICE_CODE_MAX)
+        res = {
+            KEY_SERVICE_CODE: service_code.astype(np.int64),
+            KEY_TIMESTAMP: last_ts.astype(np.int64),
+            KEY_PID_CODE: pid_code.astype(np.int64),
+            KEY_SEQUENCE: sequence.astype(np.int64)
+        }
+        return res, valid
+
+    @staticmethod
+    def unpack_array(oids):
+        """unpack的批量版本，返回以service_code、timestamp、pid_code、sequence为列的DataFrame"""
+        values, valid = ObjectId.to_array(oids)
+        res, valid = ObjectId._unpack_array(values, valid)
+        if not valid.all():
+            raise ValueError(logger.error([5504, int((~valid).sum())]))
+        index = oids.index if isinstance(oids, pd.Series) else None
+        return pd.DataFrame(res, index=index)
+
+    @staticmethod
+    def validate_array(oids):
+        """validate的批量版本，返回bool数组"""
+        values, valid = ObjectId.to_array(oids)
+        return ObjectId._unpack_array(values, valid)[1]
+
     @staticmethod
     def timestamp(ts: int):
-        return EPOCH_MOMENT.add(ts + ObjectId._epoch - EPOCH_DEFAULT, 'ms')
+        # 由Unix时间换算为本地时间，与to_ts中moment.unix()的换算互逆（moment按本地标准时间换算，不计夏令时），
+        # 不依赖导入时的时区
+        ms = EPOCH_DEFAULT * 1000 + ts + ObjectId._epoch - EPOCH_DEFAULT
+        return moment(EPOCH_UNIX + timedelta(milliseconds=ms, seconds=-time.timezone))
 
     @staticmethod
-    def pack(service_code: int, timestamp: moment = None, sn: int = None):
+    def to_ts(timestamp=None):
+        """timestamp的逆运算：将moment（或可被moment解析的字符串，None为当前时间）转换为相对epoch的毫秒数"""
         ts = timestamp
         if ts is None:
             ts = moment()
+        if isinstance(ts, str):
+            ts = moment(ts)
         if ts.unix() < ObjectId._epoch:
             raise ValueError(logger.error([5502]))
-        ts = (ts.unix() - ObjectId._epoch) * 1000 + ts.milliseconds()
-        pid_code = ObjectId._generate_pid_code()
-        sequence = sn
-        with ObjectId._lock:
-            if sn is None:
-                if ts == ObjectId._last_ts:
-                    ObjectId._sequence = (ObjectId._sequence + 1) & SEQUENCE_MASK
-                    if ObjectId._sequence == 0:
-                        ts = ts + 1
+        return (ts.unix() - ObjectId._epoch) * 1000 + ts.milliseconds()
+
+    @staticmethod
+    def min_for(timestamp, service_code: int = None):
+        """timestamp所在毫秒内可生成的最小id值"""
+        if service_code is None:
+            service_code = ObjectId._service.code
+        return (service_code << SERVICE_CODE_BITS_SHIFT) | (ObjectId.to_ts(timestamp) << TIMESTAMP_BITS_SHIFT)
+
+    @staticmethod
+    def max_for(timestamp, service_code: int = None):
+        """timestamp所在毫秒内可生成的最大id值"""
+        return ObjectId.min_for(timestamp, service_code) | (-1 ^ (-1 << TIMESTAMP_BITS_SHIFT))
+
+    @staticmethod
+    def pack(service_code: int, timestamp: moment = None, sn: int = None):
+        ts = ObjectId.to_ts(timestamp)
+        # 分配器的逻辑时钟只用于当前时间；指定timestamp时保持其时间戳不变
+        if (sn is None) and (timestamp is None) and (ObjectId._allocator is not None):
+            pid_code, counter = ObjectId._allocator.allocate(ts)
+            ts = counter >> SEQUENCE_BITS
+            sequence = counter & SEQUENCE_MASK
+        else:
+            pid_code = ObjectId._generate_pid_code()
+            with ObjectId._lock:
+                # 与pack_many共用同一个计数器；当前时间取计数器与时间戳中较大者，不会重复分配已预留的序列号
+                if sn is not None:
+                    counter = (ts << SEQUENCE_BITS) | sn
+                elif (timestamp is None) or (ts == ObjectId._counter >> SEQUENCE_BITS):
+                    counter = max(ts << SEQUENCE_BITS, ObjectId._counter + 1)
                 else:
-                    ObjectId._sequence = 0
-                sequence = ObjectId._sequence
-            else:
-                ObjectId._sequence = sn
-            ObjectId._last_ts = ts
+                    counter = ts << SEQUENCE_BITS
+                ObjectId._counter = max(ObjectId._counter, counter)
+            ts = counter >> SEQUENCE_BITS
+            sequence = counter & SEQUENCE_MASK
         new_id = (service_code << SERVICE_CODE_BITS_SHIFT) | (ts << TIMESTAMP_BITS_SHIFT) | (pid_code << PID_CODE_BITS_SHIFT) | sequence
         return new_id
 
-    def _generate(self, oid):
-        service_code, last_ts, pid_code, sequence = ObjectId.unpack(oid)
-        moment_last_ts = ObjectId.timestamp(last_ts)
-        self._id = ObjectId.pack(service_code, moment_last_ts, sequence)
+    @staticmethod
+    def pack_many(service_code: int, n: int, as_list: bool = False):
+        if not Service.valid(service_code):
+            raise ValueError(logger.error([5500, service_code, SERVICE_CODE_MIN, SERVICE_CODE_MAX]))
+        if (not isinstance(n, int)) or (n <= 0):
+            raise ValueError(logger.error([5503, n]))
+        ts = ObjectId.to_ts()
+        # 时间戳与序列号合并为一个计数器，一次性预留连续的n个序列号，序列号溢出时自动进位到下一毫秒
+        if ObjectId._allocator is None:
+            pid_code = ObjectId._generate_pid_code()
+            with ObjectId._lock:
+                start = max(ts << SEQUENCE_BITS, ObjectId._counter + 1)
+                ObjectId._counter = start + n - 1
+        else:
+            pid_code, start = ObjectId._allocator.allocate(ts, n)
+        counter = np.arange(start, start + n, dtype=np.uint64)
+        ids = (counter >> np.uint64(SEQUENCE_BITS)) << np.uint64(TIMESTAMP_BITS_SHIFT)
+        ids |= counter & np.uint64(SEQUENCE_MASK)
+        ids |= np.uint64((service_code << SERVICE_CODE_BITS_SHIFT) | (pid_code << PID_CODE_BITS_SHIFT))
+        if as_list:
+            return ids.tolist()
+        else:
+            return ids
+
+    def _generate(self, oid: int):
+        self._sc = ObjectId.unpack(oid)[0]
+        self._id = oid
+        self._str = None
+
+    @classmethod
+    def from_int(cls, oid: int):
+        """仅校验各数据位并直接保存整数值，不涉及时间对象、锁及序列号状态"""
+        res = cls.__new__(cls)
+        res._generate(oid)
+        return res
+
+    @classmethod
+    def from_str(cls, oid: str):
+        if isinstance(oid, str) and len(oid) == OID_LEN:
+            res = cls.from_int(int(oid, 16))
+            res._str = oid.lower()
+            return res
+        else:
+            raise TypeError(logger.error([5501, type(oid)]))
 
     @staticmethod
     def validate(oid):
@@ -217,9 +504,11 @@ class ObjectId(object):
 
 
 class DataDictionaryId(object):
-    __slots__ = ('_id',)
+    _interned = WeakValueDictionary()
+    __slots__ = ('_id', '_str', '__weakref__')
 
     def __init__(self, **kwargs):
+        self._str = None
         if KEY_DDID in kwargs:
             ddid = kwargs[KEY_DDID]
             if isinstance(ddid, DataDictionaryId) or isinstance(ddid, str):
@@ -254,7 +543,22 @@ class DataDictionaryId(object):
                     raise ValueError(logger.error([5601, kwargs]))
 
     def __str__(self):
-        return hex_str(self._id, 17)
+        if self._str is None:
+            self._str = hex_str(self._id, DDID_LEN)
+        return self._str
+
+    def __hash__(self):
+        return hash(self._id)
+
+    @classmethod
+    def intern(cls, ddid):
+        """返回与ddid对应的共享实例；同一ddid字符串重复构建时复用同一对象"""
+        key = ddid if isinstance(ddid, str) else str(ddid)
+        res = cls._interned.get(key)
+        if res is None:
+            res = cls(ddid=ddid)
+            cls._interned[key] = res
+        return res
 
     def __repr__(self):
         dd_type, oid = DataDictionaryId.unpack(self._id)
@@ -265,6 +569,8 @@ class DataDictionaryId(object):
     def _generate(self, ddid):
         dd_type, oid = DataDictionaryId.unpack(ddid)
         self._id = DataDictionaryId.pack(dd_type, oid)
+        if isinstance(ddid, str):
+            self._str = ddid.lower()
 
     @staticmethod
     def unpack(ddid):
@@ -294,6 +600,17 @@ class DataDictionaryId(object):
         else:
             raise ValueError(logger.error([5603]))
 
+    @staticmethod
+    def pack_many(dd_type, service_code: int, n: int):
+        """批量生成ddid；ddid为68位，超出uint64的范围，故以int的list返回"""
+        if isinstance(dd_type, str) and dd_type in DD_TYPES:
+            dd_type = int(dd_type, 16)
+        if isinstance(dd_type, int) and (dd_type & DD_TYPE_MASK) == dd_type and hex_str(dd_type, 1) in DD_TYPES:
+            dd_type_value = dd_type << DD_TYPE_BITS_SHIFT
+            return [dd_type_value | oid for oid in ObjectId.pack_many(service_code, n, True)]
+        else:
+            raise ValueError(logger.error([5604, dd_type]))
+
     @staticmethod
     def validate_raw(dd_type: int, oid: int):
         if ObjectId.validate(oid) and hex_str(dd_type, 1) in DD_TYPES:
@@ -301,6 +618,43 @@ class DataDictionaryId(object):
         else:
             return False
 
+    @staticmethod
+    def to_array(ddids):
+        """将DDID的Series/ndarray/list（17位十六进制字符串或整数）拆分为dd_type及oid两个数组，并返回格式合法性标记"""
+        values, kind, null = _split_nulls(ddids)
+        if kind in ['string', 'empty']:
+            nibbles, valid = hex_nibbles(values, DDID_LEN)
+            return nibbles[:, 0], join_nibbles(nibbles[:, 1:]), valid
+        if kind == 'integer':
+            # ddid超出64位，只能按object数组逐元素运算
+            values = values.astype(object)
+            dd_type = (values >> DD_TYPE_BITS_SHIFT).astype(np.uint64)
+            oid = (values & OID_MASK).astype(np.uint64)
+            return dd_type, oid, ~null
+        raise TypeError(logger.error([5600, type(ddids)]))
+
+    @staticmethod
+    def _unpack_array(ddids):
+        dd_type, oid, valid = DataDictionaryId.to_array(ddids)
+        res, valid = ObjectId._unpack_array(oid, valid)
+        valid = valid & np.isin(dd_type, [int(t, 16) for t in DD_TYPES])
+        res = {KEY_DD_TYPE: dd_type.astype(np.int64), KEY_OID: oid, **res}
+        return res, valid
+
+    @staticmethod
+    def unpack_array(ddids):
+        """unpack的批量版本，返回以dd_type、oid、service_code、timestamp、pid_code、sequence为列的DataFrame"""
+        res, valid = DataDictionaryId._unpack_array(ddids)
+        if not valid.all():
+            raise ValueError(logger.error([5605, int((~valid).sum())]))
+        index = ddids.index if isinstance(ddids, pd.Series) else None
+        return pd.DataFrame(res, index=index)
+
+    @staticmethod
+    def validate_array(ddids):
+        """validate的批量版本，返回bool数组"""
+        return DataDictionaryId._unpack_array(ddids)[1]
+
     @staticmethod
     def validate(ddid: int):
         dd_type = ddid >> DD_TYPE_BITS_SHIFT
@@ -313,11 +667,11 @@ class DataDictionaryId(object):
 
     @property
     def dd_type(self):
-        return hex_str(self._id >> DD_TYPE_BITS_SHIFT, 1)
+        return str(self)[0]
 
     @property
     def oid(self):
-        return hex_str(self.value, -16)
+        return str(self)[1:]
 
     @property
     def sid(self):
@@ -0,0 +1,71 @@
+import os
+import unittest
+from mts.commons.singleton import _Singleton
+from mts.core.handler import DBHandler
+from mts.core.datamodel import TimeDataUnit, DataDictionary
+from mts.aio import AsyncExecutor, AsyncDataDictionary, AsyncTimeDataUnit, AsyncSpaceDataUnit
+
+cwd = os.path.abspath(os.path.dirname(__file__)).split('aio')[0]
+output_dir = os.path.join(os.getcwd(), 'output')
+db_file_name = os.path.join(output_dir, 'aio_tdu')
+db_url = 'sqlite://' + db_file_name
+owners = ['1a4059507fd2fc000', '1a4059507fd2fc001', '1a4059507fd2fc002']
+
+
+class TestAsyncTimeDataUnit(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):  # pragma: no cover
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        if os.path.exists(db_file_name):
+            os.remove(db_file_name)
+
+    def setUp(self):
+        for cls in [DBHandler, AsyncExecutor]:
+            if cls in _Singleton._instances:
+                del _Singleton._instances[cls]
+        DBHandler(db_url)
+        dd = DataDictionary('51')
+        dd.sync_db(os.path.join(cwd, 'resources', 'ds', '51.dd'), True)
+
+    def tearDown(self):
+        AsyncExecutor().shutdown()
+        DBHandler().disconnect()
+
+    async def test_basic(self):
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu = await AsyncTimeDataUnit.create(owners[0])
+        self.assertTrue(isinstance(tdu.unit, TimeDataUnit))
+        await tdu.sync_db(filename, True)
+        res = await tdu.query(metric=['a4059507fd30c004'])
+        self.assertEqual(res.shape, (4, 1))
+        self.assertTrue(res.equals(TimeDataUnit(owners[0]).query(metric=['a4059507fd30c004'])))
+        await tdu.add(ts='2022-01-01', data_desc={'进货量/斤': 90})
+        self.assertEqual(len((await tdu.query()).index), 5)
+        await tdu.remove('2022-01-01')
+        self.assertEqual(len((await tdu.query()).index), 4)
+
+    async def test_query_many(self):
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        for owner in owners:
+            tdu = await AsyncTimeDataUnit.create(owner)
+            await tdu.sync_db(filename, True)
+        res = await AsyncTimeDataUnit.query_many(owners, interval={'from': '2021-01-01', 'to': '2021-03-31'})
+        self.assertEqual(list(res.keys()), owners)
+        expected = TimeDataUnit(owners[0]).query(interval={'from': '2021-01-01', 'to': '2021-03-31'})
+        self.assertEqual(expected.shape, (3, 2))
+        for owner in owners:
+            self.assertTrue(res[owner].equals(expected))
+
+    async def test_dd_and_sdu(self):
+        dd = await AsyncDataDictionary.create('51')
+        self.assertEqual(await dd.query(True, desc=['苹果']), ['a4059507fd2fc000'])
+        sdu = await AsyncSpaceDataUnit.create('51')
+        await sdu.sync_db(os.path.join(cwd, 'resources', 'ds', '51.sdu'), True)
+        condition = {'op': 'and', 'data': {'a4059507fd30c005': [{'eq': 32}]}}
+        self.assertEqual(await sdu.query(tag=condition), sdu.unit.query(tag=condition))
+        self.assertEqual(1, len(await sdu.query(tag=condition)))
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
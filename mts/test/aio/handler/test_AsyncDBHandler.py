@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import unittest
+from mts.commons.singleton import _Singleton
+from mts.commons.const import *
+from mts.core.handler import DBHandler
+from mts.core.id import DataDictionaryId
+from mts.aio import AsyncExecutor, AsyncDBHandler
+
+output_dir = os.path.join(os.getcwd(), 'output')
+db_file_name = os.path.join(output_dir, 'aio_dbhandler')
+db_url = 'sqlite://' + db_file_name
+SQL_SLOW = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 1000000000) SELECT count(*) FROM c'
+
+
+class TestAsyncDBHandler(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        if os.path.exists(db_file_name):
+            os.remove(db_file_name)  # pragma: no cover
+
+    def setUp(self):
+        for cls in [DBHandler, AsyncExecutor]:
+            if cls in _Singleton._instances:
+                del _Singleton._instances[cls]
+
+    def tearDown(self):
+        AsyncExecutor().shutdown()
+        DBHandler().disconnect()
+
+    async def test_basic(self):
+        adb = AsyncDBHandler(DBHandler(db_url))
+        table_name = 'dd_51'
+        await adb.init_table(table_name, FIELDS_DD)
+        self.assertTrue(await adb.exist_table(table_name))
+        self.assertEqual(await adb.get_fields(table_name), sorted(FIELDS_DD.keys()))
+        rows = [{'ddid': str(DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id='51')), 'desc': '测试项_' + str(i),
+                 'oid_mask': ''} for i in range(10)]
+        await adb.add_many(rows[1:], table_name)
+        await adb.add(rows[0], table_name)
+        self.assertEqual(len((await adb.query(table_name)).index), 10)
+        res = await adb.query(table_name, ['desc'], 'ddid = ?', (rows[0]['ddid'],))
+        self.assertEqual(res['desc'].tolist(), ['测试项_0'])
+        chunks = [len(df.index) async for df in adb.query_iter(table_name, chunk_rows=4)]
+        self.assertEqual(chunks, [4, 4, 2])
+        await adb.remove(table_name, 'ddid = ?', (rows[0]['ddid'],))
+        self.assertEqual(len((await adb.query(table_name)).index), 9)
+        await adb.export_data(output_dir, table_name)
+        await adb.init_table(table_name, FIELDS_DD)
+        self.assertEqual(await adb.import_data(os.path.join(output_dir, table_name + '.csv'), table_name), 9)
+        self.assertTrue(table_name in await adb.get_tables())
+
+    async def test_concurrency(self):
+        executor = AsyncExecutor(max_workers=4, max_concurrency=2)
+        adb = AsyncDBHandler(DBHandler(db_url), executor)
+        state = {'running': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def work(i):
+            with lock:
+                state['running'] = state['running'] + 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] = state['running'] - 1
+            return i
+
+        res = await asyncio.gather(*[adb.run(work, i) for i in range(6)])
+        self.assertEqual(res, list(range(6)))
+        self.assertEqual(state['max'], 2)
+
+    async def test_cancel(self):
+        db = DBHandler(db_url)
+        adb = AsyncDBHandler(db)
+        errors = []
+        started = threading.Event()
+
+        def slow():
+            with db.reader() as conn:
+                started.set()
+                try:
+                    return conn.execute(SQL_SLOW).fetchone()
+                except sqlite3.OperationalError as e:
+                    errors.append(e)
+                    raise
+
+        task = asyncio.ensure_future(adb.run(slow))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        for i in range(100):
+            if errors:
+                break
+            await asyncio.sleep(0.01)  # pragma: no cover
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(db.metrics['reader']['acquire'], 1)
+        self.assertIsNone(db.cancel_token())
+        # 中断后连接仍可继续使用
+        self.assertEqual(len((await adb.get_tables())), len(db.get_tables()))
+
+    async def _cancel_when_reading(self, db, coro):
+        # 只读连接被取走即表示查询已开始执行
+        task = asyncio.ensure_future(coro)
+        for i in range(500):
+            if (db.metrics['reader'] is not None) and (db.metrics['reader']['acquire'] > 0):
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        return start
+
+    @staticmethod
+    def _init_slow_view(db):
+        with db.writer() as cursor:
+            cursor.execute('CREATE VIEW IF NOT EXISTS slow_view AS ' + SQL_SLOW)
+
+    async def test_cancel_query(self):
+        db = DBHandler(db_url)
+        self._init_slow_view(db)
+        adb = AsyncDBHandler(db)
+        start = await self._cancel_when_reading(db, adb.query('slow_view'))
+        # 查询被中断，连接归还后可继续使用
+        self.assertEqual(len((await adb.query('slow_view', condition='0')).index), 0)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(db.metrics['engine'][ENGINE_CX]['count'], 0)
+
+    async def test_cancel_query_iter(self):
+        db = DBHandler(db_url)
+        self._init_slow_view(db)
+        adb = AsyncDBHandler(db)
+
+        async def consume():
+            return [chunk async for chunk in adb.query_iter('slow_view')]
+
+        start = await self._cancel_when_reading(db, consume())
+        self.assertLess(time.perf_counter() - start, 5)
+        # 迭代器已在线程池中关闭，连接已归还
+        self.assertEqual(db._pool._idle.qsize(), db._pool.created)
+        chunks = [chunk async for chunk in adb.query_iter('slow_view', condition='0')]
+        self.assertEqual(len(chunks[0].index), 0)
+
+    async def test_cancel_holds_slot(self):
+        executor = AsyncExecutor(max_workers=4, max_concurrency=1)
+        events = []
+
+        def work(name):
+            events.append(name + '_start')
+            time.sleep(0.2)
+            events.append(name + '_end')
+
+        task = asyncio.ensure_future(executor.run(work, 'a'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        # 被取消的调用执行完毕前不占用其名额
+        await executor.run(work, 'b')
+        self.assertEqual(events, ['a_start', 'a_end', 'b_start', 'b_end'])
+
+    async def test_reuse(self):
+        executor = AsyncExecutor()
+        self.assertIs(AsyncExecutor(max_workers=2, max_concurrency=2), executor)
+        self.assertEqual((executor.max_workers, executor.max_concurrency), (2, 2))
+        with self.assertRaises(ValueError):
+            AsyncExecutor(max_concurrency=0)
+        # shutdown之后再次使用时重新建立线程池
+        executor.shutdown()
+        self.assertEqual(await AsyncExecutor().run(sum, [1, 2]), 3)
+        AsyncExecutor().shutdown()
+        AsyncExecutor(max_workers=3)
+        self.assertEqual(await AsyncDBHandler(DBHandler(db_url)).run(sum, [1, 2]), 3)
+
+    def test_error_init(self):
+        with self.assertRaises(ValueError):
+            AsyncExecutor(max_workers=0)
+        with self.assertRaises(ValueError):
+            AsyncExecutor(max_concurrency=0)
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
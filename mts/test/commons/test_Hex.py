@@ -0,0 +1,25 @@
+import unittest
+import numpy as np
+from mts.commons import hex_str, hex_str_array, hex_int_array
+
+
+class TestHex(unittest.TestCase):
+    def test_hex_str_array(self):
+        values = [int('a4059507fd30cfff', 16), 0, 255, int('ffffffffffffffff', 16)]
+        res = hex_str_array(np.array(values, dtype=np.uint64))
+        self.assertEqual(res.tolist(), [hex_str(value, 16) for value in values])
+        self.assertEqual(hex_str_array(values, 4).tolist(), [hex_str(value, -4) for value in values])
+        self.assertEqual(len(hex_str_array([])), 0)
+
+    def test_hex_int_array(self):
+        values = np.array([int('a4059507fd30cfff', 16), 0, 255], dtype=np.uint64)
+        res, valid = hex_int_array(hex_str_array(values), 16)
+        self.assertTrue(np.array_equal(res, values))
+        self.assertTrue(valid.all())
+        res, valid = hex_int_array(['A4059507FD30CFFF', 'a4059507fd30cff', 'a4059507fd30cffg', 'a4059507fd30cfff0'], 16)
+        self.assertEqual(res[0], values[0])
+        self.assertEqual(valid.tolist(), [True, False, False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()  # pragma: no cover
@@ -1,8 +1,11 @@
 import os
+import sqlite3
+import threading
 import unittest
 from mts.commons.const import *
 from mts.core.handler import DBHandler, DataFileHandler
 from mts.core.datamodel import DataDictionary
+from mts.core.id import ObjectId
 
 cwd = os.path.abspath(os.path.dirname(__file__)).split('core')[0]
 output_dir = os.path.join(os.getcwd(), 'output')
@@ -115,6 +118,346 @@ class TestDataDictionary(unittest.TestCase):
         self.assertEqual(ddid[1:], dd.map_oid(desc='黑'))
         self.assertEqual('黑', dd.map_desc(ddid[1:]))
 
+    @staticmethod
+    def _created_at(oid: str):
+        return ObjectId.timestamp(ObjectId.unpack(oid)[1]).format('YYYY-MM-DD HH:mm:ss.SSS')
+
+    def test_query_created_between(self):
+        service_id = '51'
+        dd = DataDictionary(service_id)
+        dd_file_name = os.path.join(cwd, 'resources', 'ds', '51.dd')
+        dd.sync_db(dd_file_name, True)
+        res = dd.query(created_between={KEY_FROM: '2021-01-01', KEY_TO: '2022-01-01'})
+        self.assertEqual(len(res.index), len(dd.query().index))
+        # 时间窗口由id中的创建时间换算为本地时间，与查询时的解析方式一致
+        created_at = self._created_at('a4059507fd30c000')
+        res = dd.query(True, created_between={KEY_FROM: created_at, KEY_TO: created_at})
+        self.assertEqual(res, [
+            'a4059507fd30c000', 'a4059507fd30c001', 'a4059507fd30c002', 'a4059507fd30c003',
+            'a4059507fd30c004', 'a4059507fd30c005', 'a4059507fd30c006'])
+        oid_from = self._created_at(dd.query(True, dd_type=DD_TYPE_TAG_VALUE, desc=['黄'])[0])
+        oid_to = self._created_at(dd.query(True, dd_type=DD_TYPE_TAG_VALUE, desc=['进口'])[0])
+        res = dd.query(True, dd_type=DD_TYPE_TAG_VALUE, created_between={KEY_FROM: oid_from, KEY_TO: oid_to})
+        self.assertEqual(res, dd.query(True, desc=['黄', '绿', '橙', '白', '紫', '国产', '进口']))
+        self.assertEqual(len(dd.query(created_between={KEY_FROM: '2022-01-01', KEY_TO: '2023-01-01'}).index), 0)
+        with self.assertRaises(ValueError):
+            dd.query(created_between={KEY_FROM: '2022-01-01'})
+
+    def test_add_transaction(self):
+        service_id = '55'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        commit = dd._db.metrics['writer']['commit']
+        with dd._db.transaction():
+            ddid_01 = dd.add(dd_type=DD_TYPE_METRIC, desc='销量/斤')
+            dd.add(dd_type=DD_TYPE_METRIC, desc='进货量/斤')
+            ddid_02 = dd.add(dd_type=DD_TYPE_METRIC, desc='销量/斤')
+        self.assertEqual(ddid_01, ddid_02)
+        self.assertEqual(dd._db.metrics['writer']['commit'], commit + 1)
+        self.assertEqual(len(DataDictionary(service_id).query().index), 2)
+
+    def test_index(self):
+        service_id = '51'
+        dd = DataDictionary(service_id)
+        dd_file_name = os.path.join(cwd, 'resources', 'ds', '51.dd')
+        dd.sync_db(dd_file_name, True)
+        data = dd._data
+        # 与逐行过滤的结果一致
+        for dd_type in DD_TYPES:
+            expected = data[data[FIELD_DDID].str[0] == dd_type]
+            self.assertTrue(dd.query(dd_type=dd_type).equals(expected))
+            self.assertEqual(dd.query(True, dd_type=dd_type), sorted(expected[FIELD_DDID].str[1:].tolist()))
+        descs = ['苹果', '颜色', '黄', '不存在']
+        expected = data[data[FIELD_DESC].isin(descs)]
+        self.assertTrue(dd.query(desc=descs).equals(expected))
+        self.assertTrue(dd.query(desc=descs + descs).equals(expected))
+        expected = expected[expected[FIELD_DDID].str[0] == DD_TYPE_TAG_VALUE]
+        self.assertTrue(dd.query(dd_type=DD_TYPE_TAG_VALUE, desc=descs).equals(expected))
+        ddids = data[FIELD_DDID].tolist()[3:6] + ['1a4059507fd2fcfff']
+        self.assertTrue(dd.query(ddid=ddids).equals(data.iloc[3:6]))
+        self.assertTrue(dd.query(ddid=ddids, desc=[data[FIELD_DESC][4]]).equals(data.iloc[4:5]))
+        self.assertTrue(dd.query(oid='a4059507fd30c001', dd_type=DD_TYPE_METRIC).empty)
+        self.assertEqual(dd.query(oid='a4059507fd30c001', dd_type=DD_TYPE_OWNER)[FIELD_DESC].tolist(), ['山竹'])
+        self.assertTrue(dd.query().equals(data))
+        self.assertEqual(dd.query(True), sorted(data[FIELD_DDID].str[1:].tolist()))
+        # 返回值的修改不影响字典本身
+        res = dd.query(True, dd_type=DD_TYPE_METRIC)
+        res.append('0000000000000000')
+        self.assertEqual(dd.query(True, dd_type=DD_TYPE_METRIC), ['a4059507fd30c003', 'a4059507fd30c004'])
+        self.assertEqual(dd.map_oid('苹果', DD_TYPE_OWNER), 'a4059507fd2fc000')
+        self.assertEqual(dd.map_desc('a4059507fd2fc000', DD_TYPE_OWNER), '苹果')
+        self.assertIsNone(dd.map_oid('不存在'))
+        self.assertIsNone(dd.map_desc('0000000000000000'))
+        # 重复添加时返回已有的ddid
+        self.assertEqual(dd.add(dd_type=DD_TYPE_OWNER, desc='梨'), '1a4059507fd2fc001')
+
+    def test_add_many(self):
+        service_id = '54'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        ddid_01 = dd.add(dd_type=DD_TYPE_METRIC, desc='销量/斤')
+        engine = dd._db.metrics['engine']
+        commit = dd._db.metrics['writer']['commit']
+        items = [{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_' + str(i)} for i in range(500)]
+        items.append({'dd_type': DD_TYPE_METRIC, 'desc': '销量/斤'})
+        items.append({'dd_type': DD_TYPE_OWNER, 'desc': 'owner_0'})
+        items.append({'dd_type': DD_TYPE_TAG_VALUE, 'desc': '黑', 'oid': 'a4059507fd30c005', 'mask': '0000000000000007'})
+        res = dd.add_many(items)
+        self.assertEqual(len(res), 503)
+        self.assertEqual(res[500], ddid_01)
+        self.assertEqual(res[501], res[0])
+        self.assertEqual(res[502], '4a4059507fd30c005')
+        self.assertEqual(len(set(res[:500])), 500)
+        # 一次提交，且未重新读取数据库
+        self.assertEqual(dd._db.metrics['writer']['commit'], commit + 1)
+        self.assertEqual(dd._db.metrics['engine'], engine)
+        self.assertEqual(dd.map_oid('owner_7'), res[7][1:])
+        self.assertEqual(dd.map_desc('a4059507fd30c005', DD_TYPE_TAG_VALUE), '黑')
+        self.assertEqual(dd.add_many(items[:3]), res[:3])
+        self.assertEqual(dd._db.metrics['writer']['commit'], commit + 1)
+        self.assertEqual(dd.add_many([]), [])
+        with self.assertRaises(ValueError):
+            dd.add_many([{'dd_type': DD_TYPE_OWNER}])
+        with self.assertRaises(ValueError):
+            dd.add_many([{'desc': 'owner_x'}])
+        # 内存中的结果与重新加载的结果一致
+        dd_02 = DataDictionary(service_id)
+        self.assertEqual(dd.query(True), dd_02.query(True))
+        self.assertEqual(dd.query(True, dd_type=DD_TYPE_OWNER), dd_02.query(True, dd_type=DD_TYPE_OWNER))
+        self.assertEqual(sorted(dd.query()[FIELD_DESC].tolist()), sorted(dd_02.query()[FIELD_DESC].tolist()))
+
+    def test_incremental(self):
+        service_id = '53'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        engine = dd._db.metrics['engine']
+        ddids = [dd.add(dd_type=DD_TYPE_OWNER, desc='owner_' + str(i)) for i in range(20)]
+        dd.remove(ddids[5])
+        dd.remove(ddids[5])
+        self.assertEqual(dd._db.metrics['engine'], engine)
+        self.assertIsNone(dd.map_oid('owner_5'))
+        self.assertEqual(dd.map_oid('owner_6'), ddids[6][1:])
+        self.assertEqual(dd.query(ddid=[ddids[19]])[FIELD_DESC].tolist(), ['owner_19'])
+        self.assertEqual(len(dd.query().index), 19)
+        dd_02 = DataDictionary(service_id)
+        self.assertTrue(dd.query().reset_index(drop=True).equals(dd_02.query()))
+        self.assertEqual(dd.query(True, dd_type=DD_TYPE_OWNER), dd_02.query(True, dd_type=DD_TYPE_OWNER))
+
+    def test_shared(self):
+        service_id = '61'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        shared = DataDictionary.shared(service_id)
+        self.assertIs(DataDictionary.shared(service_id), shared)
+        # 经共享实例写入，版本号递增，实例不变
+        version = shared.version
+        ddid = shared.add(dd_type=DD_TYPE_OWNER, desc='owner_0')
+        self.assertEqual(shared.version, version + 1)
+        self.assertIs(DataDictionary.shared(service_id), shared)
+        shared.add_many([{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_1'}])
+        self.assertIs(DataDictionary.shared(service_id), shared)
+        # 经其他实例写入后，共享实例重新加载
+        dd.add(dd_type=DD_TYPE_OWNER, desc='owner_2')
+        shared_02 = DataDictionary.shared(service_id)
+        self.assertIsNot(shared_02, shared)
+        self.assertEqual(shared_02.version, dd.version)
+        self.assertEqual(len(shared_02.query(True)), 3)
+        shared_02.remove(ddid)
+        self.assertIs(DataDictionary.shared(service_id), shared_02)
+        self.assertIsNone(shared_02.map_oid('owner_0'))
+        # 显式清除
+        DataDictionary.invalidate(service_id)
+        shared_03 = DataDictionary.shared(service_id)
+        self.assertIsNot(shared_03, shared_02)
+        self.assertEqual(shared_03.query(True), shared_02.query(True))
+        DataDictionary.invalidate()
+        self.assertIsNot(DataDictionary.shared(service_id), shared_03)
+
+    def test_shared_rollback(self):
+        service_id = '62'
+        dd = DataDictionary.shared(service_id)
+        with self.assertRaises(RuntimeError):
+            with dd._db.transaction():
+                dd.add(dd_type=DD_TYPE_OWNER, desc='owner_x')
+                self.assertIsNotNone(dd.map_oid('owner_x'))
+                raise RuntimeError()
+        # 事务回滚后共享实例按数据库重新加载，不含未提交的数据
+        shared = DataDictionary.shared(service_id)
+        self.assertIs(shared, dd)
+        self.assertIsNone(shared.map_oid('owner_x'))
+
+    def test_refresh(self):
+        service_id = '63'
+        # dd与worker模拟两个进程各自持有的数据字典
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        worker = DataDictionary(service_id)
+        self.assertEqual(worker.refresh(), 0)
+        seq = worker.seq
+        ddid_01 = dd.add(dd_type=DD_TYPE_OWNER, desc='owner_1')
+        ddids = dd.add_many([{'dd_type': DD_TYPE_METRIC, 'desc': 'metric_' + str(i)} for i in range(3)])
+        dd.remove(ddid_01)
+        self.assertIsNone(worker.map_oid('metric_0'))
+        self.assertEqual(worker.refresh(), 5)
+        self.assertEqual(worker.seq, seq + 5)
+        self.assertIsNone(worker.map_oid('owner_1'))
+        self.assertEqual(worker.map_oid('metric_2', DD_TYPE_METRIC), ddids[2][1:])
+        self.assertEqual(worker.query(True), dd.query(True))
+        self.assertEqual(worker.refresh(), 0)
+        # worker自身的写入已推进seq，refresh时不再重复应用
+        ddid_02 = worker.add(dd_type=DD_TYPE_OWNER, desc='owner_2')
+        self.assertEqual(worker.seq, seq + 6)
+        self.assertEqual(worker.refresh(), 0)
+        dd.remove(ddids[0])
+        self.assertEqual(worker.refresh(), 1)
+        self.assertEqual(worker.map_oid('owner_2'), ddid_02[1:])
+        self.assertIsNone(worker.map_oid('metric_0'))
+        self.assertTrue(worker.query().reset_index(drop=True).equals(DataDictionary(service_id).query()))
+        # 其他实例的日志夹在中间时seq保持不变，由refresh按序应用
+        dd.add(dd_type=DD_TYPE_OWNER, desc='owner_3')
+        worker.add_many([{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_4'}])
+        self.assertEqual(worker.seq, seq + 7)
+        self.assertEqual(worker.refresh(), 2)
+        self.assertEqual(worker.seq, seq + 9)
+        # 指定的oid已存在时不写入，也不记录日志
+        count = len(dd._db.query(dd._log_table_name).index)
+        self.assertEqual(worker.add(dd_type=DD_TYPE_METRIC, desc='metric_x', oid=ddids[1][1:]), ddids[1])
+        self.assertEqual(worker.add_many([{'dd_type': DD_TYPE_METRIC, 'desc': 'metric_y', 'oid': ddids[2][1:]}]), [ddids[2]])
+        self.assertEqual(len(dd._db.query(dd._log_table_name).index), count)
+        self.assertIsNone(worker.map_oid('metric_x'))
+        self.assertEqual(worker.refresh(), 0)
+        # 重新导入后全部重新加载，之前的日志被清除
+        dd_file_name = os.path.join(cwd, 'resources', 'ds', '51.dd')
+        dd.sync_db(dd_file_name, True)
+        self.assertEqual(worker.refresh(), 1)
+        self.assertEqual(worker.map_oid('苹果'), 'a4059507fd2fc000')
+        self.assertIsNone(worker.map_oid('owner_2'))
+        self.assertEqual(len(dd._db.query(dd._log_table_name).index), 1)
+
+    def test_map_many(self):
+        service_id = '51'
+        dd = DataDictionary(service_id)
+        dd_file_name = os.path.join(cwd, 'resources', 'ds', '51.dd')
+        dd.sync_db(dd_file_name, True)
+        descs = dd.query()[FIELD_DESC].tolist() + ['不存在', None]
+        oids = [item[1:] for item in dd.query()[FIELD_DDID].tolist()] + ['123']
+        for dd_type in [None] + DD_TYPES:
+            res = dd.map_oid_many(descs, dd_type)
+            self.assertEqual(len(res), len(descs))
+            self.assertEqual(res.tolist(), [dd.map_oid(item, dd_type) for item in descs])
+            self.assertEqual(dd.map_desc_many(oids, dd_type).tolist(), [dd.map_desc(item, dd_type) for item in oids])
+        self.assertEqual(dd.map_oid_many(['不存在'], missing='').tolist(), [''])
+        # 增删后查找表随之更新
+        ddid = dd.add(dd_type=DD_TYPE_OWNER, desc='owner_many')
+        self.assertEqual(dd.map_oid_many(['owner_many']).tolist(), [ddid[1:]])
+        dd.remove(ddid)
+        self.assertEqual(dd.map_desc_many([ddid[1:]], DD_TYPE_OWNER).tolist(), [None])
+
+    @staticmethod
+    def _create_by_other_process(db, table_name, ddid, desc):
+        # 模拟其他进程：在另一个连接中建表并写入
+        conn = sqlite3.connect(db._db_url[len('sqlite://'):])
+        conn.execute('DROP TABLE IF EXISTS ' + table_name)
+        conn.execute('CREATE TABLE ' + table_name + ' (ddid VARCHAR(17) PRIMARY KEY, desc VARCHAR(160), oid_mask VARCHAR(32))')
+        conn.execute('INSERT INTO ' + table_name + ' VALUES (?, ?, ?)', (ddid, desc, ddid[1:] + MASK_DEFAULT))
+        conn.commit()
+        conn.close()
+
+    def test_table_created_by_other_process(self):
+        db = DataDictionary('52')._db
+        self.assertNotIn('dd_64', db.get_tables())
+        self._create_by_other_process(db, 'dd_64', '1a4059507fd2fc000', '苹果')
+        self.assertEqual(DataDictionary('64').map_oid('苹果'), 'a4059507fd2fc000')
+        # 不检查schema_version时缓存的表结构已过期，但已存在的表不会被删除重建
+        db._schema_check = False
+        try:
+            self.assertNotIn('dd_65', db.get_tables())
+            self._create_by_other_process(db, 'dd_65', '1a4059507fd2fc001', '香蕉')
+            self.assertFalse(db.exist_table('dd_65'))
+            self.assertEqual(DataDictionary('65').map_oid('香蕉'), 'a4059507fd2fc001')
+        finally:
+            db._schema_check = True
+
+    def test_rollback(self):
+        service_id = '66'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        ddids = dd.add_many([{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_' + str(i)} for i in range(4)])
+        with self.assertRaises(RuntimeError):
+            with dd._db.transaction():
+                dd.add(dd_type=DD_TYPE_OWNER, desc='owner_x')
+                dd.add_many([{'dd_type': DD_TYPE_METRIC, 'desc': 'metric_x'}])
+                dd.remove(ddids[0])
+                self.assertIsNotNone(dd.map_oid('owner_x'))
+                self.assertIsNone(dd.map_oid('owner_0'))
+                raise RuntimeError()
+        # 直接持有的实例在回滚后与数据库一致
+        self.assertIsNone(dd.map_oid('owner_x'))
+        self.assertIsNone(dd.map_oid('metric_x'))
+        self.assertEqual(dd.map_oid('owner_0'), ddids[0][1:])
+        self.assertEqual(dd.query(True), DataDictionary(service_id).query(True))
+
+    def test_remove_in_place(self):
+        service_id = '67'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        ddids = dd.add_many([{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_' + str(i)} for i in range(10)])
+        for ddid in ddids[2:6]:
+            dd.remove(ddid)
+        # 删除只留下空位，未整理前其他行的位置不变
+        self.assertEqual(dd._removed, 4)
+        self.assertEqual(dd._ddid_index[ddids[9]], 9)
+        dd_02 = DataDictionary(service_id)
+        self.assertTrue(dd.query().reset_index(drop=True).equals(dd_02.query()))
+        self.assertEqual(dd.query(True, dd_type=DD_TYPE_OWNER), dd_02.query(True, dd_type=DD_TYPE_OWNER))
+        self.assertEqual(dd.map_oid_many(['owner_1', 'owner_2']).tolist(), [ddids[1][1:], None])
+        # 空位超过半数时整理
+        dd.remove(ddids[6])
+        self.assertEqual(dd._removed, 5)
+        dd.remove(ddids[7])
+        self.assertEqual(dd._removed, 0)
+        self.assertEqual(len(dd._ddids), 4)
+        self.assertEqual(dd.query(desc=['owner_9'])[FIELD_DDID].tolist(), [ddids[9]])
+
+    def test_concurrent(self):
+        service_id = '71'
+        dd = DataDictionary(service_id)
+        dd.init_db()
+        dd.load_data()
+        ddids = dd.add_many([{'dd_type': DD_TYPE_OWNER, 'desc': 'owner_' + str(i)} for i in range(20)])
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    dd.map_oid_many(['owner_' + str(i) for i in range(40)])
+                    dd.query(True, dd_type=DD_TYPE_OWNER)
+                    dd.query(desc=['owner_1', 'owner_30'])
+                    dd.map_desc(ddids[1][1:])
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i in range(20, 40):
+                dd.add(dd_type=DD_TYPE_OWNER, desc='owner_' + str(i))
+            for ddid in ddids[2:18]:
+                dd.remove(ddid)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(dd.query(True), DataDictionary(service_id).query(True))
+
     def test_field(self):
         service_id = '57'
         dd = DataDictionary(service_id)
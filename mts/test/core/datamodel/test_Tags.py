@@ -49,6 +49,18 @@ class TestTags(unittest.TestCase):
         self.assertEqual(4, t.enum_value('绿'))
         self.assertEqual(None, t.enum_value('黑'))
 
+    def test_map_many(self):
+        service_id = '51'
+        t = Tags(service_id)
+        descs = ['货源', '红', '颜色', '黑', '绿'] * 3
+        self.assertEqual(t.map_oid_many(descs).tolist(), [t.oid(item) for item in descs])
+        self.assertEqual(t.map_oid_many(['黑'], missing='').tolist(), [''])
+        oids = t.value + ['123']
+        for mask in [0, 1, 4]:
+            self.assertEqual(t.map_desc_many(oids, mask).tolist(), [t.desc(item, mask) for item in oids])
+        self.assertEqual(t.map_desc_many(['123'], missing=None).tolist(), [None])
+        self.assertEqual(len(t.map_desc_many([])), 0)
+
 
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
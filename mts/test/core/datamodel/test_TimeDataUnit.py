@@ -1,6 +1,7 @@
 import os
 import unittest
 import numpy as np
+from mts.commons.const import *
 from mts.core.datamodel import TimeDataUnit, DataDictionary
 from mts.core.handler import DataFileHandler, DBHandler
 
@@ -77,6 +78,84 @@ class TestTimeDataUnit(unittest.TestCase):
         res_02 = tdu.query(any=['2021-01-01', '2021-01-31'])
         self.assertTrue(res_01.equals(res_02))
 
+    def test_query_iter(self):
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu.sync_db(filename, True)
+        chunks = list(tdu.query_iter(chunk_rows=3))
+        self.assertEqual([chunk.shape[0] for chunk in chunks], [3, 1])
+        res = tdu.query()
+        self.assertTrue(res.equals(tdu.query(chunk_rows=1)))
+        res = tdu.query(desc=['销量/斤'], interval={'from': '2021-01-01', 'to': '2021-03-31'})
+        self.assertTrue(res.equals(tdu.query(desc=['销量/斤'], interval={'from': '2021-01-01', 'to': '2021-03-31'}, chunk_rows=1)))
+        # 分块导出结果与整表导出一致
+        tdu._db.export_data(output_dir, tdu._table_name, chunk_rows=1)
+        file_02 = os.path.join(output_dir, 'tdu_51_a4059507fd2fc000.csv')
+        self.assertEqual(DataFileHandler.checksum(filename), DataFileHandler.checksum(file_02))
+
+    def test_query_arrow(self):
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu.sync_db(filename, True)
+        for kwargs in [{}, {'metric': ['a4059507fd30c004']}, {'desc': ['进货量/斤']},
+                       {'interval': {'from': '2021-01-01', 'to': '2021-03-31'}},
+                       {'any': ['2021-01-01', '2021-01-31']}, {'any': ['2030-01-01']}, {'chunk_rows': 3}]:
+            res = tdu.query(return_type='arrow', **kwargs)
+            self.assertEqual(res.schema.names[0], 'timestamp')
+            df = tdu.query(**kwargs)
+            self.assertTrue(TimeDataUnit.to_pandas(res).equals(df))
+        chunks = list(tdu.query_iter(return_type='arrow', chunk_rows=3))
+        self.assertEqual([chunk.num_rows for chunk in chunks], [3, 1])
+        res = tdu.query(return_type='arrow', interval={'from': '2030-01-01', 'to': '2030-03-31'})
+        self.assertEqual(res.num_rows, 0)
+        self.assertTrue(tdu.query(interval={'from': '2030-01-01', 'to': '2030-03-31'}).empty)
+
+    def test_import_columns(self):
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        # 只有取值项、没有描述的指标不映射空列名
+        dd = DataDictionary.shared('51')
+        oid = dd.add(dd_type=DD_TYPE_METRIC_VALUE, desc='低', mask='0000000000000001')[1:]
+        tdu.reset_metrics(True)
+        self.assertTrue(tdu.metrics.exists_oid(oid))
+        self.assertEqual(tdu.map_desc(oid), '')
+        self.assertEqual(tdu._import_columns(), {'进货量/斤': 'a4059507fd30c003', '销量/斤': 'a4059507fd30c004'})
+
+    def test_sync_db_arrow(self):
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu.sync_db(filename, True)
+        res_01 = tdu.query()
+        tdu.init_db()
+        self.assertEqual(tdu.import_data(filename, parser='arrow', batch_rows=2), 4)
+        self.assertTrue(res_01.equals(tdu.query()))
+
+    def test_sync_db_columnar(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu.sync_db(filename, True)
+        res_01 = tdu.query()
+        # Parquet：timestamp为时间类型，指标列以描述命名
+        table = tdu.query(return_type='arrow')
+        names = ['timestamp'] + [tdu.map_desc(name) for name in table.schema.names[1:]]
+        parquet_filename = os.path.join(output_dir, 'tdu_51_a4059507fd2fc000.parquet')
+        pq.write_table(table.rename_columns(names), parquet_filename)
+        tdu.sync_db(parquet_filename, True)
+        self.assertTrue(res_01.equals(tdu.query()))
+        # Arrow IPC：原始的字符串时间戳，指标列以oid命名
+        table = tdu._db.query(tdu._table_name, return_type='arrow')
+        ipc_filename = os.path.join(output_dir, 'tdu_51_a4059507fd2fc000.arrow')
+        with pa.ipc.new_file(ipc_filename, table.schema) as writer:
+            writer.write_table(table)
+        tdu.sync_db(ipc_filename, True)
+        self.assertTrue(res_01.equals(tdu.query()))
+        with pa.ipc.new_stream(ipc_filename, table.schema) as writer:
+            writer.write_table(table)
+        tdu.init_db()
+        self.assertEqual(tdu.import_data(ipc_filename, batch_rows=3), 4)
+        self.assertTrue(res_01.equals(tdu.query()))
+
     def test_add_01(self):
         tdu = TimeDataUnit('1a4059507fd2fc000')
         filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
@@ -127,6 +206,20 @@ class TestTimeDataUnit(unittest.TestCase):
         self.assertEqual(df.shape, (1, 2))
         self.assertEqual(38, df['a4059507fd30c004'][0])
 
+    def test_add_rollback(self):
+        tdu = TimeDataUnit('1a4059507fd2fc000')
+        filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
+        tdu.sync_db(filename, True)
+        with self.assertRaises(Exception):
+            tdu.add(ts='not-a-date', data_desc={'新指标': 1})
+        # 回滚后新指标及其字段均不存在，再次添加时重新创建
+        self.assertFalse(tdu.metrics.exists('新指标'))
+        self.assertIsNone(DataDictionary.shared('51').map_oid('新指标'))
+        tdu.add(ts='2022-01-01', data_desc={'新指标': 1})
+        oid = tdu.metrics.oid('新指标')
+        df = tdu.query(interval={'from': '2022-1-1', 'to': '2023-1-1'})
+        self.assertEqual(df[oid].tolist(), [1])
+
     def test_reset_metrics(self):
         tdu = TimeDataUnit('1a4059507fd2fc000')
         filename = os.path.join(cwd, 'resources', 'ds', '51_a4059507fd2fc000.tdu')
@@ -1,7 +1,11 @@
 import os
+import sqlite3
+import threading
 import unittest
+from unittest import mock
+import pandas as pd
 from mts.commons.singleton import _Singleton
-from mts.core.handler import DBHandler, DataFileHandler
+from mts.core.handler import DBHandler, DataFileHandler, ConnectionPool
 from mts.core.id import DataDictionaryId, Service
 from mts.commons.const import *
 
@@ -149,6 +153,493 @@ class TestDBHandler(unittest.TestCase):
         db.remove(dd_table_name, 'ddid="' + str(ddid_02) + '"')
         self.assertEqual(db.query(dd_table_name)['ddid'].tolist(), [str(ddid_01)])
 
+    def test_params(self):
+        db = DBHandler(db_url)
+        service_id = '57'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        ddid_01 = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+        ddid_02 = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+        db.add({'ddid': str(ddid_01), 'desc': "测试'项_01", 'oid_mask': ''}, dd_table_name)
+        db.add({'ddid': str(ddid_02), 'desc': '测试项_02', 'oid_mask': ''}, dd_table_name)
+        res = db.query(dd_table_name, ['ddid'], 'desc = ?', ["测试'项_01"])
+        self.assertEqual(res['ddid'].tolist(), [str(ddid_01)])
+        db.remove(dd_table_name, 'ddid = ?', (str(ddid_01),))
+        self.assertEqual(db.query(dd_table_name)['ddid'].tolist(), [str(ddid_02)])
+
+    def test_error_cached_statements(self):
+        with self.assertRaises(ValueError):
+            DBHandler(db_url, cached_statements=-1)
+
+    def test_error_pool_size(self):
+        with self.assertRaises(ValueError):
+            DBHandler(db_url, pool_size=0)
+
+    def test_pool(self):
+        db = DBHandler(db_url, pool_size=2)
+        service_id = '56'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        errors = []
+
+        def worker(index):
+            try:
+                for i in range(20):
+                    ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+                    db.add({'ddid': str(ddid), 'desc': '测试项_' + str(index), 'oid_mask': ''}, dd_table_name)
+                    self.assertTrue(dd_table_name in db.get_tables())
+                    self.assertTrue('ddid' in db.get_fields(dd_table_name))
+                    res = db.query(dd_table_name, condition='ddid = ?', params=(str(ddid),))
+                    self.assertEqual(len(res.index), 1)
+            except Exception as e:  # pragma: no cover
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(db.query(dd_table_name).index), 120)
+        metrics = db.metrics
+        self.assertEqual(metrics['writer']['acquire'], 121)
+        self.assertTrue(metrics['reader']['acquire'] >= 120)
+        self.assertTrue(db._pool.created <= 2)
+        db.disconnect()
+        self.assertIsNone(db.metrics['reader'])
+
+    def test_pool_close(self):
+        pool = ConnectionPool(db_file_name, 2)
+        conn_01 = pool.acquire()
+        conn_02 = pool.acquire()
+        pool.release(conn_02)
+        pool.close()
+        # 空闲连接立即关闭，使用中的连接在归还时关闭
+        self.assertEqual(pool.created, 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn_02.execute('SELECT 1')
+        self.assertEqual(conn_01.execute('SELECT 1').fetchone()[0], 1)
+        pool.release(conn_01)
+        self.assertEqual(pool.created, 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn_01.execute('SELECT 1')
+        with self.assertRaises(ValueError):
+            pool.acquire()
+        # 关闭时唤醒等待空闲连接的线程
+        pool = ConnectionPool(db_file_name, 1)
+        conn = pool.acquire()
+        errors = []
+
+        def wait():
+            try:
+                pool.acquire()
+            except ValueError as e:
+                errors.append(e)
+
+        t = threading.Thread(target=wait)
+        t.start()
+        t.join(0.1)
+        pool.close()
+        t.join()
+        self.assertEqual(len(errors), 1)
+        pool.release(conn)
+        self.assertEqual(pool.created, 0)
+
+    def test_add_many(self):
+        db = DBHandler(db_url)
+        service_id = '57'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        commit = db.metrics['writer']['commit']
+        rows = []
+        for i in range(50):
+            ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+            rows.append({'ddid': str(ddid), 'desc': '测试项_' + str(i), 'oid_mask': ''})
+        rows.append({'ddid': rows[0]['ddid'], 'desc': '重复项'})
+        # 返回最后插入行的rowid，被忽略的行不计
+        self.assertEqual(db.add_many(rows, dd_table_name), 50)
+        self.assertEqual(db.metrics['writer']['commit'], commit + 1)
+        self.assertEqual(len(db.query(dd_table_name).index), 50)
+        self.assertIsNone(db.add_many([], dd_table_name))
+        self.assertIsNone(db.add_many(rows[-1:], dd_table_name))
+        self.assertIsNone(db.add(rows[-1], dd_table_name))
+        ddid = str(DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id))
+        self.assertEqual(db.add({'ddid': ddid, 'desc': '新增项'}, dd_table_name), 51)
+        self.assertEqual(len(db.query(dd_table_name).index), 51)
+        db.disconnect()
+
+    def test_transaction(self):
+        db = DBHandler(db_url)
+        service_id = '54'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        commit = db.metrics['writer']['commit']
+        with db.transaction():
+            for i in range(10):
+                ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+                db.add({'ddid': str(ddid), 'desc': '测试项_' + str(i), 'oid_mask': ''}, dd_table_name)
+            with db.transaction():
+                ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+                db.add({'ddid': str(ddid), 'desc': '测试项_嵌套', 'oid_mask': ''}, dd_table_name)
+            self.assertTrue(db.in_transaction())
+            # 事务内可读到未提交数据，其他连接不可见
+            self.assertEqual(len(db.query(dd_table_name).index), 11)
+            conn = sqlite3.connect(db_file_name)
+            self.assertEqual(conn.execute('SELECT count(*) FROM ' + dd_table_name).fetchone()[0], 0)
+            conn.close()
+        self.assertFalse(db.in_transaction())
+        self.assertEqual(db.metrics['writer']['commit'], commit + 1)
+        self.assertEqual(len(db.query(dd_table_name).index), 11)
+        # 异常时整体回滚
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+                db.add({'ddid': str(ddid), 'desc': '测试项_回滚', 'oid_mask': ''}, dd_table_name)
+                raise RuntimeError('rollback')
+        self.assertFalse(db.in_transaction())
+        self.assertEqual(len(db.query(dd_table_name).index), 11)
+        # 回滚后的回调只在最外层事务回滚时执行一次
+        hooks = []
+
+        def hook():
+            hooks.append('rollback')
+
+        db.on_rollback(lambda: hooks.append('outside'))
+        with db.transaction():
+            db.on_rollback(lambda: hooks.append('commit'))
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                with db.transaction():
+                    db.on_rollback(hook)
+                db.on_rollback(hook)
+                raise RuntimeError('rollback')
+        self.assertEqual(hooks, ['rollback'])
+        # KeyboardInterrupt等非Exception的中断同样回滚，未提交的写入不会随后续提交写入
+        with self.assertRaises(KeyboardInterrupt):
+            with db.transaction():
+                ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+                db.add({'ddid': str(ddid), 'desc': '测试项_中断', 'oid_mask': ''}, dd_table_name)
+                db.on_rollback(hook)
+                raise KeyboardInterrupt()
+        self.assertEqual(hooks, ['rollback', 'rollback'])
+        with self.assertRaises(KeyboardInterrupt):
+            with db.writer() as cursor:
+                cursor.execute('INSERT INTO ' + dd_table_name + " VALUES ('x', '测试项_中断', '')")
+                raise KeyboardInterrupt()
+        db.commit()
+        self.assertEqual(len(db.query(dd_table_name).index), 11)
+        db.disconnect()
+
+    def test_profile(self):
+        wal_file_name = db_file_name + '_wal'
+        db = DBHandler(db_url + '_wal', profile=PROFILE_BALANCED)
+        self.assertEqual(db.profile, PROFILE_BALANCED)
+        self.assertEqual(db.connect().execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(db.connect().execute('PRAGMA synchronous').fetchone()[0], 1)
+        with db.reader() as conn:
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+            self.assertEqual(conn.execute('PRAGMA temp_store').fetchone()[0], 2)
+        db.init_table('dd_53', FIELDS_DD)
+        self.assertTrue(os.path.exists(wal_file_name + '-wal'))
+        db.register(db_url + '_wal', PROFILE_FAST)
+        self.assertFalse(db.is_connect())
+        self.assertEqual(db.connect().execute('PRAGMA synchronous').fetchone()[0], 0)
+        self.assertTrue('dd_53' in db.get_tables())
+        db.set_profile(PROFILE_DEFAULT)
+        self.assertEqual(db.connect().execute('PRAGMA synchronous').fetchone()[0], 2)
+        with self.assertRaises(ValueError):
+            db.set_profile('turbo')
+        self.assertEqual(db.profile, PROFILE_DEFAULT)
+        db.disconnect()
+
+    def test_catalog(self):
+        db = DBHandler(db_url)
+        dd_table_name = 'dd_52'
+        db.init_table(dd_table_name, FIELDS_DD)
+        self.assertTrue(db.exist_table(dd_table_name))
+        self.assertIsNotNone(db._catalog)
+        self.assertEqual(db.get_fields(dd_table_name), sorted(FIELDS_DD.keys()))
+        # 不检查schema_version时，缓存命中不再访问数据库
+        db._schema_check = False
+        acquire = db.metrics['reader']['acquire']
+        for i in range(10):
+            self.assertTrue(db.exist_table(dd_table_name))
+            self.assertTrue('ddid' in db.get_fields(dd_table_name))
+        self.assertEqual(db.metrics['reader']['acquire'], acquire)
+        db.add_column(dd_table_name, 'abc', 'INT')
+        self.assertTrue('abc' in db.get_fields(dd_table_name))
+        self.assertEqual(db.get_fields('dd_not_exist'), [])
+        # 回滚后缓存失效
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.add_column(dd_table_name, 'xyz', 'INT')
+                self.assertTrue('xyz' in db.get_fields(dd_table_name))
+                raise RuntimeError('rollback')
+        self.assertIsNone(db._catalog)
+        conn = sqlite3.connect(db_file_name)
+        fields = sorted([item[1] for item in conn.execute("PRAGMA table_info('" + dd_table_name + "')").fetchall()])
+        conn.close()
+        self.assertEqual(db.get_fields(dd_table_name), fields)
+        # 其他连接修改表结构
+        conn = sqlite3.connect(db_file_name)
+        conn.execute('CREATE TABLE dd_other (ddid VARCHAR(17))')
+        conn.commit()
+        self.assertFalse(db.exist_table('dd_other'))
+        db._schema_check = True
+        self.assertTrue(db.exist_table('dd_other'))
+        conn.execute('ALTER TABLE dd_other ADD COLUMN abc INT')
+        conn.execute('DROP TABLE dd_other')
+        conn.commit()
+        conn.close()
+        self.assertFalse(db.exist_table('dd_other'))
+        db.disconnect()
+        self.assertIsNone(db._catalog)
+
+    def test_query_iter(self):
+        db = DBHandler(db_url)
+        service_id = '53'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        chunks = list(db.query_iter(dd_table_name))
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].empty)
+        self.assertEqual(sorted(chunks[0].columns), sorted(FIELDS_DD.keys()))
+        rows = []
+        for i in range(10):
+            ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+            rows.append({'ddid': str(ddid), 'desc': '测试项_' + str(i), 'oid_mask': ''})
+        db.add_many(rows, dd_table_name)
+        self.assertEqual([len(df.index) for df in db.query_iter(dd_table_name, chunk_rows=4)], [4, 4, 2])
+        self.assertEqual([len(df.index) for df in db.query_iter(dd_table_name, chunk_rows=5)], [5, 5])
+        chunks = list(db.query_iter(dd_table_name, ['ddid'], 'desc != ?', ('测试项_0',), chunk_rows=3))
+        self.assertEqual(sum([len(df.index) for df in chunks]), 9)
+        self.assertEqual(list(chunks[0].columns), ['ddid'])
+        with self.assertRaises(ValueError):
+            next(db.query_iter(dd_table_name, chunk_rows=0))
+        db.export_data(output_dir, dd_table_name, chunk_rows=3)
+        df = db.query(dd_table_name)
+        df.to_csv(os.path.join(output_dir, 'dd_full.csv'), index=False)
+        self.assertEqual(DataFileHandler.checksum(os.path.join(output_dir, dd_table_name + '.csv')),
+                         DataFileHandler.checksum(os.path.join(output_dir, 'dd_full.csv')))
+        db.disconnect()
+
+    def test_query_arrow(self):
+        db = DBHandler(db_url)
+        service_id = '52'
+        dd_table_name = 'dd_' + service_id
+        db.init_table(dd_table_name, FIELDS_DD)
+        res = db.query(dd_table_name, return_type='arrow')
+        self.assertEqual(res.num_rows, 0)
+        self.assertEqual(sorted(res.schema.names), sorted(FIELDS_DD.keys()))
+        rows = []
+        for i in range(10):
+            ddid = DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id=service_id)
+            rows.append({'ddid': str(ddid), 'desc': '测试项_' + str(i), 'oid_mask': ''})
+        db.add_many(rows, dd_table_name)
+        res = db.query(dd_table_name, ['ddid', 'desc'], return_type='arrow')
+        self.assertEqual(res.num_rows, 10)
+        self.assertTrue(res.to_pandas().equals(db.query(dd_table_name, ['ddid', 'desc'])))
+        res = db.query(dd_table_name, ['ddid'], 'desc = ?', ('测试项_1',), return_type='arrow')
+        self.assertEqual(res.column('ddid').to_pylist(), [rows[1]['ddid']])
+        batches = list(db.query_iter(dd_table_name, chunk_rows=4, return_type='arrow'))
+        self.assertEqual([batch.num_rows for batch in batches], [4, 4, 2])
+        # 分批读取时各批类型不一致的列
+        batches = [DBHandler._arrow_arrays(rows, 3) for rows in [[(1, 1, None)], [(1.5, '', None)], [(None, 2, 'a')]]]
+        res = DBHandler._arrow_table(batches, ['a', 'b', 'c'])
+        self.assertEqual(res.column('a').to_pylist(), [1.0, 1.5, None])
+        self.assertEqual(res.column('b').to_pylist(), ['1', '', '2'])
+        self.assertEqual(res.column('c').to_pylist(), [None, None, 'a'])
+        with self.assertRaises(ValueError):
+            db.query(dd_table_name, return_type='numpy')
+        with self.assertRaises(ValueError):
+            next(db.query_iter(dd_table_name, return_type='numpy'))
+        db.disconnect()
+
+    def test_backend(self):
+        db = DBHandler(db_url)
+        table_name = 'tdu_backend'
+        db.init_table(table_name, {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT'})
+        # INT列中混有空字符串，connectorx无法推断类型
+        db.add_many([{'timestamp': '1.000', 'm1': 1}, {'timestamp': '2.000', 'm1': ''}], table_name)
+        engine = db.metrics['engine']
+        res = db.query(table_name)
+        self.assertEqual(len(res.index), 2)
+        shape = ('SELECT * from ' + table_name, 'pandas')
+        self.assertEqual(db.backends[shape], ENGINE_SQLITE)
+        metrics = db.metrics['engine']
+        self.assertEqual(metrics['fallback'], engine['fallback'] + 1)
+        self.assertEqual(metrics[ENGINE_SQLITE]['count'], engine[ENGINE_SQLITE]['count'] + 1)
+        # 相同形态的查询直接使用sqlite3
+        for i in range(3):
+            self.assertEqual(len(db.query(table_name).index), 2)
+        metrics = db.metrics['engine']
+        self.assertEqual(metrics['fallback'], engine['fallback'] + 1)
+        self.assertEqual(metrics[ENGINE_CX]['error'], engine[ENGINE_CX]['error'] + 1)
+        self.assertEqual(metrics[ENGINE_SQLITE]['count'], engine[ENGINE_SQLITE]['count'] + 4)
+        self.assertTrue(metrics[ENGINE_SQLITE]['time'] > engine[ENGINE_SQLITE]['time'])
+        # 带参数的查询不经过connectorx，也不计为回退
+        db.query(table_name, condition='timestamp = ?', params=('1.000',))
+        self.assertEqual(db.metrics['engine']['fallback'], engine['fallback'] + 1)
+        self.assertEqual(len(db.backends), 1)
+        # 其他形态的查询单独记录
+        db.query(table_name, ['timestamp'], return_type='arrow')
+        self.assertEqual(db.backends[('SELECT timestamp from ' + table_name, 'arrow')], ENGINE_CX)
+        db.register(db_url)
+        self.assertEqual(db.backends, {})
+        db.disconnect()
+
+    def test_backend_disabled(self):
+        db = DBHandler(db_url)
+        table_name = 'tdu_backend_disabled'
+        db.init_table(table_name, {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT'})
+        db.add({'timestamp': '1.000', 'm1': 1}, table_name)
+        error = db.metrics['engine'][ENGINE_CX]['error']
+        # 与数据无关的错误使整个DBHandler停用connectorx，其他形态的查询不再尝试
+        with mock.patch('mts.core.handler.cx.read_sql', side_effect=ImportError('connectorx')) as read_sql:
+            for fields in [None, ['timestamp'], ['m1']]:
+                self.assertEqual(db.query(table_name, fields, return_type='arrow').num_rows, 1)
+            self.assertEqual(read_sql.call_count, 1)
+        self.assertFalse(db.cx_enabled)
+        self.assertEqual(db.backends, {})
+        self.assertEqual(db.metrics['engine'][ENGINE_CX]['error'], error + 1)
+        db.disconnect()
+
+    def test_backend_retry(self):
+        db = DBHandler(db_url)
+        table_name = 'tdu_backend_retry'
+        db.init_table(table_name, {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT'})
+        db.add_many([{'timestamp': '1.000', 'm1': 1}, {'timestamp': '2.000', 'm1': ''}], table_name)
+        shape = ('SELECT * from ' + table_name, 'arrow')
+        # 与数据有关的错误只在重试间隔内改用sqlite3
+        db._cx_retry_interval = 0
+        try:
+            error = db.metrics['engine'][ENGINE_CX]['error']
+            db.query(table_name, return_type='arrow')
+            self.assertEqual(db.backends[shape], ENGINE_SQLITE)
+            db.query(table_name, return_type='arrow')
+            self.assertEqual(db.metrics['engine'][ENGINE_CX]['error'], error + 2)
+            # 数据修正后重新使用connectorx
+            db.remove(table_name, 'timestamp = ?', ('2.000',))
+            self.assertEqual(db.query(table_name, return_type='arrow').num_rows, 1)
+            self.assertEqual(db.backends[shape], ENGINE_CX)
+        finally:
+            del db._cx_retry_interval
+        # 只保留最近使用的查询形态
+        db._backends_max_size = 2
+        try:
+            db.register(db_url)
+            for fields in [['timestamp'], ['m1'], None]:
+                db.query(table_name, fields, return_type='arrow')
+            self.assertEqual(sorted(db.backends.keys()),
+                             sorted([('SELECT m1 from ' + table_name, 'arrow'), shape]))
+        finally:
+            del db._backends_max_size
+        db.disconnect()
+
+    def test_import_data(self):
+        db = DBHandler(db_url)
+        table_name = 'tdu_import'
+        fields = {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT', 'm2': 'INT'}
+        filename = os.path.join(output_dir, table_name + '.csv')
+        with open(filename, 'w') as fout:
+            fout.write('timestamp,m1,m2\n')
+            for i in range(25):
+                fout.write('{0}.000,{1},{2}\n'.format(1612022400 + i, i, '' if i % 5 == 0 else i * 2))
+            fout.write('\n')
+            fout.write('1612022400.000,100,100\n')  # 重复主键，忽略
+        db.init_table(table_name, fields)
+        commit = db.metrics['writer']['commit']
+        progress = []
+        count = db.import_data(filename, table_name, batch_rows=10, progress=lambda n, speed: progress.append(n))
+        self.assertEqual(count, 26)
+        self.assertEqual(progress, [10, 20, 26])
+        self.assertEqual(db.metrics['writer']['commit'], commit + 1)
+        res_csv = db.query(table_name)
+        self.assertEqual(len(res_csv.index), 25)
+        self.assertEqual(res_csv['timestamp'][0], '1612022400.000')
+        self.assertEqual(res_csv['m1'][0], 0)
+        # 使用pyarrow解析，数值字段的空值写入NULL
+        db.init_table(table_name, fields)
+        self.assertEqual(db.import_data(filename, table_name, batch_rows=7, parser='arrow'), 26)
+        res_arrow = db.query(table_name)
+        self.assertEqual(res_arrow['timestamp'].tolist(), res_csv['timestamp'].tolist())
+        self.assertEqual(res_arrow['m1'].tolist(), res_csv['m1'].tolist())
+        self.assertTrue(res_arrow['m2'].isna()[0])
+        self.assertEqual(res_arrow['m2'][1], 2)
+        with self.assertRaises(ValueError):
+            db.import_data(filename, table_name, batch_rows=0)
+        with self.assertRaises(ValueError):
+            db.import_data(filename, table_name, parser='json')
+        db.disconnect()
+
+    def test_export_service(self):
+        db = DBHandler(db_url)
+        fields_tdu = {'timestamp': 'VARCHAR(16) PRIMARY KEY', 'm1': 'INT', 'm2': 'REAL'}
+        db.init_table('dd_50', FIELDS_DD)
+        db.init_table('tdu_50_a', fields_tdu)
+        db.init_table('tdu_50_b', fields_tdu)
+        db.init_table('tdu_500_a', fields_tdu)
+        db.add_many([{'ddid': str(DataDictionaryId(dd_type=DD_TYPE_METRIC, service_id='50')), 'desc': '测试项_' + str(i),
+                      'oid_mask': ''} for i in range(5)], 'dd_50')
+        db.add_many([{'timestamp': '{0}.000'.format(1612022400 + i), 'm1': '' if i % 3 == 0 else i, 'm2': i / 2}
+                     for i in range(10)], 'tdu_50_a')
+        self.assertEqual(db.service_tables('50'), ['dd_50', 'tdu_50_a', 'tdu_50_b'])
+        export_dir = os.path.join(output_dir, 'export_50')
+        if not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+        manifest_filename = db.export_service('50', export_dir, workers=2, chunk_rows=3)
+        manifest = DataFileHandler.load_json(manifest_filename)
+        self.assertEqual(manifest['format'], 'csv.gz')
+        self.assertEqual([(item['table'], item['rows']) for item in manifest['tables']],
+                         [('dd_50', 5), ('tdu_50_a', 10), ('tdu_50_b', 0)])
+        self.assertTrue(DataFileHandler.verify_manifest(manifest_filename))
+        # 由压缩的CSV恢复
+        db.init_table('tdu_restore', fields_tdu)
+        self.assertEqual(db.import_data(os.path.join(export_dir, 'tdu_50_a.csv.gz'), 'tdu_restore'), 10)
+        self.assertTrue(db.query('tdu_restore').equals(db.query('tdu_50_a')))
+        # Parquet
+        manifest_filename = db.export_service('50', export_dir, fmt='parquet')
+        manifest = DataFileHandler.load_json(manifest_filename)
+        self.assertEqual([item['rows'] for item in manifest['tables']], [5, 10, 0])
+        self.assertTrue(DataFileHandler.verify_manifest(manifest_filename))
+        import pyarrow.parquet as pq
+        table = pq.read_table(os.path.join(export_dir, 'tdu_50_a.parquet'))
+        self.assertEqual(str(table.schema.field('m1').type), 'int64')
+        self.assertEqual(table.column('m1').null_count, 4)
+        self.assertEqual(table.column('timestamp').to_pylist()[0], '1612022400.000')
+        with open(os.path.join(export_dir, 'dd_50.parquet'), 'ab') as fout:
+            fout.write(b'0')
+        self.assertFalse(DataFileHandler.verify_manifest(manifest_filename))
+        self.assertFalse(DataFileHandler.verify_manifest(os.path.join(export_dir, 'not_exist.json')))
+        with self.assertRaises(ValueError):
+            db.export_service('50', export_dir, fmt='xlsx')
+        with self.assertRaises(ValueError):
+            db.export_service('50', export_dir, workers=0)
+        db.disconnect()
+
+    def test_error_profile(self):
+        with self.assertRaises(ValueError):
+            DBHandler(db_url, profile='turbo')
+
+    def test_reuse(self):
+        reuse_url = db_url + '_reuse'
+        db = DBHandler(reuse_url)
+        # 再次构造时profile与timezone生效，其他不一致的参数被忽略
+        self.assertIs(DBHandler(profile=PROFILE_BALANCED), db)
+        self.assertEqual(db.profile, PROFILE_BALANCED)
+        self.assertEqual(db.connect().execute('PRAGMA synchronous').fetchone()[0], 1)
+        DBHandler(reuse_url, '+00:00')
+        self.assertEqual(db.timezone, pd.Timedelta('+00:00:00'))
+        with self.assertRaises(ValueError):
+            DBHandler(timezone='+24:00')
+        with self.assertRaises(ValueError):
+            DBHandler(profile='turbo')
+        self.assertIs(DBHandler(db_url, pool_size=2), db)
+        self.assertEqual(db._pool_size, POOL_SIZE_DEFAULT)
+        self.assertEqual(db._db_url, reuse_url)
+        db.set_profile(PROFILE_DEFAULT)
+        db.disconnect()
+
 
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
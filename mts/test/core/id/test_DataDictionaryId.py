@@ -1,4 +1,5 @@
 import unittest
+import pandas as pd
 from mts.commons.const import *
 from mts.core.id import DataDictionaryId, Service
 
@@ -135,6 +136,61 @@ class TestDataDictionaryId(unittest.TestCase):
     def test_validate(self):
         self.assertTrue(DataDictionaryId.validate(int('2a00548d4e5abb001', 16)))
 
+    def test_pack_many(self):
+        ddids = DataDictionaryId.pack_many(DD_TYPE_OWNER, 43, 100)
+        self.assertEqual(len(set(ddids)), 100)
+        for ddid in ddids:
+            a = DataDictionaryId(ddid=hex_str(ddid, DDID_LEN))
+            self.assertEqual(a.dd_type, DD_TYPE_OWNER)
+            self.assertEqual(a.sid, Service.to_service_id(43))
+        self.assertEqual(DataDictionaryId.pack_many(2, 43, 1)[0] >> DD_TYPE_BITS_SHIFT, 2)
+
+    def test_error_pack_many(self):
+        with self.assertRaises(ValueError):
+            DataDictionaryId.pack_many('0', 43, 10)
+        with self.assertRaises(ValueError):
+            DataDictionaryId.pack_many(0x12, 43, 10)
+
+    def test_unpack_array(self):
+        ddids = ['2a00548d4e5abb001', '1a4059507fd2fc000']
+        res = DataDictionaryId.unpack_array(ddids)
+        for i in range(len(ddids)):
+            dd_type, oid = DataDictionaryId.unpack(ddids[i])
+            self.assertEqual(res[KEY_DD_TYPE][i], dd_type)
+            self.assertEqual(int(res[KEY_OID][i]), oid)
+        self.assertTrue(res.equals(DataDictionaryId.unpack_array([int(ddid, 16) for ddid in ddids])))
+        with self.assertRaises(ValueError):
+            DataDictionaryId.unpack_array(['2a00548d4e5abb001', 'aa00548d4e5abb002'])
+
+    def test_validate_array(self):
+        ddids = ['2a00548d4e5abb001', 'aa00548d4e5abb002', '2900616afc99d6000', '2a00548d4e5abb00']
+        self.assertEqual(DataDictionaryId.validate_array(ddids).tolist(), [True, False, False, False])
+        self.assertEqual(DataDictionaryId.validate_array([int(ddid, 16) for ddid in ddids[0:3]]).tolist(), [True, False, False])
+        self.assertEqual(DataDictionaryId.validate_array(pd.Series([ddids[0], None])).tolist(), [True, False])
+
+    def test_hash(self):
+        a = DataDictionaryId(ddid='2a00548d4e5abb001')
+        b = DataDictionaryId(ddid='2a00548d4e5abb001')
+        c = DataDictionaryId(ddid='3a00548d4e5abb001')
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len({a, b, c}), 2)
+        self.assertEqual({a: 1}[b], 1)
+
+    def test_intern(self):
+        a = DataDictionaryId.intern('2a00548d4e5abb001')
+        self.assertIs(a, DataDictionaryId.intern('2a00548d4e5abb001'))
+        self.assertEqual(a, DataDictionaryId(ddid='2a00548d4e5abb001'))
+        with self.assertRaises(TypeError):
+            DataDictionaryId.intern(['2a00548d4e5abb001'])
+
+    def test_str_cache(self):
+        a = DataDictionaryId(ddid='2A00548D4E5ABB001')
+        self.assertIs(str(a), str(a))
+        self.assertEqual(str(a), '2a00548d4e5abb001')
+        b = DataDictionaryId(dd_type=DD_TYPE_OWNER, service_code=43)
+        self.assertEqual(str(b), hex_str(b.value, DDID_LEN))
+        self.assertEqual(b.dd_type + b.oid, str(b))
+
 
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
@@ -1,5 +1,10 @@
+import os
+import json
 import unittest
-from mts.core.id import ObjectId, Service
+import threading
+import numpy as np
+import pandas as pd
+from mts.core.id import ObjectId, Service, ThreadPartitionAllocator, MonotonicAllocator
 from mts.commons.const import *
 from mts.commons import logger
 
@@ -147,6 +152,287 @@ class TestObjectId(unittest.TestCase):
         oid = ObjectId()
         self.assertEqual(Service.to_service_id(43), oid.sid)
 
+    def test_pack_many_01(self):
+        ids = ObjectId.pack_many(41, 5000)
+        self.assertEqual(ids.dtype, np.uint64)
+        self.assertEqual(len(ids), 5000)
+        self.assertEqual(len(np.unique(ids)), 5000)
+        self.assertTrue(np.all(ids[1:] > ids[:-1]))
+        for oid in ids[[0, 4095, 4096, 4999]].tolist():
+            self.assertTrue(ObjectId.validate(oid))
+            self.assertEqual(ObjectId.unpack(oid)[0], 41)
+
+    def test_pack_many_02(self):
+        last_ts = ObjectId.unpack(ObjectId.pack(41))[1] + 10
+        ObjectId._counter = (last_ts << SEQUENCE_BITS) | (SEQUENCE_MASK - 1)
+        ids = ObjectId.pack_many(41, 3, True)
+        self.assertTrue(isinstance(ids, list))
+        self.assertEqual([ObjectId.unpack(oid)[3] for oid in ids], [SEQUENCE_MASK, 0, 1])
+        self.assertEqual([ObjectId.unpack(oid)[1] for oid in ids], [last_ts, last_ts + 1, last_ts + 1])
+
+    def test_pack_threads(self):
+        res = []
+
+        def worker():
+            res.extend([ObjectId.pack(41) for i in range(2000)])
+
+        pool = [threading.Thread(target=worker) for i in range(4)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        self.assertEqual(len(set(res)), 8000)
+
+    def test_pack_many_then_pack(self):
+        # pack_many预留到后续毫秒的序列号不会被随后的pack重复分配
+        for i in range(20):
+            ids = set(ObjectId.pack_many(41, 5000).tolist())
+            for j in range(100):
+                oid = ObjectId.pack(41)
+                self.assertNotIn(oid, ids)
+                ids.add(oid)
+
+    def test_error_pack_many(self):
+        with self.assertRaises(ValueError):
+            ObjectId.pack_many(SERVICE_CODE_MAX + 1, 10)
+        with self.assertRaises(ValueError):
+            ObjectId.pack_many(41, 0)
+
+    def test_unpack_array(self):
+        oids = ['a4059507fd30cfff', 'a00616afc99d6000', str(ObjectId())]
+        res = ObjectId.unpack_array(pd.Series(oids))
+        self.assertEqual(res.columns.tolist(), [KEY_SERVICE_CODE, KEY_TIMESTAMP, KEY_PID_CODE, KEY_SEQUENCE])
+        for i in range(len(oids)):
+            self.assertEqual(tuple(res.iloc[i].tolist()), ObjectId.unpack(oids[i]))
+        values = np.array([int(oid, 16) for oid in oids], dtype=np.uint64)
+        self.assertTrue(res.equals(ObjectId.unpack_array(values)))
+        with self.assertRaises(ValueError):
+            ObjectId.unpack_array(['a4059507fd30cfff', '900616afc99d6000'])
+        with self.assertRaises(TypeError):
+            ObjectId.unpack_array([1.5, 2.5])
+
+    def test_validate_array(self):
+        oids = ['a4059507fd30cfff', '900616afc99d6000', 'a00616afc99d600', 'a00616afc99d600g', 'A00616AFC99D6000']
+        self.assertEqual(ObjectId.validate_array(oids).tolist(), [ObjectId.validate(oid) for oid in oids[0:2]] + [False, False, True])
+        self.assertEqual(ObjectId.validate_array([0xa4059507fd30cfff, 0x900616afc99d6000]).tolist(), [True, False])
+        self.assertEqual(len(ObjectId.validate_array([])), 0)
+        oids = pd.Series(['a4059507fd30cfff', None, np.nan, '900616afc99d6000'])
+        self.assertEqual(ObjectId.validate_array(oids).tolist(), [True, False, False, False])
+        self.assertEqual(ObjectId.validate_array([0xa4059507fd30cfff, None]).tolist(), [True, False])
+        self.assertEqual(ObjectId.validate_array(pd.Series([None, None])).tolist(), [False, False])
+        with self.assertRaises(ValueError):
+            ObjectId.unpack_array(oids)
+
+    def test_hash(self):
+        a = ObjectId()
+        b = ObjectId(str(a))
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len({a, b, ObjectId()}), 2)
+        index = {a: 'a'}
+        self.assertEqual(index[b], 'a')
+
+    def test_intern(self):
+        oid = str(ObjectId())
+        a = ObjectId.intern(oid)
+        self.assertIs(a, ObjectId.intern(oid))
+        self.assertIs(a, ObjectId.intern(a))
+        self.assertEqual(str(a), oid)
+        del a
+        self.assertFalse(oid in ObjectId._interned)
+
+    def test_allocator_01(self):
+        results = {}
+
+        def worker(name):
+            results[name] = [ObjectId().value for i in range(500)]
+
+        ObjectId.register({'allocator': ThreadPartitionAllocator(list(range(8)))})
+        try:
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            ObjectId.register({'allocator': None})
+        all_ids = []
+        pid_codes = set()
+        for ids in results.values():
+            self.assertEqual(ids, sorted(ids))
+            pid_codes.add((ids[0] >> PID_CODE_BITS_SHIFT) & PID_CODE_MASK)
+            all_ids.extend(ids)
+        self.assertEqual(len(set(all_ids)), len(all_ids))
+        self.assertEqual(len(pid_codes), 8)
+
+    def test_allocator_02(self):
+        ObjectId.register({'allocator': ThreadPartitionAllocator([3])})
+        try:
+            a = ObjectId(service_code=41)
+            ids = ObjectId.pack_many(41, 5000, True)
+            b = ObjectId(service_code=41)
+        finally:
+            ObjectId.register({'allocator': None})
+        self.assertTrue(a.value < ids[0] and ids[-1] < b.value)
+        self.assertEqual({(oid >> PID_CODE_BITS_SHIFT) & PID_CODE_MASK for oid in [a.value, b.value] + ids}, {3})
+
+    def test_allocator_timestamp(self):
+        allocator = MonotonicAllocator(5)
+        ObjectId.register({'allocator': allocator})
+        try:
+            ObjectId.pack(41)
+            past = moment('2021-03-01 10:00')
+            oid = ObjectId.pack(41, past)
+        finally:
+            ObjectId.register({'allocator': None})
+        # 指定的时间戳不经过分配器，不计为时钟回拨
+        self.assertEqual(ObjectId.unpack(oid)[1], ObjectId.to_ts(past))
+        self.assertEqual(allocator.stats['clock_regression'], 0)
+
+    def test_allocator_03(self):
+        # 线程轮流分配到各分区：8个线程、4个分区时每个分区由2个线程共用
+        allocator = ThreadPartitionAllocator(list(range(4)))
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def worker(name):
+            barrier.wait()
+            results[name] = [allocator.allocate(1000 + i) for i in range(200)]
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counts = {}
+        for items in results.values():
+            self.assertEqual(len(set([pid_code for pid_code, counter in items])), 1)
+            counts[items[0][0]] = counts.get(items[0][0], 0) + 1
+        self.assertEqual(counts, {0: 2, 1: 2, 2: 2, 3: 2})
+        allocated = [item for items in results.values() for item in items]
+        self.assertEqual(len(set(allocated)), len(allocated))
+        with self.assertRaises(TypeError):
+            ThreadPartitionAllocator()
+
+    @staticmethod
+    def _fork_pack(n):
+        # 在子进程中生成n个id，返回子进程生成的id（或异常类型名）
+        r, w = os.pipe()
+        pid = os.fork()
+        if 0 == pid:  # pragma: no cover
+            code = 0
+            try:
+                try:
+                    res = ObjectId.pack_many(41, n, True)
+                except ValueError as e:
+                    res = type(e).__name__
+                os.write(w, json.dumps(res).encode())
+            except Exception:
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(w)
+        with os.fdopen(r) as fin:
+            res = json.loads(fin.read())
+        os.waitpid(pid, 0)
+        return res
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork')
+    def test_allocator_fork(self):
+        # 未指定pid_code的MonotonicAllocator随进程的pid_code改变
+        ObjectId.register({'allocator': MonotonicAllocator()})
+        try:
+            ObjectId.pack(41)
+            child_ids = self._fork_pack(1000)
+            ids = ObjectId.pack_many(41, 1000, True)
+        finally:
+            ObjectId.register({'allocator': None})
+        self.assertEqual(len(child_ids), 1000)
+        self.assertEqual(set(ids) & set(child_ids), set())
+        self.assertNotEqual((ids[0] >> PID_CODE_BITS_SHIFT) & PID_CODE_MASK,
+                            (child_ids[0] >> PID_CODE_BITS_SHIFT) & PID_CODE_MASK)
+        # 指定的pid_codes不能在fork后的子进程中继续使用
+        for allocator in [ThreadPartitionAllocator([1, 2]), MonotonicAllocator(3)]:
+            ObjectId.register({'allocator': allocator})
+            try:
+                self.assertEqual(self._fork_pack(10), 'ValueError')
+                self.assertEqual(len(ObjectId.pack_many(41, 10, True)), 10)
+            finally:
+                ObjectId.register({'allocator': None})
+
+    def test_error_allocator(self):
+        with self.assertRaises(ValueError):
+            ThreadPartitionAllocator([])
+        with self.assertRaises(ValueError):
+            ThreadPartitionAllocator([1, 1])
+        with self.assertRaises(ValueError):
+            ThreadPartitionAllocator([16])
+
+    def test_from_str(self):
+        a = ObjectId()
+        counter = ObjectId._counter
+        b = ObjectId.from_str(str(a))
+        c = ObjectId.from_int(a.value)
+        d = ObjectId('a4059507fd30cfff')
+        self.assertEqual(counter, ObjectId._counter)
+        self.assertEqual(a, b)
+        self.assertEqual(a, c)
+        self.assertEqual(str(d), 'a4059507fd30cfff')
+        self.assertEqual(ObjectId.from_str('a4059507fd30cfff').sid, d.sid)
+        with self.assertRaises(ValueError):
+            ObjectId.from_str('900616afc99d6000')
+        with self.assertRaises(TypeError):
+            ObjectId.from_str(123)
+
+    def test_monotonic_allocator_01(self):
+        allocator = MonotonicAllocator(5)
+        ts = 1000
+        pid_code, start = allocator.allocate(ts, 10000)
+        self.assertEqual((pid_code, start), (5, ts << SEQUENCE_BITS))
+        self.assertEqual(allocator.stats['borrowed_ms'], 2)
+        self.assertEqual(allocator.stats['drift_ms'], 2)
+        # 真实时间进入下一毫秒，逻辑时钟已超前，不能与已分配的id重复
+        pid_code, counter = allocator.allocate(ts + 1)
+        self.assertEqual(counter, start + 10000)
+        self.assertEqual(allocator.stats['borrowed_ms'], 2)
+        # 时钟回拨
+        pid_code, counter_02 = allocator.allocate(ts - 500)
+        self.assertEqual(counter_02, counter + 1)
+        self.assertEqual(allocator.stats['clock_regression'], 1)
+        pid_code, counter_03 = allocator.allocate(ts + 10)
+        self.assertEqual(counter_03, (ts + 10) << SEQUENCE_BITS)
+        self.assertEqual(allocator.stats['drift_ms'], 0)
+
+    def test_monotonic_allocator_02(self):
+        allocator = MonotonicAllocator()
+        ObjectId.register({'allocator': allocator})
+        try:
+            ids = ObjectId.pack_many(41, 10000, True)
+            ids.extend([ObjectId(service_code=41).value for i in range(100)])
+        finally:
+            ObjectId.register({'allocator': None})
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(allocator.stats['borrowed_ms'] >= 1)
+        with self.assertRaises(ValueError):
+            MonotonicAllocator(16)
+
+    def test_min_max_for(self):
+        service_code, last_ts, pid_code, sequence = ObjectId.unpack('a4059507fd30cfff')
+        ts = ObjectId.timestamp(last_ts)
+        self.assertEqual(ObjectId.to_ts(ts), last_ts)
+        oid_min = ObjectId.min_for(ts, service_code)
+        oid_max = ObjectId.max_for(ts, service_code)
+        self.assertTrue(oid_min <= int('a4059507fd30cfff', 16) <= oid_max)
+        self.assertEqual(ObjectId.unpack(oid_min)[1:], (last_ts, 0, 0))
+        self.assertEqual(ObjectId.unpack(oid_max)[1:], (last_ts, PID_CODE_MASK, SEQUENCE_MASK))
+        with self.assertRaises(ValueError):
+            ObjectId.min_for('2019-11-21')
+
+    def test_str_cache(self):
+        a = ObjectId()
+        self.assertIs(str(a), str(a))
+        self.assertEqual(str(ObjectId('A4059507FD30CFFF')), 'a4059507fd30cfff')
+        self.assertEqual(str(ObjectId.from_int(a.value)), str(a))
+
 
 if __name__ == '__main__':
     unittest.main()  # pragma: no cover
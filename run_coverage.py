@@ -26,6 +26,7 @@ for d in dirs:
 
 test_modules = [
     'mts.test.stats.test_Jaccard',
+    'mts.test.commons.test_Hex',
     'mts.test.core.id.test_ObjectId',
     'mts.test.core.id.test_DataDictionaryId',
     'mts.test.core.id.test_Service',
@@ -36,6 +37,8 @@ test_modules = [
     'mts.test.core.datamodel.test_Tags',
     'mts.test.core.datamodel.test_TimeDataUnit',
     'mts.test.core.datamodel.test_SpaceDataUnit',
+    'mts.test.aio.handler.test_AsyncDBHandler',
+    'mts.test.aio.datamodel.test_AsyncTimeDataUnit',
     # 'mts.test.test_DataUnitService',
     # 'mts.test.test_DataDictionary',
     # 'mts.test.test_SpaceDataUnit',